@@ -1,22 +1,56 @@
 """Main entry point for the __pandarus_remote__ service."""
 
-from typing import Any, Dict, Optional
+import uuid
+from typing import Any, BinaryIO, Dict, Optional
 
-from flask import Flask
+from flask import Flask, Request
 from pandarus import __version__ as pandarus_version
 
+from .commands import (
+    evict_results_command,
+    job_stats_command,
+    migrate_storage_command,
+    pin_result_command,
+    store_bounds_command,
+    sweep_storage_command,
+)
+from .helpers import DatabaseHelper, IOHelper
 from .routes import routes_blueprint
+from .uploads import StagingFile
 from .version import __version__
 
 
+class UploadRequest(Request):
+    """Request receiving uploaded files straight into staging files in the uploads
+    directory, so they are moved to the storage instead of being copied from a
+    temporary file."""
+
+    def _get_file_stream(
+        self,
+        total_content_length: Optional[int],
+        content_type: Optional[str],
+        filename: Optional[str] = None,
+        content_length: Optional[int] = None,
+    ) -> BinaryIO:
+        return StagingFile(IOHelper().staging_file_path(uuid.uuid4().hex))
+
+
 def create_app(configs: Optional[Dict[str, Any]] = None) -> Flask:
     """Create the flask app."""
     if not configs:
         configs = {"MAX_CONTENT_LENGTH": 250 * 1024 * 1024}  # pragma: no cover
 
     pr_app = Flask("pandarus_remote")
+    pr_app.request_class = UploadRequest
     pr_app.logger.setLevel("DEBUG")
     pr_app.register_blueprint(routes_blueprint)
+    pr_app.teardown_appcontext(lambda _: DatabaseHelper.release_connection())
+    pr_app.cli.add_command(migrate_storage_command)
+    pr_app.cli.add_command(store_bounds_command)
+    pr_app.cli.add_command(evict_results_command)
+    pr_app.cli.add_command(pin_result_command)
+    pr_app.cli.add_command(job_stats_command)
+    pr_app.cli.add_command(sweep_storage_command)
     pr_app.config.update(configs)
     pr_app.logger.info(
         "Starting %s service version %s using pandarus version %s.",
@@ -0,0 +1,170 @@
+"""Cache helpers for the __pandarus_remote__ web service, mixed into the
+RedisHelper."""
+
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .models import File
+from .utils import loggable
+
+
+class CacheMixin:
+    """Mixin of the RedisHelper sharing generations and cached results between
+    processes."""
+
+    catalog_generation_key: str = "catalog_generation"
+    file_generation_key: str = "file_generation"
+    result_accesses_key: str = "result_accesses"
+    result_cache_ttl: int = 24 * 60 * 60
+
+    def get_generation(self, key: str) -> int:
+        """Return the generation stored at key, shared by all web workers. A missing
+        generation, e.g. after redis was flushed, starts at a random value so it
+        doesn't match generations cached before."""
+        generation = self.queue.connection.get(key)
+        if generation is None:
+            self.queue.connection.set(key, uuid.uuid4().int >> 80, nx=True)
+            generation = self.queue.connection.get(key)
+        return int(generation)
+
+    @property
+    def catalog_generation(self) -> int:
+        """Return the catalog generation, see get_generation."""
+        return self.get_generation(self.catalog_generation_key)
+
+    @loggable
+    def bump_catalog_generation(self) -> int:
+        """Increment the catalog generation after files or results were added or
+        deleted, so cached catalogs are rebuilt. Returns the new generation."""
+        return self.queue.connection.incr(self.catalog_generation_key)
+
+    @property
+    def file_generation(self) -> int:
+        """Return the file generation, see get_generation."""
+        return self.get_generation(self.file_generation_key)
+
+    @loggable
+    def bump_file_generation(self) -> int:
+        """Increment the file generation after files were updated or deleted, so the
+        file caches of all processes are cleared. Returns the new generation."""
+        return self.queue.connection.incr(self.file_generation_key)
+
+    def result_cache_key(
+        self, result_type: str, first_sha256: str, second_sha256: str
+    ) -> str:
+        """Return the key of a result in the result cache."""
+        return f"result:{result_type}:{first_sha256}:{second_sha256}"
+
+    def get_cached_result(
+        self, result_type: str, first_sha256: str, second_sha256: str
+    ) -> Optional[Dict[str, str]]:
+        """Return the cached file path, content hash and size of a result, or None if
+        it isn't cached."""
+        cached = self.queue.connection.hgetall(
+            self.result_cache_key(result_type, first_sha256, second_sha256)
+        )
+        if not cached:
+            return None
+        return {field.decode(): value.decode() for field, value in cached.items()}
+
+    def record_result_access(
+        self, result_type: str, first_sha256: str, second_sha256: str
+    ) -> None:
+        """Record the access time of a result read from the result cache, see
+        pop_result_accesses."""
+        self.queue.connection.hset(
+            self.result_accesses_key,
+            self.result_cache_key(result_type, first_sha256, second_sha256),
+            time.time(),
+        )
+
+    def cache_result(
+        self,
+        result_type: str,
+        first_sha256: str,
+        second_sha256: str,
+        entry: Dict[str, Any],
+    ) -> None:
+        """Cache the file path, content hash and size of a result for
+        result_cache_ttl seconds."""
+        key = self.result_cache_key(result_type, first_sha256, second_sha256)
+        pipeline = self.queue.connection.pipeline()
+        pipeline.hset(key, mapping=entry)
+        pipeline.expire(key, self.result_cache_ttl)
+        pipeline.execute()
+
+    def invalidate_results(self, results: Iterable[Tuple[str, str, str]]) -> None:
+        """Drop results, given by their type and the hashes of their first and
+        second files, from the result cache."""
+        keys = [self.result_cache_key(*result) for result in results]
+        if keys:
+            self.queue.connection.delete(*keys)
+
+    def pop_result_accesses(self) -> List[Tuple[Tuple[str, str, str], float]]:
+        """Return and clear the recorded access times of cached results, with the
+        type and the hashes of the first and second files of each result."""
+        pipeline = self.queue.connection.pipeline()
+        pipeline.hgetall(self.result_accesses_key)
+        pipeline.delete(self.result_accesses_key)
+        accesses = pipeline.execute()[0]
+        return [
+            (tuple(key.decode().split(":")[1:]), float(accessed))
+            for key, accessed in accesses.items()
+        ]
+
+
+class FileCacheMixin:
+    """Mixin of the DatabaseHelper caching Files in memory."""
+
+    file_cache_size: int = 1024
+    file_cache_hits: int = 0
+    file_cache_misses: int = 0
+
+    def cached_files(self, sha256s: Iterable[str]) -> Dict[str, File]:
+        """Return the Files of sha256s found in the file cache by sha256, counting
+        hits and misses. The cache is cleared first if the file generation changed,
+        after files were updated or deleted by any process."""
+        generation = self.redis_helper.file_generation
+        files = {}
+        with self._file_cache_lock:
+            if generation != self._file_cache_generation:
+                self._file_cache.clear()
+                self._file_cache_generation = generation
+            for sha256 in sha256s:
+                file = self._file_cache.get(sha256)
+                if file is None:
+                    self.file_cache_misses += 1
+                    continue
+                self._file_cache.move_to_end(sha256)
+                self.file_cache_hits += 1
+                files[sha256] = file
+        return files
+
+    def cache_files(self, files: Iterable[File]) -> None:
+        """Add copies of files to the file cache, dropping the least recently used
+        Files beyond file_cache_size."""
+        with self._file_cache_lock:
+            for file in files:
+                self._file_cache[file.sha256] = File(**file.__data__)
+                self._file_cache.move_to_end(file.sha256)
+            while len(self._file_cache) > self.file_cache_size:
+                self._file_cache.popitem(last=False)
+
+    @loggable
+    def invalidate_file_cache(self) -> None:
+        """Clear the file cache of this process and bump the file generation, so the
+        caches of other processes are cleared on their next lookup. Must be called
+        whenever File entries are updated or deleted."""
+        with self._file_cache_lock:
+            self._file_cache.clear()
+        self.redis_helper.bump_file_generation()
+
+    @property
+    def file_cache_stats(self) -> Dict[str, int]:
+        """Return the size, hits and misses of the file cache of this process."""
+        return {
+            "size": len(self._file_cache),
+            "hits": self.file_cache_hits,
+            "misses": self.file_cache_misses,
+        }
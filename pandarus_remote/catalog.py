@@ -0,0 +1,247 @@
+"""Catalog helpers for the __pandarus_remote__ web service, mixed into the
+DatabaseHelper."""
+
+import hashlib
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from peewee import fn
+
+from .errors import InvalidCatalogQueryError
+from .models import BaseModel, CatalogChange, File, Intersection, RasterStats, Remaining
+from .utils import loggable
+
+
+class CatalogMixin:
+    """Mixin of the DatabaseHelper querying the catalog and its changes."""
+
+    catalog_sections: List[str] = [
+        "files",
+        "intersections",
+        "remainings",
+        "raster_stats",
+    ]
+
+    @property
+    def files(self) -> List[Dict[str, str]]:
+        """Return a list of files."""
+        return self.query_catalog_section("files")[0]
+
+    @property
+    def intersections(self) -> List[Dict[str, str]]:
+        """Return a list of intersections."""
+        return self.query_catalog_section("intersections")[0]
+
+    @property
+    def remaining(self) -> List[Dict[str, str]]:
+        """Return a list of remaining."""
+        return self.query_catalog_section("remainings")[0]
+
+    @property
+    def raster_stats(self) -> List[Dict[str, str]]:
+        """Return a list of raster_stats."""
+        return self.query_catalog_section("raster_stats")[0]
+
+    @property
+    def catalog(self) -> Dict[str, List[Dict[str, str]]]:
+        """Return a catalog of all files, intersections, remaining, and raster_stats."""
+        return {
+            "files": self.files,
+            "intersections": self.intersections,
+            "remainings": self.remaining,
+            "raster_stats": self.raster_stats,
+        }
+
+    def serialized_catalog(self, generation: int) -> Tuple[bytes, str, int]:
+        """Return the catalog serialized as JSON, its hash and the change sequence it
+        is up to date with, cached in memory until the catalog generation changes.
+        The catalog is read after generation and the change sequence, so a cached
+        catalog is never older than either."""
+        if self._catalog_cache is None or self._catalog_cache[0] != generation:
+            change_sequence = self.catalog_change_sequence
+            content = json.dumps(self.catalog).encode("utf-8")
+            self._catalog_cache = (
+                generation,
+                content,
+                hashlib.sha256(content).hexdigest(),
+                change_sequence,
+            )
+        return self._catalog_cache[1:]
+
+    @property
+    def catalog_change_sequence(self) -> int:
+        """Return the sequence of the last catalog change, or 0 if there is none."""
+        return CatalogChange.select(fn.MAX(CatalogChange.id)).scalar(None) or 0
+
+    def catalog_entry(self, obj: BaseModel) -> Tuple[str, Dict[str, str]]:
+        """Return the catalog section of a file or result and its catalog entry."""
+        if isinstance(obj, File):
+            return "files", {"name": obj.name, "kind": obj.kind, "sha256": obj.sha256}
+        if isinstance(obj, RasterStats):
+            return "raster_stats", {
+                "vector_sha256": obj.vector_file.sha256,
+                "raster_sha256": obj.raster_file.sha256,
+            }
+        intersection = obj if isinstance(obj, Intersection) else obj.intersection
+        return "intersections" if obj is intersection else "remainings", {
+            "first_file_sha256": intersection.first_file.sha256,
+            "second_file_sha256": intersection.second_file.sha256,
+        }
+
+    def backfill_catalog_changes(self) -> None:
+        """Record the entries of a catalog created by older versions as added, so
+        syncing from the start of the catalog changes returns the whole catalog."""
+        for section in self.catalog_sections:
+            self._insert_batches(
+                CatalogChange,
+                (
+                    {"section": section, "action": "added", "entry": json.dumps(entry)}
+                    for entry in self.query_catalog_section(section)[0]
+                ),
+            )
+
+    @loggable
+    def catalog_changes(self, since: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """Return up to limit catalog changes after the change sequence since, oldest
+        first, with the sequence of the last returned change as ``next_cursor`` and
+        whether there are more changes."""
+        changes = [
+            {
+                "cursor": change.id,
+                "type": change.section,
+                "action": change.action,
+                "entry": json.loads(change.entry),
+            }
+            for change in CatalogChange.select()
+            .where(CatalogChange.id > since)
+            .order_by(CatalogChange.id)
+            .limit(limit + 1)
+        ]
+        page = changes[:limit]
+        return {
+            "changes": page,
+            "next_cursor": page[-1]["cursor"] if page else since,
+            "has_more": len(changes) > limit,
+        }
+
+    @loggable
+    def query_catalog(
+        self,
+        section: Optional[str] = None,
+        kind: Optional[str] = None,
+        sha256: Optional[str] = None,
+        cursor: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Return the catalog section, one of catalog_sections, or all sections if
+        section is None, filtered by kind and sha256 (see query_catalog_section). A
+        section is paginated with cursor and limit and returned with the
+        ``next_cursor`` of the following page. Raises InvalidCatalogQueryError if
+        section is unknown or a page of all sections is requested."""
+        if section is None:
+            if cursor is not None or limit is not None:
+                raise InvalidCatalogQueryError("limit", "requires a type")
+            return {
+                section: self.query_catalog_section(section, kind, sha256)[0]
+                for section in self.catalog_sections
+            }
+        if section not in self.catalog_sections:
+            raise InvalidCatalogQueryError(
+                "type", f"must be one of {self.catalog_sections}"
+            )
+        entries, next_cursor = self.query_catalog_section(
+            section, kind, sha256, cursor, limit
+        )
+        return {section: entries, "next_cursor": next_cursor}
+
+    def query_catalog_section(
+        self,
+        section: str,
+        kind: Optional[str] = None,
+        sha256: Optional[str] = None,
+        cursor: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, str]], Optional[int]]:
+        """Return the entries of a catalog section after cursor, up to limit, and the
+        cursor of the next page, or None if it is the last one. The hashes of result
+        entries are selected with a single join. Files are filtered by kind and
+        sha256, results by the sha256 of either of their files. Entries whose file is
+        missing are left out."""
+        first_file, second_file = File.alias(), File.alias()
+        if section == "files":
+            model = File
+            query = File.select(File.id, File.name, File.kind, File.sha256)
+            if kind is not None:
+                query = query.where(File.kind == kind)
+            if sha256 is not None:
+                query = query.where(File.sha256 == sha256)
+        else:
+            if section == "raster_stats":
+                model = RasterStats
+                query = (
+                    RasterStats.select(
+                        RasterStats.id,
+                        first_file.sha256.alias("vector_sha256"),
+                        second_file.sha256.alias("raster_sha256"),
+                    )
+                    .join(first_file, on=RasterStats.vector_file == first_file.id)
+                    .switch(RasterStats)
+                    .join(second_file, on=RasterStats.raster_file == second_file.id)
+                )
+            else:
+                model = Intersection if section == "intersections" else Remaining
+                query = model.select(
+                    model.id,
+                    first_file.sha256.alias("first_file_sha256"),
+                    second_file.sha256.alias("second_file_sha256"),
+                )
+                if model is Remaining:
+                    query = query.join(Intersection)
+                query = (
+                    query.join(first_file, on=Intersection.first_file == first_file.id)
+                    .switch(Intersection)
+                    .join(second_file, on=Intersection.second_file == second_file.id)
+                )
+            if sha256 is not None:
+                query = query.where(
+                    (first_file.sha256 == sha256) | (second_file.sha256 == sha256)
+                )
+        query = query.where(~model.missing)
+        if cursor is not None:
+            query = query.where(model.id > cursor)
+        query = query.order_by(model.id)
+        if limit is not None:
+            query = query.limit(limit + 1)
+
+        entries = list(query.dicts())
+        next_cursor = None
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = entries[-1]["id"]
+        for entry in entries:
+            del entry["id"]
+        return entries, next_cursor
+
+    @loggable
+    def record_catalog_changes(self, action: str, objs: Iterable[BaseModel]) -> None:
+        """Append the files or results added to or removed from the catalog, action
+        being ``added`` or ``removed``, to the catalog changes. Record them in the
+        transaction changing the catalog and call invalidate_catalog once it is
+        committed."""
+        changes = []
+        for obj in objs:
+            section, entry = self.catalog_entry(obj)
+            changes.append(
+                {"section": section, "action": action, "entry": json.dumps(entry)}
+            )
+        self._insert_batches(CatalogChange, changes)
+
+    def invalidate_catalog(self, objs: Iterable[BaseModel]) -> None:
+        """Bump the catalog generation and drop the results of objs from the result
+        cache, after the transaction changing the catalog is committed, so readers
+        don't cache the catalog or results as they were before it under the new
+        generation."""
+        self.redis_helper.invalidate_results(
+            [self.result_key(obj) for obj in objs if not isinstance(obj, File)]
+        )
+        self.redis_helper.bump_catalog_generation()
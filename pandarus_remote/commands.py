@@ -0,0 +1,80 @@
+"""Command line commands for the __pandarus_remote__ web service."""
+
+from typing import Optional
+
+import click
+
+from .helpers import DatabaseHelper, IOHelper, RedisHelper
+
+
+@click.command("migrate-storage")
+def migrate_storage_command() -> None:
+    """Move uploads and results to the content-addressed storage layout."""
+    migrated = DatabaseHelper().migrate_storage()
+    click.echo(f"Migrated {migrated} file(s) to the content-addressed storage layout.")
+
+
+@click.command("store-bounds")
+def store_bounds_command() -> None:
+    """Store the bounds index of vector files uploaded by older versions."""
+    stored = DatabaseHelper().store_missing_bounds()
+    click.echo(f"Stored the bounds index of {stored} vector file(s).")
+
+
+@click.command("evict-results")
+@click.option("--budget", type=int, help="Storage budget in bytes.")
+def evict_results_command(budget: Optional[int]) -> None:
+    """Evict the least recently accessed results over the storage budget."""
+    budget = IOHelper().storage_budget if budget is None else budget
+    if budget is None:
+        raise click.UsageError("Set PANDARUS_STORAGE_BUDGET or pass --budget.")
+    evicted = DatabaseHelper().evict_results(budget)
+    click.echo(f"Evicted {evicted} result(s).")
+
+
+@click.command("pin-result")
+@click.argument("result_type", type=click.Choice(DatabaseHelper.result_types))
+@click.argument("first")
+@click.argument("second")
+@click.option("--unpin", is_flag=True, help="Allow the result to be evicted again.")
+def pin_result_command(result_type: str, first: str, second: str, unpin: bool) -> None:
+    """Pin a result, so it is never evicted."""
+    DatabaseHelper().pin_result(result_type, first, second, pinned=not unpin)
+    click.echo(f"{'Unpinned' if unpin else 'Pinned'} the {result_type} result.")
+
+
+@click.command("sweep-storage")
+@click.option(
+    "--grace-period",
+    type=float,
+    default=24 * 60 * 60,
+    show_default=True,
+    help="Seconds since their last change files are kept for.",
+)
+@click.option("--dry-run", is_flag=True, help="Only report, don't delete or flag.")
+@click.option("--enqueue", is_flag=True, help="Run the sweep as a background job.")
+def sweep_storage_command(grace_period: float, dry_run: bool, enqueue: bool) -> None:
+    """Delete orphaned files and flag entries whose files are missing."""
+    if enqueue:
+        job = RedisHelper().enqueue_sweep_job(
+            grace_period=grace_period, dry_run=dry_run
+        )
+        click.echo(f"Enqueued the sweep job {job.id}.")
+        return
+    swept = DatabaseHelper().sweep_storage(grace_period, dry_run)
+    click.echo(
+        f"Found {swept['orphaned_files']} orphaned file(s), "
+        f"{swept['missing_entries']} entry(ies) with missing files and "
+        f"{swept['expired_uploads']} expired upload(s)."
+    )
+
+
+@click.command("job-stats")
+@click.option("--compact", is_flag=True, help="Remove expired and legacy job entries.")
+def job_stats_command(compact: bool) -> None:
+    """Show the number of jobs kept in redis, to monitor its memory."""
+    if compact:
+        legacy_job_ids = RedisHelper().compact_jobs()
+        click.echo(f"Deleted {legacy_job_ids} legacy job id(s).")
+    for status, count in RedisHelper().job_stats.items():
+        click.echo(f"{status}: {count}")
@@ -32,6 +32,50 @@ class ResultAlreadyExistsError(PandarusRemoteError):
         super().__init__(f"Result already exists for hash(es): {entries_sha256}.")
 
 
+class InvalidResultTypeError(PandarusRemoteError):
+    """Raised when a result of an unknown type is requested."""
+
+    def __init__(self, result_type: str, result_types: List[str]) -> None:
+        """Initialize the error."""
+        super().__init__(
+            f"Invalid result type: {result_type}, must be one of {result_types}."
+        )
+
+
+class InvalidResultFormatError(PandarusRemoteError):
+    """Raised when a result is requested in an unknown format."""
+
+    def __init__(self, result_format: str, result_formats: List[str]) -> None:
+        """Initialize the error."""
+        super().__init__(
+            f"Invalid result format: {result_format}, must be one of {result_formats}."
+        )
+
+
+class ResultFormatNotFoundError(PandarusRemoteError):
+    """Raised when a result is not stored in the requested format."""
+
+    def __init__(self, result_format: str) -> None:
+        """Initialize the error."""
+        super().__init__(f"Result is not available in format: {result_format}.")
+
+
+class ResultMissingError(PandarusRemoteError):
+    """Raised when the file of a result was found missing by the storage sweep."""
+
+    def __init__(self, entries_sha256: List[str]) -> None:
+        """Initialize the error."""
+        super().__init__(f"Result file is missing for hash(es): {entries_sha256}.")
+
+
+class InvalidCatalogQueryError(PandarusRemoteError):
+    """Raised when the catalog is queried with an invalid parameter."""
+
+    def __init__(self, parameter: str, reason: str) -> None:
+        """Initialize the error."""
+        super().__init__(f"Invalid catalog parameter: {parameter}, {reason}.")
+
+
 class InvalidSpatialDatasetError(PandarusRemoteError):
     """Raised when a spatial dataset is not valid."""
 
@@ -56,6 +100,30 @@ class FileAlreadyExistsError(PandarusRemoteError):
         super().__init__(f"File: {file_name} already exists.")
 
 
+class UploadNotFoundError(PandarusRemoteError):
+    """Raised when a resumable upload is not found."""
+
+    def __init__(self, upload_id: str) -> None:
+        """Initialize the error."""
+        super().__init__(f"Upload {upload_id} not found.")
+
+
+class InvalidChunkError(PandarusRemoteError):
+    """Raised when a chunk of a resumable upload is invalid."""
+
+    def __init__(self, upload_id: str, index: int, reason: str) -> None:
+        """Initialize the error."""
+        super().__init__(f"Invalid chunk {index} for upload {upload_id}: {reason}.")
+
+
+class IncompleteUploadError(PandarusRemoteError):
+    """Raised when a resumable upload is finalized with missing chunks."""
+
+    def __init__(self, upload_id: str, missing_chunks: List[int]) -> None:
+        """Initialize the error."""
+        super().__init__(f"Upload {upload_id} is missing chunk(s): {missing_chunks}.")
+
+
 class IntersectionWithSelfError(PandarusRemoteError):
     """Raised when an intersection is attempted with the same file."""
 
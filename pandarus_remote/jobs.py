@@ -0,0 +1,173 @@
+"""Job helpers for the __pandarus_remote__ web service, mixed into the
+RedisHelper."""
+
+import datetime
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from redis import WatchError
+from rq.job import Job
+from rq.registry import clean_registries
+from rq.results import Result
+
+from .errors import JobNotFoundError
+from .models import BaseModel, File
+from .utils import loggable
+
+
+class JobQueueMixin:
+    """Mixin of the RedisHelper enqueueing jobs once per computation."""
+
+    job_ids_set_name: str = "job_ids_set"
+    job_result_ttl: int = 24 * 60 * 60
+    job_failure_ttl: int = 7 * 24 * 60 * 60
+    active_job_statuses: Tuple[str, ...] = (
+        "queued",
+        "started",
+        "deferred",
+        "scheduled",
+    )
+
+    @loggable
+    def get_job_status(self, job_id: str) -> Dict[str, str]:
+        """Return the status of a job. Raises `JobNotFoundError` if job is not found."""
+        job = self.queue.fetch_job(job_id)
+        if job is not None:
+            return {"status": job.get_status(), "result": job.return_value()}
+        raise JobNotFoundError(job_id)
+
+    @loggable
+    def create_task_identifier(
+        self, func: Callable, *args: Tuple[Any], **kwargs: Dict[str, Any]
+    ) -> str:
+        """Creates a task identifier from the name of func and its arguments, files
+        being identified by their hash and other entries by their id."""
+        arguments = [self.task_argument(arg) for arg in args]
+        arguments.extend(
+            f"{key}={self.task_argument(value)}"
+            for key, value in sorted(kwargs.items())
+        )
+        return ":".join([func.__name__, *arguments])
+
+    def task_argument(self, arg: Any) -> str:
+        """Return the identity of a task argument, see create_task_identifier."""
+        if isinstance(arg, File):
+            return arg.sha256
+        if isinstance(arg, BaseModel):
+            return f"{type(arg).__name__.lower()}-{arg.id}"
+        return "" if arg is None else str(arg)
+
+    def create_job_id(self, func: Callable, identifier: str) -> str:
+        """Return the job id of the task identifier of func, the same for every
+        enqueue of the same computation."""
+        return f"{func.__name__}-{hashlib.sha256(identifier.encode()).hexdigest()}"
+
+    @loggable
+    def enqueue_task(
+        self, func: Callable, *args: Tuple[Any], **kwargs: Dict[str, Any]
+    ) -> Job:
+        """Enqueues a task unless a job for the same computation is already waiting
+        or running, and returns that job instead. Jobs have a deterministic id, see
+        create_job_id, and are enqueued with enqueue_job. Failed, finished or expired
+        jobs are replaced, with their results. The job itself is the deduplication
+        entry, expiring job_result_ttl seconds after it finished or job_failure_ttl
+        after it failed."""
+        job_id = self.create_job_id(
+            func, self.create_task_identifier(func, *args, **kwargs)
+        )
+        return self.enqueue_job(
+            func,
+            args,
+            kwargs,
+            job_ids=[job_id],
+            reusable_statuses=self.active_job_statuses,
+        )
+
+    def enqueue_job(
+        self,
+        func: Callable,
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+        *,
+        job_ids: List[str],
+        reusable_statuses: Tuple[str, ...],
+        delay: Optional[float] = None,
+    ) -> Job:
+        """Enqueues func under the first of job_ids whose job isn't running, to run
+        after delay seconds if given, unless the job of one of job_ids has a status in
+        reusable_statuses, and returns that job instead. The jobs are checked and
+        enqueued in a redis transaction watching them, so concurrent requests enqueue
+        exactly one job. The replaced job leaves the failed and finished registries."""
+        job_keys = [Job.key_for(job_id) for job_id in job_ids]
+        with self.queue.connection.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(*job_keys)
+                    statuses = [
+                        (pipeline.hget(job_key, "status") or b"").decode("utf-8")
+                        for job_key in job_keys
+                    ]
+                    reusable_ids = [
+                        job_id
+                        for job_id, status in zip(job_ids, statuses)
+                        if status in reusable_statuses
+                    ]
+                    replaced_ids = [
+                        job_id
+                        for job_id, status in zip(job_ids, statuses)
+                        if status != "started"
+                    ]
+                    if reusable_ids or not replaced_ids:
+                        pipeline.unwatch()
+                        return self.queue.fetch_job((reusable_ids or job_ids)[0])
+                    job_id = replaced_ids[0]
+                    pipeline.multi()
+                    # The job hash would keep the fields and the expiry of the
+                    # replaced job, the new job starts from scratch
+                    pipeline.delete(Job.key_for(job_id), Result.get_key(job_id))
+                    options = {
+                        "result_ttl": self.job_result_ttl,
+                        "failure_ttl": self.job_failure_ttl,
+                        "job_id": job_id,
+                        "pipeline": pipeline,
+                    }
+                    if delay is None:
+                        job = self.queue.enqueue_call(func, args, kwargs, **options)
+                    else:
+                        job = self.queue.enqueue_in(
+                            datetime.timedelta(seconds=delay),
+                            func,
+                            *args,
+                            **options,
+                            **kwargs,
+                        )
+                    self.queue.failed_job_registry.remove(job_id, pipeline=pipeline)
+                    self.queue.finished_job_registry.remove(job_id, pipeline=pipeline)
+                    pipeline.execute()
+                    return job
+                except WatchError:
+                    continue
+
+    @property
+    def job_stats(self) -> Dict[str, int]:
+        """Return the number of jobs per status kept in redis, and the number of
+        entries left in the job ids hash written by earlier versions."""
+        return {
+            "queued": self.queue.count,
+            "started": self.queue.started_job_registry.count,
+            "deferred": self.queue.deferred_job_registry.count,
+            "scheduled": self.queue.scheduled_job_registry.count,
+            "finished": self.queue.finished_job_registry.count,
+            "failed": self.queue.failed_job_registry.count,
+            "legacy_job_ids": self.queue.connection.hlen(self.job_ids_set_name),
+        }
+
+    @loggable
+    def compact_jobs(self) -> int:
+        """Remove expired jobs from the job registries and delete the job ids hash
+        written by earlier versions, which was never pruned. Returns the number of
+        entries deleted from that hash."""
+        clean_registries(self.queue)
+        legacy_job_ids = self.queue.connection.hlen(self.job_ids_set_name)
+        self.queue.connection.unlink(self.job_ids_set_name)
+        return legacy_job_ids
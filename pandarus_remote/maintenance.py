@@ -0,0 +1,353 @@
+"""Maintenance helpers for the __pandarus_remote__ web service, mixed into the
+DatabaseHelper."""
+
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from playhouse.migrate import SchemaMigrator, migrate
+
+from .models import (
+    BaseModel,
+    File,
+    Intersection,
+    RasterStats,
+    ReferencedPath,
+    Remaining,
+    ResultModel,
+    StoredPath,
+    Upload,
+)
+from .utils import loggable
+
+
+class MaintenanceMixin:
+    """Mixin of the DatabaseHelper migrating, evicting and sweeping the storage."""
+
+    @loggable
+    def evict_results(self, budget: int) -> int:
+        """Delete the least recently accessed results which aren't pinned, with their
+        files, until the storage directories use at most budget bytes, by the running
+        storage usage while a storage budget is set. Uploads are never deleted and
+        evicted results can be calculated again. Returns the number of evicted
+        results."""
+        io_helper = self.io_helper
+        usage = (
+            io_helper.storage_usage()
+            if io_helper.storage_budget is None
+            else self.redis_helper.storage_usage
+        )
+        if usage <= budget:
+            return 0
+
+        self.apply_result_accesses()
+
+        # Results never accessed since older versions sort first
+        candidates = heapq.merge(
+            *(
+                [
+                    (last_accessed or datetime.datetime.min, model, result_id)
+                    for result_id, last_accessed in model.select(
+                        model.id, model.last_accessed
+                    )
+                    .where(~model.pinned)
+                    .order_by(model.last_accessed, model.id)
+                    .tuples()
+                ]
+                for model in (Intersection, RasterStats, Remaining)
+            ),
+            key=lambda candidate: candidate[0],
+        )
+        evicted = 0
+        for _, model, result_id in candidates:
+            if usage <= budget:
+                break
+            result = model.get_or_none(model.id == result_id)
+            if result is None or (
+                isinstance(result, Intersection)
+                and Remaining.select()
+                .where((Remaining.intersection == result) & Remaining.pinned)
+                .exists()
+            ):
+                continue
+            usage -= self.evict_result(result)
+            evicted += 1
+        return evicted
+
+    @loggable
+    def evict_result(self, result: ResultModel) -> int:
+        """Delete a result, with the remaining of an intersection, and its files
+        unless another result shares them. The vector file of an intersection is
+        kept, it is also the upload of the new spatial scale. Returns the number of
+        bytes freed."""
+        freed = 0
+        if isinstance(result, Intersection):
+            remaining = Remaining.get_or_none(Remaining.intersection == result)
+            if remaining is not None:
+                freed += self.evict_result(remaining)
+
+        model = type(result)
+        path_field = (
+            RasterStats.output_file_path
+            if isinstance(result, RasterStats)
+            else model.data_file_path
+        )
+        file_path = getattr(result, path_field.name)
+        with self.atomic:
+            self.record_catalog_changes("removed", [result])
+            result.delete_instance()
+        self.invalidate_catalog([result])
+        if not model.select().where(path_field == file_path).exists():
+            freed += self.io_helper.delete_result(file_path)
+        return freed
+
+    def migrate_schema(self, models: List[BaseModel]) -> None:
+        """Add the columns of models missing from the tables created by older versions,
+        they are nullable or have a default."""
+        # pylint: disable=protected-access
+        migrator = SchemaMigrator.from_database(self._database)
+        for model in models:
+            table_name = model._meta.table_name
+            columns = {column.name for column in self._database.get_columns(table_name)}
+            operations = [
+                migrator.add_column(table_name, field.column_name, field)
+                for field in model._meta.sorted_fields
+                if field.column_name not in columns
+            ]
+            if operations:
+                migrate(*operations)
+
+    @loggable
+    def migrate_storage(self) -> int:
+        """Move the files of all database entries from the flat directories of older
+        versions to the content-addressed storage layout. Files shared by several
+        entries are moved once, files of other directories are hard linked and missing
+        files are skipped. Returns the number of migrated paths."""
+        io_helper = self.io_helper
+        migrated_paths: Dict[Tuple[str, Path], Path] = {}
+        for model, fields, directory in (
+            (File, [File.file_path], io_helper.uploads_dir),
+            (
+                Intersection,
+                [Intersection.data_file_path, Intersection.vector_file_path],
+                io_helper.intersections_dir,
+            ),
+            (RasterStats, [RasterStats.output_file_path], io_helper.raster_stats_dir),
+            (Remaining, [Remaining.data_file_path], io_helper.remaining_dir),
+        ):
+            for obj in model.select().iterator():
+                for field in fields:
+                    old_path = getattr(obj, field.name)
+                    new_path = migrated_paths.get((old_path, directory))
+                    if new_path is None:
+                        if io_helper.is_stored(old_path, directory) or not (
+                            Path(old_path).exists()
+                        ):
+                            continue
+                        if Path(old_path).parent == directory:
+                            new_path = io_helper.store_file(old_path, directory)
+                        else:
+                            new_path = io_helper.link_file(old_path, directory)
+                        migrated_paths[(old_path, directory)] = new_path
+                    model.update({field: str(new_path)}).where(
+                        model.id == obj.id
+                    ).execute()
+        self.invalidate_file_cache()
+        return len(migrated_paths)
+
+    @loggable
+    def store_missing_bounds(self) -> int:
+        """Store the bounds index of vector files uploaded by older versions. Returns
+        the number of stored bounds indexes."""
+        io_helper = self.io_helper
+        stored = 0
+        for file in File.select().where(File.kind == "vector").iterator():
+            if io_helper.bounds_path(file.dataset_path).exists() or not (
+                Path(file.dataset_path).exists()
+            ):
+                continue
+            if io_helper.store_bounds(file.dataset_path) is not None:
+                stored += 1
+        return stored
+
+    @loggable
+    def sweep_storage(
+        self, grace_period: float = 24 * 60 * 60, dry_run: bool = False
+    ) -> Dict[str, int]:
+        """Delete the files of the storage directories no database entry references,
+        and which aren't derived from a referenced file, and flag the entries whose
+        files are missing as ``missing``. Flagged entries leave the catalog and are
+        recorded as removed catalog changes, and as added again once their files are
+        back. Files modified within grace_period seconds
+        are kept, they may belong to an upload or a task which didn't commit its entry
+        yet. The disk and the database are indexed in batches into temporary tables,
+        so they are never held in memory. Resumable uploads started more than
+        ``upload_ttl`` seconds ago are expired, with their staging files. If dry_run
+        is True, nothing is deleted or flagged. Returns the number of orphaned files,
+        missing entries and expired uploads."""
+        io_helper = self.io_helper
+        expired_uploads = Upload.select().where(
+            Upload.created_at.is_null()
+            | (
+                Upload.created_at
+                < datetime.datetime.now()
+                - datetime.timedelta(seconds=io_helper.upload_ttl)
+            )
+        )
+        expired_uploads = list(expired_uploads)
+        if not dry_run:
+            for upload in expired_uploads:
+                logging.warning("Expired upload %s.", upload.id)
+                Path(upload.staging_file_path).unlink(missing_ok=True)
+                self.delete_upload(upload)
+        temporary_models = [StoredPath, ReferencedPath]
+        self._database.bind(temporary_models)
+        self._database.create_tables(temporary_models, temporary=True)
+        try:
+            for directory in io_helper.storage_dirs:
+                self._insert_batches(
+                    StoredPath,
+                    (
+                        {
+                            "path": entry.path,
+                            "mtime": entry.stat(follow_symlinks=False).st_mtime,
+                        }
+                        for entry in io_helper.iter_files(directory)
+                    ),
+                )
+            for model, fields in (
+                (File, [File.file_path, File.canonical_file_path]),
+                (
+                    Intersection,
+                    [Intersection.data_file_path, Intersection.vector_file_path],
+                ),
+                (RasterStats, [RasterStats.output_file_path]),
+                (Remaining, [Remaining.data_file_path]),
+                (Upload, [Upload.staging_file_path]),
+            ):
+                self._insert_batches(
+                    ReferencedPath,
+                    (
+                        {
+                            "path": str(path),
+                            "model": model.__name__,
+                            "entry_id": entry_id,
+                            "derived": derived,
+                        }
+                        for entry_id, *paths in model.select(model.id, *fields)
+                        .tuples()
+                        .iterator()
+                        for referenced_path in paths
+                        if referenced_path is not None
+                        for path, derived in (
+                            (referenced_path, False),
+                            *(
+                                (derived_path, True)
+                                for derived_path in io_helper.derived_paths(
+                                    referenced_path
+                                )
+                            ),
+                        )
+                    ),
+                )
+
+            orphaned_files = 0
+            for stored_path in (
+                StoredPath.select(StoredPath.path)
+                .where(
+                    (StoredPath.mtime < time.time() - grace_period)
+                    & StoredPath.path.not_in(ReferencedPath.select(ReferencedPath.path))
+                )
+                .iterator()
+            ):
+                logging.warning("Orphaned file %s.", stored_path.path)
+                if not dry_run:
+                    Path(stored_path.path).unlink(missing_ok=True)
+                orphaned_files += 1
+
+            missing_ids: Dict[str, set] = {}
+            for referenced_path in (
+                ReferencedPath.select()
+                .where(
+                    ~ReferencedPath.derived
+                    & ReferencedPath.path.not_in(StoredPath.select(StoredPath.path))
+                )
+                .iterator()
+            ):
+                # Paths outside of the storage directories weren't indexed
+                if Path(referenced_path.path).exists():
+                    continue
+                logging.warning(
+                    "Missing file %s of %s %s.",
+                    referenced_path.path,
+                    referenced_path.model,
+                    referenced_path.entry_id,
+                )
+                missing_ids.setdefault(referenced_path.model, set()).add(
+                    referenced_path.entry_id
+                )
+        finally:
+            self._database.drop_tables(temporary_models)
+
+        if not dry_run:
+            self._flag_missing_entries(missing_ids)
+            self.invalidate_file_cache()
+            self.redis_helper.reset_storage_usage()
+        return {
+            "orphaned_files": orphaned_files,
+            "missing_entries": sum(len(ids) for ids in missing_ids.values()),
+            "expired_uploads": len(expired_uploads),
+        }
+
+    def _flag_missing_entries(self, missing_ids: Dict[str, set]) -> None:
+        """Flag the entries with missing_ids, by model name, as ``missing`` and clear
+        the flag of the others, recording the flagged entries as removed from the
+        catalog and the cleared ones as added again."""
+        removed, restored = [], []
+        with self.atomic:
+            for model in (File, Intersection, RasterStats, Remaining):
+                ids = missing_ids.get(model.__name__, set())
+                flagged = {
+                    entry_id
+                    for (entry_id,) in model.select(model.id)
+                    .where(model.missing)
+                    .tuples()
+                }
+                removed.extend(self._select_batches(model, ids - flagged))
+                restored.extend(self._select_batches(model, flagged - ids))
+                model.update(missing=False).where(model.missing).execute()
+                ids = list(ids)
+                for start in range(0, len(ids), self.query_batch_size):
+                    model.update(missing=True).where(
+                        model.id.in_(ids[start : start + self.query_batch_size])
+                    ).execute()
+            if removed:
+                self.record_catalog_changes("removed", removed)
+            if restored:
+                self.record_catalog_changes("added", restored)
+        if removed or restored:
+            self.invalidate_catalog(removed + restored)
+
+    def _select_batches(self, model: BaseModel, ids: Iterable[int]) -> List[BaseModel]:
+        """Return the entries of model with ids, selected in batches of up to
+        query_batch_size ids, to stay under the SQLite variables limit."""
+        ids = sorted(ids)
+        return [
+            obj
+            for start in range(0, len(ids), self.query_batch_size)
+            for obj in model.select().where(
+                model.id.in_(ids[start : start + self.query_batch_size])
+            )
+        ]
+
+    def _insert_batches(self, model: BaseModel, rows: Iterable[Dict[str, Any]]) -> None:
+        """Insert rows into the table of model in batches of up to query_batch_size
+        values, to stay under the SQLite variables limit."""
+        rows = iter(rows)
+        for row in rows:
+            batch_size = max(1, self.query_batch_size // len(row))
+            model.insert_many([row, *itertools.islice(rows, batch_size - 1)]).execute()
@@ -1,7 +1,19 @@
 """Models for the __pandarus_remote__ web service."""
 
 # pylint: disable=too-few-public-methods``
-from peewee import AutoField, CharField, ForeignKeyField, IntegerField, Model, TextField
+import datetime
+
+from peewee import (
+    AutoField,
+    BooleanField,
+    CharField,
+    DateTimeField,
+    FloatField,
+    ForeignKeyField,
+    IntegerField,
+    Model,
+    TextField,
+)
 
 
 class BaseModel(Model):
@@ -18,19 +30,36 @@ class File(BaseModel):
     kind = CharField(choices=KIND_CHOICES)
     sha256 = CharField(unique=True)
     file_path = TextField()
+    canonical_file_path = TextField(null=True)
     band = IntegerField(null=True)
     layer = CharField(null=True)
     field = CharField(null=True)
     geometry_type = CharField(null=True)
+    missing = BooleanField(default=False)
+
+    @property
+    def dataset_path(self) -> str:
+        """Return the path tasks read the dataset from, its canonical file if any."""
+        return self.canonical_file_path or self.file_path
+
+
+class ResultModel(BaseModel):
+    """Base model for a derived result, evicted least recently accessed first when
+    the storage budget is exceeded unless pinned."""
+
+    last_accessed = DateTimeField(null=True, default=datetime.datetime.now)
+    pinned = BooleanField(default=False)
+    missing = BooleanField(default=False)
 
 
-class Intersection(BaseModel):
+class Intersection(ResultModel):
     """Model for an intersection between two files."""
 
     id = AutoField(primary_key=True)
     first_file = ForeignKeyField(File, backref="first_file_fk")
     second_file = ForeignKeyField(File, backref="second_file_fk")
     data_file_path = TextField()
+    data_sha256 = CharField(null=True)
     vector_file_path = TextField()
 
     class Meta:
@@ -41,13 +70,14 @@ class Intersection(BaseModel):
         ]
 
 
-class RasterStats(BaseModel):
+class RasterStats(ResultModel):
     """Model for the statistics of a raster file."""
 
     id = AutoField(primary_key=True)
     vector_file = ForeignKeyField(File, backref="vector_file_fk")
     raster_file = ForeignKeyField(File, backref="raster_file_fk")
     output_file_path = TextField()
+    output_sha256 = CharField(null=True)
 
     class Meta:
         """Meta class for the RasterStats model."""
@@ -57,9 +87,80 @@ class RasterStats(BaseModel):
         ]
 
 
-class Remaining(BaseModel):
+class Remaining(ResultModel):
     """Model for the remaining area files."""
 
     id = AutoField(primary_key=True)
     intersection = ForeignKeyField(Intersection, backref="intersection_fk", unique=True)
     data_file_path = TextField()
+    data_sha256 = CharField(null=True)
+
+
+class Upload(BaseModel):
+    """Model for a resumable chunked upload in progress."""
+
+    id = CharField(primary_key=True)
+    name = CharField()
+    sha256 = CharField()
+    size = IntegerField()
+    chunk_size = IntegerField()
+    staging_file_path = TextField()
+    band = IntegerField(null=True)
+    layer = CharField(null=True)
+    field = CharField(null=True)
+    created_at = DateTimeField(null=True, default=datetime.datetime.now)
+
+    @property
+    def n_chunks(self) -> int:
+        """Return the number of chunks the upload is split into."""
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index: int) -> int:
+        """Return the expected length in bytes of the chunk at index."""
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+class UploadChunk(BaseModel):
+    """Model for a received chunk of a resumable upload."""
+
+    id = AutoField(primary_key=True)
+    upload = ForeignKeyField(Upload, backref="upload_fk", on_delete="CASCADE")
+    index = IntegerField()
+    sha256 = CharField()
+
+    class Meta:
+        """Meta class for the UploadChunk model."""
+
+        indexes = [
+            (("upload", "index"), True),
+        ]
+
+
+class CatalogChange(BaseModel):
+    """Model for an entry added to or removed from the catalog. The id is the
+    monotonic change sequence clients sync the catalog from."""
+
+    ACTION_CHOICES = ["added", "removed"]
+
+    id = AutoField(primary_key=True)
+    section = CharField()
+    action = CharField(choices=ACTION_CHOICES)
+    entry = TextField()
+
+
+class StoredPath(BaseModel):
+    """Model for a file found on disk by the storage sweeper, in a temporary table."""
+
+    path = TextField(primary_key=True)
+    mtime = FloatField()
+
+
+class ReferencedPath(BaseModel):
+    """Model for a file path of a database entry, or of a file derived from it, found
+    by the storage sweeper, in a temporary table."""
+
+    id = AutoField(primary_key=True)
+    path = TextField(index=True)
+    model = CharField()
+    entry_id = IntegerField()
+    derived = BooleanField()
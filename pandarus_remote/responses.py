@@ -0,0 +1,129 @@
+"""Responses serving stored files for the __pandarus_remote__ web service."""
+
+import os
+from functools import wraps
+from http import HTTPStatus
+from pathlib import Path
+from typing import Callable, Optional, Tuple, Union
+
+from flask import Response, request, send_file
+
+from .errors import (
+    InvalidResultFormatError,
+    NoEntryFoundError,
+    ResultAlreadyExistsError,
+    ResultFormatNotFoundError,
+    ResultMissingError,
+)
+from .helpers import IOHelper
+
+
+def send_result_file(
+    file_path: Path,
+    mimetype: str,
+    download_name: str,
+    etag: Union[str, bool],
+    content_encoding: Optional[str] = None,
+) -> Response:
+    """Send a stored file as an attachment. If a sendfile mode is set, the response
+    has no body but an ``X-Sendfile`` or ``X-Accel-Redirect`` header, so the front
+    server sends the file, answering range requests too, and the worker is freed."""
+    offload_header = IOHelper().offload_header(file_path)
+    if offload_header is None:
+        response = send_file(
+            file_path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            etag=etag,
+        )
+    else:
+        response = Response(mimetype=mimetype)
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=download_name
+        )
+        response.headers[offload_header[0]] = offload_header[1]
+        if isinstance(etag, str):
+            response.set_etag(etag)
+            response.make_conditional(request)
+    if content_encoding is not None:
+        response.headers["Content-Encoding"] = content_encoding
+    return response
+
+
+def get_calculation_endpoint(
+    calculation_function: Callable[[], Tuple[str, Optional[str]]]
+) -> Callable[[], Response]:
+    """Decorator for get_calculation endpoints. The decorated function returns the
+    result file path and its content hash, used as a strong ETag if known. Responses
+    are conditional, so ``If-None-Match`` and ``Range`` requests are answered with
+    304 and 206."""
+
+    @wraps(calculation_function)
+    def wrapper() -> Response:
+        """Wrapper function for get_calculation endpoints."""
+        try:
+            result, sha256 = calculation_function()
+            result_format = request.values.get("format", "json")
+            if result_format not in ("json", "npz"):
+                raise InvalidResultFormatError(result_format, ["json", "npz"])
+            if result_format == "npz":
+                if not IOHelper().is_compressed_result(result) or not (
+                    IOHelper().columnar_path(result).exists()
+                ):
+                    raise ResultFormatNotFoundError(result_format)
+                return send_result_file(
+                    IOHelper().columnar_path(result),
+                    mimetype="application/octet-stream",
+                    download_name=os.path.basename(IOHelper().columnar_path(result)),
+                    etag=f"{sha256}-npz" if sha256 else True,
+                )
+
+            if not IOHelper().is_compressed_result(result):
+                return send_result_file(
+                    result,
+                    mimetype="application/octet-stream",
+                    download_name=os.path.basename(result),
+                    etag=sha256 or True,
+                )
+
+            accepted_encodings = [
+                encoding
+                for encoding in IOHelper().result_encodings
+                if request.accept_encodings.quality(encoding) > 0
+            ]
+            file_path, encoding = IOHelper().result_representation(
+                result, accepted_encodings
+            )
+            download_name = os.path.basename(result).removesuffix(".gz")
+            if encoding is not None:
+                response = send_result_file(
+                    file_path,
+                    mimetype="application/json",
+                    download_name=download_name,
+                    etag=f"{sha256}-{encoding}" if sha256 else True,
+                    content_encoding=encoding,
+                )
+            else:
+                response = Response(
+                    IOHelper().read_decompressed(file_path),
+                    mimetype="application/json",
+                    headers={
+                        "Content-Disposition": f"attachment; filename={download_name}"
+                    },
+                )
+                if sha256:
+                    response.set_etag(sha256)
+                response.make_conditional(request)
+            response.vary.add("Accept-Encoding")
+            return response
+        except (NoEntryFoundError, ResultFormatNotFoundError) as error:
+            return {"error": str(error)}, HTTPStatus.NOT_FOUND
+        except ResultAlreadyExistsError as raee:
+            return {"error": str(raee)}, HTTPStatus.CONFLICT
+        except InvalidResultFormatError as irfe:
+            return {"error": str(irfe)}, HTTPStatus.BAD_REQUEST
+        except ResultMissingError as rme:
+            return {"error": str(rme)}, HTTPStatus.GONE
+
+    return wrapper
@@ -0,0 +1,381 @@
+"""Result helpers for the __pandarus_remote__ web service, mixed into the
+DatabaseHelper."""
+
+import datetime
+import os
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from peewee import JOIN
+
+from .errors import (
+    InvalidResultTypeError,
+    NoEntryFoundError,
+    ResultAlreadyExistsError,
+    ResultMissingError,
+)
+from .models import BaseModel, File, Intersection, RasterStats, Remaining, ResultModel
+from .utils import loggable
+
+
+class ResultQueryMixin:
+    """Mixin of the DatabaseHelper looking up results and their files."""
+
+    result_types: List[str] = ["intersection", "raster_stats", "remaining"]
+    result_models: Dict[str, BaseModel] = {
+        "intersection": Intersection,
+        "raster_stats": RasterStats,
+        "remaining": Remaining,
+    }
+    result_files: Dict[BaseModel, Tuple[str, str]] = {
+        Intersection: ("first_file", "second_file"),
+        RasterStats: ("vector_file", "raster_file"),
+    }
+
+    def _query_pair(
+        self,
+        file1_hash: str,
+        file2_hash: str,
+        result_model: Optional[BaseModel] = None,
+    ) -> Tuple[File, File, Optional[Intersection], Optional[BaseModel]]:
+        """Return the Files for file1_hash and file2_hash, the Intersection joining
+        them for a Remaining result_model, and the result_model entry joining them,
+        or None. Files found in the file cache are not queried again, otherwise the
+        files and the result are selected with a single query. Raises
+        NoEntryFoundError with the first hash not found."""
+        files = self.cached_files({file1_hash, file2_hash})
+        if file1_hash in files and file2_hash in files:
+            file1, file2 = files[file1_hash], files[file2_hash]
+            if result_model is None:
+                return file1, file2, None, None
+            if result_model is RasterStats:
+                return (
+                    file1,
+                    file2,
+                    None,
+                    RasterStats.get_or_none(
+                        (RasterStats.vector_file == file1.id)
+                        & (RasterStats.raster_file == file2.id)
+                    ),
+                )
+            query = Intersection.select().where(
+                (Intersection.first_file == file1.id)
+                & (Intersection.second_file == file2.id)
+            )
+            if result_model is Intersection:
+                return file1, file2, None, query.first()
+            intersection = (
+                query.select(Intersection, Remaining)
+                .join(
+                    Remaining,
+                    JOIN.LEFT_OUTER,
+                    on=Remaining.intersection == Intersection.id,
+                    attr="paired_result",
+                )
+                .first()
+            )
+            return (
+                file1,
+                file2,
+                intersection,
+                getattr(intersection, "paired_result", None),
+            )
+
+        first_file, second_file = File.alias(), File.alias()
+        selected = [first_file, second_file]
+        query = first_file.select().join(
+            second_file, on=second_file.sha256 == file2_hash, attr="paired_file"
+        )
+        if result_model is RasterStats:
+            selected.append(RasterStats)
+            query = query.switch(first_file).join(
+                RasterStats,
+                JOIN.LEFT_OUTER,
+                on=(RasterStats.vector_file == first_file.id)
+                & (RasterStats.raster_file == second_file.id),
+                attr="paired_result",
+            )
+        elif result_model is not None:
+            selected.append(Intersection)
+            query = query.switch(first_file).join(
+                Intersection,
+                JOIN.LEFT_OUTER,
+                on=(Intersection.first_file == first_file.id)
+                & (Intersection.second_file == second_file.id),
+                attr=(
+                    "paired_intersection"
+                    if result_model is Remaining
+                    else "paired_result"
+                ),
+            )
+        if result_model is Remaining:
+            selected.append(Remaining)
+            query = query.switch(first_file).join(
+                Remaining,
+                JOIN.LEFT_OUTER,
+                on=Remaining.intersection == Intersection.id,
+                attr="paired_result",
+            )
+
+        file1 = query.select(*selected).where(first_file.sha256 == file1_hash).first()
+        if file1 is None:
+            if not self.file_exists(file1_hash):
+                raise NoEntryFoundError([file1_hash])
+            raise NoEntryFoundError([file2_hash])
+        self.cache_files([file1, file1.paired_file])
+        return (
+            file1,
+            file1.paired_file,
+            getattr(file1, "paired_intersection", None),
+            getattr(file1, "paired_result", None),
+        )
+
+    @loggable
+    def validate_query(
+        self,
+        file1_hash: str,
+        file2_hash: str,
+        result_model: Optional[BaseModel] = None,
+        should_exist: bool = True,
+    ) -> Union[BaseModel, Tuple[File, File], int]:
+        """Check if the file1_hash and file2_hash are valid. Raises QueryError if not.
+        Returns the result_model entry if it exists and should_exist is True else
+        returns Files for file1_hash and file2_hash if exist, or the Intersection id
+        for a Remaining. The files and the result are looked up with a single query,
+        or only the result if the files are cached."""
+        file1, file2, intersection, result = self._query_pair(
+            file1_hash, file2_hash, result_model
+        )
+        if result_model is None:
+            return file1, file2
+
+        if result_model is Remaining and intersection is None:
+            raise NoEntryFoundError([file1_hash, file2_hash])
+        if result is None:
+            if should_exist:
+                raise NoEntryFoundError([file1_hash, file2_hash])
+            return intersection.id if result_model is Remaining else (file1, file2)
+        if not should_exist:
+            raise ResultAlreadyExistsError([file1_hash, file2_hash])
+
+        files_result = result
+        if result_model is Remaining:
+            result.intersection = files_result = intersection
+        files_fields = self.result_files[type(files_result)]
+        for files_field, file in zip(files_fields, (file1, file2)):
+            setattr(files_result, files_field, file)
+        return result
+
+    @loggable
+    def get_raster_stats(
+        self, vector_sha256: str, raster_sha256: str, should_exist: bool = True
+    ) -> Union[RasterStats, Tuple[File, File]]:
+        """Returns a RasterStats if exists and should_exist else Files for vector_sha256
+        and raster_sha256. Raises QueryError if the vector_sha256 or raster_sha256 are
+        are not found or RasterStats with vector_sha256 and raster_sha256 combination
+        doesn't exist."""
+        return self.validate_query(
+            vector_sha256, raster_sha256, RasterStats, should_exist
+        )
+
+    @loggable
+    def get_intersection(
+        self, file1_sha256: str, file2_sha256: str, should_exist: bool = True
+    ) -> Union[Intersection, Tuple[File, File]]:
+        """Return an Intersection if exists and should_exist else Files for
+        vector_sha256 and raster_sha256. Raises QueryError if the file1_sha256
+        or file2_sha256 are not found or Intersection with file1_sha256 and
+        file2_sha256 combination doesn't exist."""
+        return self.validate_query(
+            file1_sha256, file2_sha256, Intersection, should_exist
+        )
+
+    @loggable
+    def get_remaining(
+        self, file1_sha256: str, file2_sha256: str, should_exist: bool = True
+    ) -> Union[Remaining, int]:
+        """Return a Remaining for file1_d and file2_d if exists and should_exist
+        else Intersection.id for file1_sha256 and file2_sha256. Raises QueryError
+        if the file1_sha256 or file2_sha256 are not found or Remaining with file1_sha256
+        and file2_sha256 combination doesn't exist."""
+        return self.validate_query(file1_sha256, file2_sha256, Remaining, should_exist)
+
+    @loggable
+    def existing_results(
+        self, result_type: str, pairs: List[Tuple[str, str]]
+    ) -> List[Tuple[str, str]]:
+        """Return the (first, second) hash pairs of pairs which have a result of
+        result_type, one of result_types. Raises InvalidResultTypeError if result_type
+        is unknown."""
+        pairs = [tuple(pair) for pair in pairs]
+        result_ids = self.result_ids(result_type, pairs)
+        return [pair for pair in pairs if pair in result_ids]
+
+    def result_ids(
+        self, result_type: str, pairs: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], int]:
+        """Return the ids of the results of result_type, one of result_types, by the
+        (first, second) hash pairs of pairs which have one. Every batch of pairs is
+        checked with a single statement, selecting the results whose files are among
+        the first and second hashes of the batch. Results whose file is missing are
+        left out. Raises InvalidResultTypeError if result_type is unknown."""
+        if result_type not in self.result_types:
+            raise InvalidResultTypeError(result_type, self.result_types)
+        model = self.result_models[result_type]
+        files_model = RasterStats if model is RasterStats else Intersection
+        first_field, second_field = (
+            getattr(files_model, files_field)
+            for files_field in self.result_files[files_model]
+        )
+
+        pairs = [tuple(pair) for pair in pairs]
+        result_ids = {}
+        batch_size = self.query_batch_size // 2
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start : start + batch_size]
+            first_file, second_file = File.alias(), File.alias()
+            query = model.select(model.id, first_file.sha256, second_file.sha256)
+            if model is Remaining:
+                query = query.join(Intersection)
+            query = (
+                query.join(first_file, on=first_field == first_file.id)
+                .switch(files_model)
+                .join(second_file, on=second_field == second_file.id)
+                .where(
+                    first_file.sha256.in_({first for first, _ in batch})
+                    & second_file.sha256.in_({second for _, second in batch})
+                    & ~model.missing
+                )
+            )
+            batch = set(batch)
+            result_ids.update(
+                ((first, second), result_id)
+                for result_id, first, second in query.tuples()
+                if (first, second) in batch
+            )
+        return result_ids
+
+    def result_key(self, result: ResultModel) -> Tuple[str, str, str]:
+        """Return the type and the hashes of the first and second files of a result."""
+        if isinstance(result, RasterStats):
+            return (
+                "raster_stats",
+                result.vector_file.sha256,
+                result.raster_file.sha256,
+            )
+        intersection = (
+            result if isinstance(result, Intersection) else result.intersection
+        )
+        return (
+            "intersection" if result is intersection else "remaining",
+            intersection.first_file.sha256,
+            intersection.second_file.sha256,
+        )
+
+    @loggable
+    def get_result_entry(
+        self, result_type: str, first_sha256: str, second_sha256: str
+    ) -> ResultModel:
+        """Return the result of result_type, one of result_types, for first_sha256 and
+        second_sha256. Raises QueryError if the result doesn't exist or
+        InvalidResultTypeError if result_type is unknown."""
+        if result_type == "intersection":
+            return self.get_intersection(first_sha256, second_sha256)
+        if result_type == "raster_stats":
+            return self.get_raster_stats(first_sha256, second_sha256)
+        if result_type == "remaining":
+            return self.get_remaining(first_sha256, second_sha256)
+        raise InvalidResultTypeError(result_type, self.result_types)
+
+    @loggable
+    def pin_result(
+        self,
+        result_type: str,
+        first_sha256: str,
+        second_sha256: str,
+        pinned: bool = True,
+    ) -> None:
+        """Pin the result of result_type for first_sha256 and second_sha256, so it is
+        never evicted, or unpin it. Raises QueryError if the result doesn't exist or
+        InvalidResultTypeError if result_type is unknown."""
+        result = self.get_result_entry(result_type, first_sha256, second_sha256)
+        model = type(result)
+        model.update(pinned=pinned).where(model.id == result.id).execute()
+
+    def cache_result(
+        self, result: ResultModel, key: Optional[Tuple[str, str, str]] = None
+    ) -> None:
+        """Cache the file path, content hash and size of a result in redis, unless its
+        file is missing. The key of the result, see result_key, is looked up unless
+        given."""
+        if isinstance(result, RasterStats):
+            file_path, sha256 = result.output_file_path, result.output_sha256
+        else:
+            file_path, sha256 = result.data_file_path, result.data_sha256
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        self.redis_helper.cache_result(
+            *(key or self.result_key(result)),
+            {"file_path": str(file_path), "sha256": sha256 or "", "size": size},
+        )
+
+    @loggable
+    def apply_result_accesses(self) -> int:
+        """Set the last access time of the results downloaded from the result cache,
+        recorded in redis, in the database. Returns the number of updated results."""
+        accesses_by_type: Dict[str, Dict[Tuple[str, str], float]] = {}
+        for (result_type, *pair), accessed in self.redis_helper.pop_result_accesses():
+            accesses_by_type.setdefault(result_type, {})[tuple(pair)] = accessed
+        updated = 0
+        with self.atomic:
+            for result_type, accesses in accesses_by_type.items():
+                if result_type not in self.result_types:
+                    continue
+                model = self.result_models[result_type]
+                for pair, result_id in self.result_ids(result_type, accesses).items():
+                    accessed = datetime.datetime.fromtimestamp(accesses[pair])
+                    updated += (
+                        model.update(last_accessed=accessed)
+                        .where(
+                            (model.id == result_id)
+                            & (
+                                model.last_accessed.is_null()
+                                | (model.last_accessed < accessed)
+                            )
+                        )
+                        .execute()
+                    )
+        return updated
+
+    @loggable
+    def get_result(
+        self, result_type: str, first_sha256: str, second_sha256: str
+    ) -> Tuple[str, Optional[str]]:
+        """Return the file path and content hash of the result of result_type, one of
+        result_types, for first_sha256 and second_sha256, and mark it as accessed.
+        Results are read through the redis result cache, whose accesses are only
+        recorded in the database by apply_result_accesses. Raises QueryError if the
+        result doesn't exist, ResultMissingError if the storage sweep found its file
+        missing or InvalidResultTypeError if result_type is unknown."""
+        redis_helper = self.redis_helper
+        key = (result_type, first_sha256, second_sha256)
+        cached = redis_helper.get_cached_result(*key)
+        if cached is not None:
+            if os.path.exists(cached["file_path"]):
+                if self.io_helper.storage_budget is not None:
+                    redis_helper.record_result_access(*key)
+                return cached["file_path"], cached["sha256"] or None
+            redis_helper.invalidate_results([key])
+
+        result = self.get_result_entry(result_type, first_sha256, second_sha256)
+        if result.missing:
+            raise ResultMissingError([first_sha256, second_sha256])
+        model = type(result)
+        model.update(last_accessed=datetime.datetime.now()).where(
+            model.id == result.id
+        ).execute()
+        self.cache_result(result, key)
+        if isinstance(result, RasterStats):
+            return result.output_file_path, result.output_sha256
+        return result.data_file_path, result.data_sha256
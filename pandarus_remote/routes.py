@@ -1,22 +1,33 @@
 """Routes for the __pandarus_remote__ web service."""
 
+import json
+import uuid
 from http import HTTPStatus
 from pathlib import Path
+from typing import Any, Optional, Tuple
 
-from flask import Blueprint, Response, request
+from flask import Blueprint, Response, current_app, request, url_for
 
 from .errors import (
     FileAlreadyExistsError,
+    IncompleteUploadError,
     IntersectionWithSelfError,
+    InvalidCatalogQueryError,
+    InvalidChunkError,
     InvalidIntersectionFileTypesError,
     InvalidIntersectionGeometryTypeError,
     InvalidRasterstatsFileTypesError,
+    InvalidResultTypeError,
     InvalidSpatialDatasetError,
     JobNotFoundError,
+    NoEntryFoundError,
     NoneReproducibleHashError,
+    ResultMissingError,
 )
 from .helpers import DatabaseHelper, IOHelper, RedisHelper
-from .utils import calculate_endpoint, get_calculation_endpoint
+from .models import Upload
+from .responses import get_calculation_endpoint
+from .utils import calculate_endpoint, upload_endpoint
 from .version import __version__
 
 routes_blueprint = Blueprint("routes_blueprint", __name__)
@@ -31,8 +42,121 @@ def ping() -> Response:
 @routes_blueprint.route("/catalog")
 def catalog() -> Response:
     """Get a catalog of spatial datasets and results currently available on the
-    server."""
-    return DatabaseHelper().catalog, HTTPStatus.OK
+    server. Files can be filtered by ``kind`` and all entries by ``sha256``. A single
+    section is selected with ``type`` and paginated with ``limit`` and ``cursor``."""
+    if not request.args:
+        content, content_sha256, change_sequence = DatabaseHelper().serialized_catalog(
+            RedisHelper().catalog_generation
+        )
+        response = Response(
+            content,
+            mimetype="application/json",
+            headers={"X-Catalog-Cursor": str(change_sequence)},
+        )
+        response.set_etag(content_sha256)
+        return response.make_conditional(request)
+    try:
+        return (
+            DatabaseHelper().query_catalog(
+                request.args.get("type"),
+                request.args.get("kind"),
+                request.args.get("sha256"),
+                _catalog_integer("cursor", minimum=0),
+                _catalog_integer("limit", minimum=1),
+            ),
+            HTTPStatus.OK,
+        )
+    except InvalidCatalogQueryError as icqe:
+        return {"error": str(icqe)}, HTTPStatus.BAD_REQUEST
+
+
+@routes_blueprint.route("/catalog/changes")
+def catalog_changes() -> Response:
+    """Get the entries added to or removed from the catalog after the ``since``
+    cursor, the ``X-Catalog-Cursor`` of ``/catalog`` or the ``next_cursor`` of the
+    previous changes, in pages of at most ``limit`` changes."""
+    try:
+        return (
+            DatabaseHelper().catalog_changes(
+                _catalog_integer("since", minimum=0) or 0,
+                _catalog_integer("limit", minimum=1) or 1000,
+            ),
+            HTTPStatus.OK,
+        )
+    except InvalidCatalogQueryError as icqe:
+        return {"error": str(icqe)}, HTTPStatus.BAD_REQUEST
+
+
+def _catalog_integer(parameter: str, minimum: int) -> Optional[int]:
+    """Return the integer value of a catalog query parameter, or None if it isn't
+    given. Raises InvalidCatalogQueryError if it isn't an integer of at least
+    minimum."""
+    value = request.args.get(parameter)
+    if value is None:
+        return None
+    try:
+        integer = int(value)
+    except ValueError:
+        integer = None
+    if integer is None or integer < minimum:
+        raise InvalidCatalogQueryError(
+            parameter, f"must be an integer of at least {minimum}"
+        )
+    return integer
+
+
+@routes_blueprint.route("/files/<sha256>", methods=["HEAD"])
+def file_exists(sha256: str) -> Response:
+    """Check if a spatial dataset with the given hash is already on the server, so
+    that clients can skip uploading it again (see ``/upload``)."""
+    if DatabaseHelper().file_exists(sha256):
+        return "", HTTPStatus.OK
+    return "", HTTPStatus.NOT_FOUND
+
+
+@routes_blueprint.route("/files/exists", methods=["POST"])
+def files_exist() -> Response:
+    """Check which of the given spatial dataset hashes are already on the server.
+    The hashes are posted as repeated ``sha256`` form fields."""
+    sha256s = request.form.getlist("sha256")
+    existing = DatabaseHelper().existing_files(sha256s)
+    existing_set = set(existing)
+    return {
+        "existing": existing,
+        "missing": [sha256 for sha256 in sha256s if sha256 not in existing_set],
+    }, HTTPStatus.OK
+
+
+@routes_blueprint.route("/results/exists", methods=["POST"])
+def results_exist() -> Response:
+    """Check which of the given results are already on the server. The results are
+    posted as a JSON list of objects with the result ``type`` and the ``first`` and
+    ``second`` hashes of its spatial datasets, and are checked in batches per type."""
+    results = request.get_json(silent=True)
+    if not _valid_results(results):
+        error = "Results must be a list of objects with type, first and second."
+        return {"error": error}, HTTPStatus.BAD_REQUEST
+
+    pairs_by_type = {}
+    for result in results:
+        pairs_by_type.setdefault(result["type"], []).append(
+            (result["first"], result["second"])
+        )
+    try:
+        existing = {
+            (result_type, *pair)
+            for result_type, pairs in pairs_by_type.items()
+            for pair in DatabaseHelper().existing_results(result_type, pairs)
+        }
+    except InvalidResultTypeError as irte:
+        return {"error": str(irte)}, HTTPStatus.BAD_REQUEST
+
+    response = {"existing": [], "missing": []}
+    for result in results:
+        entry = {key: result[key] for key in ("type", "first", "second")}
+        key = (entry["type"], entry["first"], entry["second"])
+        response["existing" if key in existing else "missing"].append(entry)
+    return response, HTTPStatus.OK
 
 
 @routes_blueprint.route("/status/<job_id>")
@@ -46,44 +170,90 @@ def status(job_id: str) -> Response:
         return {"error": str(jnfe)}, HTTPStatus.NOT_FOUND
 
 
-@routes_blueprint.route("/raster_stats", methods=["POST"])
+@routes_blueprint.route("/raster_stats", methods=["GET", "POST"])
 @get_calculation_endpoint
-def get_raster_stats() -> str:
+def get_raster_stats() -> Tuple[str, Optional[str]]:
     """Request the download of the JSON data file from a raster stats calculation.
     Both spatial datasets should already be on the server (see ``/upload``), and
     the raster stats should already be calculated (see ``/calculate_rasterstats``)."""
-    return (
-        DatabaseHelper()
-        .get_raster_stats(request.form["vector"], request.form["raster"])
-        .output_file_path
+    return DatabaseHelper().get_result(
+        "raster_stats", request.values["vector"], request.values["raster"]
     )
 
 
-@routes_blueprint.route("/intersection", methods=["POST"])
+@routes_blueprint.route("/intersection", methods=["GET", "POST"])
 @get_calculation_endpoint
-def get_intersection() -> str:
+def get_intersection() -> Tuple[str, Optional[str]]:
     """Request the download of a pandarus intersections JSON data file
     for two spatial datasets. Both spatial datasets should already be on
     the server (see ``/upload``), and the intersection should already be
     calculated (see ``/calculate_intersection``)."""
-    return (
-        DatabaseHelper()
-        .get_intersection(request.form["first"], request.form["second"])
-        .data_file_path
+    return DatabaseHelper().get_result(
+        "intersection", request.values["first"], request.values["second"]
     )
 
 
-@routes_blueprint.route("/remaining", methods=["POST"])
+@routes_blueprint.route("/remaining", methods=["GET", "POST"])
 @get_calculation_endpoint
-def get_remaining() -> str:
+def get_remaining() -> Tuple[str, Optional[str]]:
     """Request the download of the JSON data file from a remaining
     areas calculation. Both spatial datasets should already be on
     he server (see ``/upload``), and the remaining areas should
     already be calculated (see ``/calculate_remaining``)."""
-    return (
-        DatabaseHelper()
-        .get_remaining(request.form["first"], request.form["second"])
-        .data_file_path
+    return DatabaseHelper().get_result(
+        "remaining", request.values["first"], request.values["second"]
+    )
+
+
+@routes_blueprint.route("/results/archive", methods=["POST"])
+def results_archive() -> Response:
+    """Request the download of several result files as a single tar archive, streamed
+    while it is built. The results are posted as a JSON list of objects with the
+    result ``type`` and the ``first`` and ``second`` hashes of its spatial datasets.
+    The archive starts with a ``manifest.json`` listing the member of every result
+    and the error of every result not found."""
+    results = request.get_json(silent=True)
+    if not _valid_results(results):
+        error = "Results must be a list of objects with type, first and second."
+        return {"error": error}, HTTPStatus.BAD_REQUEST
+
+    manifest, members = [], []
+    for result in results:
+        entry = {key: result[key] for key in ("type", "first", "second")}
+        try:
+            file_path, sha256 = DatabaseHelper().get_result(
+                result["type"], result["first"], result["second"]
+            )
+        except (InvalidResultTypeError, NoEntryFoundError, ResultMissingError) as error:
+            entry["error"] = str(error)
+        else:
+            file_path = Path(file_path)
+            if file_path.exists():
+                name = (
+                    f"{result['type']}/{result['first']}-{result['second']}"
+                    f"{''.join(file_path.suffixes[-2:])}"
+                )
+                entry.update(file=name, sha256=sha256)
+                members.append((name, file_path))
+            else:
+                entry["error"] = "Result file is missing."
+        manifest.append(entry)
+
+    manifest_content = json.dumps(manifest, indent=2).encode("utf-8")
+    return Response(
+        IOHelper().stream_archive([("manifest.json", manifest_content), *members]),
+        mimetype="application/x-tar",
+        headers={"Content-Disposition": "attachment; filename=results.tar"},
+    )
+
+
+def _valid_results(results: Any) -> bool:
+    """Return whether results is a list of objects with the string ``type``,
+    ``first`` and ``second`` of results."""
+    return isinstance(results, list) and all(
+        isinstance(result, dict)
+        and all(isinstance(result.get(key), str) for key in ("type", "first", "second"))
+        for result in results
     )
 
 
@@ -93,6 +263,22 @@ def upload() -> Response:
     openable by `fiona <https://github.com/Toblerity/Fiona>`__
     or `rasterio <https://github.com/mapbox/rasterio>`__."""
     try:
+        # Identical content isn't stored again, under the suffix of another name
+        if DatabaseHelper().file_exists(request.form["sha256"]):
+            raise FileAlreadyExistsError(request.form["name"])
+        if IOHelper().async_ingest:
+            return _enqueue_ingest(
+                IOHelper().store_uploaded_file(
+                    file=request.files["file"],
+                    name=request.form["name"],
+                    file_hash=request.form["sha256"],
+                ),
+                name=request.form["name"],
+                file_hash=request.form["sha256"],
+                layer=request.form.get("layer", None),
+                field=request.form.get("field", "name"),
+                band=request.form.get("band", 1),
+            )
         file = IOHelper().save_uploaded_file(
             file=request.files["file"],
             name=request.form["name"],
@@ -108,10 +294,134 @@ def upload() -> Response:
     except NoneReproducibleHashError as nrhe:
         return {"error": str(nrhe)}, HTTPStatus.BAD_REQUEST
     except FileAlreadyExistsError as fae:
-        Path(file.file_path).unlink()
+        # Identical content shares its stored file with the existing entry
         return {"error": str(fae)}, HTTPStatus.CONFLICT
 
 
+def _enqueue_ingest(
+    file_path: Path,
+    name: str,
+    file_hash: str,
+    layer: Optional[str],
+    field: Optional[str],
+    band: Optional[str],
+) -> Response:
+    """Enqueue the validation and registration of a stored upload and return its job
+    status URL."""
+    job = RedisHelper().enqueue_ingest_job(
+        file_path, name, file_hash, layer, field, band
+    )
+    return {
+        "file_sha256": file_hash,
+        "status": url_for("routes_blueprint.status", job_id=job.id),
+    }, HTTPStatus.ACCEPTED
+
+
+@routes_blueprint.route("/upload/start", methods=["POST"])
+@upload_endpoint
+def start_upload() -> Response:
+    """Start a resumable upload of a spatial data file in chunks, for files too large
+    for ``/upload``. Chunks are sent to ``/upload/<upload_id>/<index>`` and the upload
+    is completed with ``/upload/<upload_id>/finalize``. The size may be up to
+    ``PANDARUS_MAX_UPLOAD_SIZE`` bytes and chunks up to ``MAX_CONTENT_LENGTH``."""
+    try:
+        size = int(request.form["size"])
+        chunk_size = int(request.form.get("chunk_size", IOHelper().upload_chunk_size))
+    except ValueError:
+        error = "Upload size and chunk size must be integers."
+        return {"error": error}, HTTPStatus.BAD_REQUEST
+    if size < 0 or chunk_size <= 0:
+        error = "Upload size and chunk size must be positive."
+        return {"error": error}, HTTPStatus.BAD_REQUEST
+    if size > IOHelper().max_upload_size:
+        error = f"Upload size must be at most {IOHelper().max_upload_size} bytes."
+        return {"error": error}, HTTPStatus.BAD_REQUEST
+    max_chunk_size = current_app.config.get("MAX_CONTENT_LENGTH")
+    if max_chunk_size is not None and chunk_size > max_chunk_size:
+        error = f"Chunk size must be at most {max_chunk_size} bytes."
+        return {"error": error}, HTTPStatus.BAD_REQUEST
+
+    upload_id = uuid.uuid4().hex
+    pending_upload = Upload(
+        id=upload_id,
+        name=request.form["name"],
+        sha256=request.form["sha256"],
+        size=size,
+        chunk_size=chunk_size,
+        staging_file_path=IOHelper().staging_file_path(upload_id),
+        layer=request.form.get("layer", None),
+        field=request.form.get("field", "name"),
+        band=request.form.get("band", 1),
+    )
+    DatabaseHelper().add_upload(pending_upload)
+    IOHelper().create_staging_file(pending_upload)
+    return DatabaseHelper().get_upload_status(pending_upload), HTTPStatus.CREATED
+
+
+@routes_blueprint.route("/upload/<upload_id>")
+@upload_endpoint
+def upload_status(upload_id: str) -> Response:
+    """Get the received and missing chunks of a resumable upload, so that only the
+    missing chunks are sent again after an interruption."""
+    pending_upload = DatabaseHelper().get_upload(upload_id)
+    return DatabaseHelper().get_upload_status(pending_upload), HTTPStatus.OK
+
+
+@routes_blueprint.route("/upload/<upload_id>/<int:index>", methods=["PUT"])
+@upload_endpoint
+def upload_chunk(upload_id: str, index: int) -> Response:
+    """Upload the chunk at index of a resumable upload as the raw request body. Every
+    chunk must be ``chunk_size`` bytes long except the last one. The optional
+    ``sha256`` query argument is checked against the hash of the received chunk."""
+    pending_upload = DatabaseHelper().get_upload(upload_id)
+    if not 0 <= index < pending_upload.n_chunks:
+        raise InvalidChunkError(upload_id, index, "index out of range")
+    if request.content_length != pending_upload.chunk_length(index):
+        raise InvalidChunkError(
+            upload_id, index, f"expected {pending_upload.chunk_length(index)} bytes"
+        )
+
+    chunk_hash = IOHelper().write_stream(
+        request.stream,
+        Path(pending_upload.staging_file_path),
+        offset=index * pending_upload.chunk_size,
+    )
+    if request.args.get("sha256", chunk_hash) != chunk_hash:
+        raise InvalidChunkError(upload_id, index, "non-reproducible hash")
+    DatabaseHelper().add_upload_chunk(pending_upload, index, chunk_hash)
+    return {"index": index, "sha256": chunk_hash}, HTTPStatus.OK
+
+
+@routes_blueprint.route("/upload/<upload_id>/finalize", methods=["POST"])
+@upload_endpoint
+def finalize_upload(upload_id: str) -> Response:
+    """Complete a resumable upload once all its chunks are received. The file is then
+    validated and registered like with ``/upload``."""
+    pending_upload = DatabaseHelper().get_upload(upload_id)
+    missing_chunks = DatabaseHelper().get_upload_status(pending_upload)["missing"]
+    if missing_chunks:
+        raise IncompleteUploadError(upload_id, missing_chunks)
+
+    try:
+        if DatabaseHelper().file_exists(pending_upload.sha256):
+            Path(pending_upload.staging_file_path).unlink(missing_ok=True)
+            raise FileAlreadyExistsError(pending_upload.name)
+        if IOHelper().async_ingest:
+            return _enqueue_ingest(
+                IOHelper().store_upload(pending_upload),
+                pending_upload.name,
+                pending_upload.sha256,
+                pending_upload.layer,
+                pending_upload.field,
+                pending_upload.band,
+            )
+        file = IOHelper().finalize_upload(pending_upload)
+    finally:
+        DatabaseHelper().delete_upload(pending_upload)
+    DatabaseHelper().add_uploaded_file(file)
+    return {"file_name": file.name, "file_sha256": file.sha256}, HTTPStatus.OK
+
+
 @routes_blueprint.route("/calculate_intersection", methods=["POST"])
 @calculate_endpoint
 def calculate_intersection() -> str:
@@ -135,7 +445,9 @@ def calculate_intersection() -> str:
         raise InvalidIntersectionGeometryTypeError(
             file1_hash, file1.kind, file2_hash, file2.kind
         )
-    return RedisHelper().enqueue_intersection_job(file1, file2).id
+    job = RedisHelper().enqueue_intersection_job(file1, file2)
+    RedisHelper().enqueue_eviction_job()
+    return job.id
 
 
 @routes_blueprint.route("/calculate_raster_stats", methods=["POST"])
@@ -153,7 +465,9 @@ def calculate_rasterstats() -> str:
         raise InvalidRasterstatsFileTypesError(
             vector.sha256, vector.kind, raster.sha256, raster.kind
         )
-    return RedisHelper().enqueue_raster_stats_job(vector, raster, raster.band).id
+    job = RedisHelper().enqueue_raster_stats_job(vector, raster, raster.band)
+    RedisHelper().enqueue_eviction_job()
+    return job.id
 
 
 @routes_blueprint.route("/calculate_remaining", methods=["POST"])
@@ -163,7 +477,7 @@ def calculate_remaining() -> str:
     Both spatial datasets should already be on the server (see ``/upload``)."""
     first_hash = request.form["first"]
     second_hash = request.form["second"]
-    intersection_id = DatabaseHelper().get_remaining(
-        first_hash, second_hash, should_exist=False
-    )
-    return RedisHelper().enqueue_remaining_job(intersection_id).id
+    DatabaseHelper().get_remaining(first_hash, second_hash, should_exist=False)
+    job = RedisHelper().enqueue_remaining_job(first_hash, second_hash)
+    RedisHelper().enqueue_eviction_job()
+    return job.id
@@ -0,0 +1,562 @@
+"""Storage helpers for the __pandarus_remote__ web service, mixed into the
+IOHelper."""
+
+import bz2
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+import fiona
+import numpy as np
+import rasterio.shutil
+import rtree
+from fiona.crs import CRS
+from pandarus.model import Map
+from pandarus.utils.io import sha256_file
+from pandarus.utils.projection import WGS84
+
+from .models import File
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class FileStorageMixin:
+    """Mixin of the IOHelper storing files in the content-addressed storage layout."""
+
+    @property
+    def storage_budget(self) -> Optional[int]:
+        """Return the number of bytes the storage directories may use before derived
+        results are evicted, or None if results are never evicted."""
+        try:
+            return int(os.environ["PANDARUS_STORAGE_BUDGET"])
+        except (KeyError, ValueError):
+            return None
+
+    def storage_usage(self, directory: Optional[Path] = None) -> int:
+        """Return the number of bytes used by the files in directory, the storage
+        directories by default, so the database and its journal files aren't
+        counted. Hard linked files are only counted once."""
+        usage = 0
+        seen_inodes = set()
+        for storage_dir in [directory] if directory else self.storage_dirs:
+            for entry in self.iter_files(storage_dir):
+                stat = entry.stat(follow_symlinks=False)
+                if (stat.st_dev, stat.st_ino) not in seen_inodes:
+                    seen_inodes.add((stat.st_dev, stat.st_ino))
+                    usage += stat.st_size
+        return usage
+
+    def replace_file(self, part_path: Path, file_path: Path) -> None:
+        """Move the part file part_path to file_path in the storage directories and
+        record the bytes it adds to the storage usage."""
+        nbytes = part_path.stat().st_size
+        if file_path.exists():
+            nbytes -= file_path.stat().st_size
+        part_path.replace(file_path)
+        self.record_usage(nbytes)
+
+    def write_stream(
+        self, stream: BinaryIO, file_path: Path, offset: Optional[int] = None
+    ) -> str:
+        """Write a binary stream to file_path in chunks of chunk_size, hashing the
+        content while it is written. Returns the sha256 of the written content. The
+        partially written file is removed if the stream can't be read until the end.
+        If offset is given, the stream is written into the existing file_path starting
+        at offset instead."""
+        hasher = hashlib.sha256()
+        try:
+            with file_path.open("wb" if offset is None else "r+b") as output:
+                if offset is not None:
+                    output.seek(offset)
+                for chunk in iter(lambda: stream.read(self.chunk_size), b""):
+                    hasher.update(chunk)
+                    output.write(chunk)
+        except BaseException:
+            if offset is None:
+                file_path.unlink(missing_ok=True)
+            raise
+        return hasher.hexdigest()
+
+    def content_path(self, directory: Path, sha256: str, suffix: str = "") -> Path:
+        """Return the content-addressed path of a file in directory. Files are sharded
+        by the first two bytes of their sha256, e.g. ``ab/cd/abcd...<suffix>``."""
+        return directory / sha256[:2] / sha256[2:4] / f"{sha256}{suffix}"
+
+    def content_sha256(self, file_path: Path) -> str:
+        """Return the sha256 a content-addressed file_path is stored under."""
+        return Path(file_path).name.split(".", 1)[0]
+
+    def derived_paths(self, file_path: Path) -> List[Path]:
+        """Return the paths of the files stored next to file_path for the same content:
+        the other encodings and the NPZ file of a compressed result, or the canonical
+        copies and the bounds index of a dataset."""
+        file_path = Path(file_path)
+        if self.is_compressed_result(file_path):
+            json_path = file_path.with_suffix("")
+            return [
+                *(
+                    json_path.with_name(f"{json_path.name}{suffix}")
+                    for suffix in self.result_encodings.values()
+                ),
+                self.columnar_path(file_path),
+            ]
+        sha256 = self.content_sha256(file_path)
+        return [
+            file_path.with_name(f"{sha256}.fgb"),
+            file_path.with_name(f"{sha256}.cog.tif"),
+            self.bounds_path(file_path),
+        ]
+
+    def iter_files(self, directory: Path) -> Iterator[os.DirEntry]:
+        """Yield the entries of all files under directory, without listing a whole
+        directory tree in memory."""
+        directories = [directory]
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+
+    def is_stored(self, file_path: Path, directory: Path) -> bool:
+        """Return True if file_path is in the content-addressed layout of directory."""
+        return Path(file_path).parent.parent.parent == directory
+
+    def store_file(
+        self,
+        file_path: Path,
+        directory: Path,
+        sha256: Optional[str] = None,
+        suffix: Optional[str] = None,
+    ) -> Path:
+        """Move file_path to its content-addressed path in directory and return it.
+        The file is hashed unless sha256 is given, and keeps its suffixes unless suffix
+        is given. If an identical file is already stored, file_path is removed."""
+        file_path = Path(file_path)
+        sha256 = sha256 or sha256_file(file_path)
+        suffix = "".join(file_path.suffixes) if suffix is None else suffix
+        stored_path = self.content_path(directory, sha256, suffix)
+        stored_path.parent.mkdir(parents=True, exist_ok=True)
+        if stored_path.exists():
+            file_path.unlink()
+        else:
+            self.replace_file(file_path, stored_path)
+        return stored_path
+
+    def delete_file(self, file_path: Path) -> int:
+        """Delete a stored file and record the bytes it frees in the storage usage.
+        Returns the number of bytes freed, nothing if the file is missing or hard
+        linked until its last link is deleted."""
+        file_path = Path(file_path)
+        try:
+            stat = file_path.stat()
+            file_path.unlink()
+        except FileNotFoundError:
+            return 0
+        freed = stat.st_size if stat.st_nlink == 1 else 0
+        self.record_usage(-freed)
+        return freed
+
+    def link_file(
+        self, file_path: Path, directory: Path, sha256: Optional[str] = None
+    ) -> Path:
+        """Hard link file_path to its content-addressed path in directory and return
+        it. Falls back to a copy if directory is on another file system."""
+        file_path = Path(file_path)
+        sha256 = sha256 or sha256_file(file_path)
+        linked_path = self.content_path(directory, sha256, "".join(file_path.suffixes))
+        linked_path.parent.mkdir(parents=True, exist_ok=True)
+        if not linked_path.exists():
+            try:
+                os.link(file_path, linked_path)
+            except OSError:
+                shutil.copy2(file_path, linked_path)
+                self.record_usage(linked_path.stat().st_size)
+        return linked_path
+
+
+class ResultStorageMixin:
+    """Mixin of the IOHelper storing and serving result files."""
+
+    result_columns: Dict[str, Tuple[str, ...]] = {
+        "intersection": ("first", "second", "measure"),
+        "raster_stats": ("id", "stats"),
+        "remaining": ("id", "measure"),
+    }
+
+    def delete_result(self, file_path: Path) -> int:
+        """Delete a result file with the files stored next to it for its other
+        encodings and its NPZ file. Returns the number of bytes freed, hard linked
+        files free nothing until their last link is deleted."""
+        file_path = Path(file_path)
+        if self.is_compressed_result(file_path):
+            paths = list(file_path.parent.glob(f"{self.content_sha256(file_path)}.*"))
+        else:
+            paths = [file_path]
+        return sum(self.delete_file(path) for path in paths)
+
+    @property
+    def sendfile_mode(self) -> Optional[str]:
+        """Return how file downloads are offloaded to the front server, either
+        ``x-sendfile`` or ``x-accel-redirect``, or None if they are sent by flask."""
+        sendfile_mode = os.environ.get("PANDARUS_SENDFILE_MODE", "").lower()
+        if sendfile_mode in ("x-sendfile", "x-accel-redirect"):
+            return sendfile_mode
+        return None
+
+    @property
+    def accel_redirect_prefix(self) -> str:
+        """Return the internal location the data directory is served from by nginx
+        for ``X-Accel-Redirect``."""
+        return os.environ.get(
+            "PANDARUS_ACCEL_REDIRECT_PREFIX", "/pandarus_remote_data/"
+        )
+
+    def offload_header(self, file_path: Path) -> Optional[Tuple[str, str]]:
+        """Return the name and value of the header offloading the download of
+        file_path to the front server for sendfile_mode, or None if it isn't set or
+        file_path isn't in the data directory."""
+        if self.sendfile_mode is None:
+            return None
+        file_path = Path(file_path).absolute()
+        if not file_path.is_relative_to(self.data_dir.absolute()):
+            return None
+        if self.sendfile_mode == "x-sendfile":
+            return "X-Sendfile", str(file_path)
+        relative_path = file_path.relative_to(self.data_dir.absolute()).as_posix()
+        return (
+            "X-Accel-Redirect",
+            f"{self.accel_redirect_prefix.rstrip('/')}/{quote(relative_path)}",
+        )
+
+    @property
+    def result_encodings(self) -> Dict[str, str]:
+        """Return the content encodings results are stored with and their file
+        suffixes, in order of preference. zstd is only used if ``zstandard`` is
+        installed."""
+        if zstandard is None:
+            return {"gzip": ".gz"}
+        return {"zstd": ".zst", "gzip": ".gz"}
+
+    def result_sha256(self, file_path: Path) -> str:
+        """Return the hash of a JSON result file, plain or ``bz2`` compressed, without
+        the ``when`` timestamp pandarus writes in its metadata, so identical results
+        calculated at different times get the same hash."""
+        file_path = Path(file_path)
+        with (
+            bz2.open(file_path, "rt", encoding="utf-8")
+            if file_path.suffix == ".bz2"
+            else file_path.open("r", encoding="utf-8")
+        ) as source:
+            result = json.load(source)
+        if isinstance(result, dict) and isinstance(result.get("metadata"), dict):
+            result["metadata"].pop("when", None)
+        return hashlib.sha256(
+            json.dumps(result, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def store_result(self, file_path: Path, directory: Path) -> Path:
+        """Compress a JSON result file, plain or ``bz2`` compressed, once with every
+        result encoding and store it in directory, content-addressed by its
+        result_sha256, so identical results are stored once. Returns the path of the
+        gzip file, the other encodings are stored next to it."""
+        file_path = Path(file_path)
+        sha256 = self.result_sha256(file_path)
+        part_paths = {
+            encoding: directory / f"{uuid.uuid4().hex}.json{suffix}.part"
+            for encoding, suffix in self.result_encodings.items()
+        }
+        opener = bz2.open if file_path.suffix == ".bz2" else open
+        try:
+            with ExitStack() as stack:
+                source = stack.enter_context(opener(file_path, "rb"))
+                writers = [
+                    stack.enter_context(
+                        self._result_writer(
+                            encoding, stack.enter_context(part_path.open("wb"))
+                        )
+                    )
+                    for encoding, part_path in part_paths.items()
+                ]
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    for writer in writers:
+                        writer.write(chunk)
+        except BaseException:
+            for part_path in part_paths.values():
+                part_path.unlink(missing_ok=True)
+            raise
+
+        stored_paths = {
+            encoding: self.store_file(
+                part_path, directory, sha256, f".json{self.result_encodings[encoding]}"
+            )
+            for encoding, part_path in part_paths.items()
+        }
+        file_path.unlink()
+        return stored_paths["gzip"]
+
+    def _result_writer(self, encoding: str, output: BinaryIO) -> BinaryIO:
+        """Return a writer compressing to output with encoding. The compressed bytes
+        only depend on the written bytes, so identical results are stored once."""
+        if encoding == "zstd":
+            return zstandard.ZstdCompressor().stream_writer(output, closefd=False)
+        return gzip.GzipFile(filename="", mode="wb", fileobj=output, mtime=0)
+
+    def is_compressed_result(self, file_path: Path) -> bool:
+        """Return True if file_path is a result file stored by ``store_result``."""
+        return Path(file_path).name.endswith(".json.gz")
+
+    def result_representation(
+        self, file_path: Path, accepted_encodings: Iterable[str]
+    ) -> Tuple[Path, Optional[str]]:
+        """Return the stored representation of a compressed result file in the first
+        accepted encoding and that encoding. If no encoding is accepted, the gzip file
+        is returned with no encoding and has to be decompressed."""
+        json_path = Path(file_path).with_suffix("")
+        for encoding, suffix in self.result_encodings.items():
+            encoded_path = json_path.with_name(f"{json_path.name}{suffix}")
+            if encoding in accepted_encodings and encoded_path.exists():
+                return encoded_path, encoding
+        return Path(file_path), None
+
+    def read_decompressed(self, file_path: Path) -> Iterator[bytes]:
+        """Yield the decompressed content of a gzip result file in chunks, for
+        clients that don't accept any result encoding."""
+        with gzip.open(file_path, "rb") as source:
+            yield from iter(lambda: source.read(self.chunk_size), b"")
+
+    def columnar_path(self, file_path: Path) -> Path:
+        """Return the path of the NPZ file stored next to a compressed result file."""
+        file_path = Path(file_path)
+        return file_path.with_name(f"{self.content_sha256(file_path)}.npz")
+
+    def store_columnar(self, file_path: Path, result_type: str) -> Path:
+        """Store the data of a compressed result file of result_type as an uncompressed
+        NPZ file next to it, with one array per column of result_columns. Stats
+        dictionaries are split into one column per statistic. The JSON metadata is
+        stored in the ``metadata`` array. Returns the path of the NPZ file."""
+        with gzip.open(file_path, "rt", encoding="utf-8") as source:
+            result = json.load(source)
+
+        names = self.result_columns[result_type]
+        columns: Dict[str, List[Any]] = {name: [] for name in names}
+        for row in result["data"]:
+            for name, value in zip(names, row):
+                if isinstance(value, dict):
+                    columns.pop(name, None)
+                    for key, item in value.items():
+                        columns.setdefault(key, []).append(item)
+                else:
+                    columns[name].append(value)
+        arrays = {name: self._column_array(values) for name, values in columns.items()}
+        arrays["metadata"] = np.array(json.dumps(result.get("metadata", {})))
+
+        columnar_path = self.columnar_path(file_path)
+        part_path = columnar_path.with_name(f"{uuid.uuid4().hex}.npz.part")
+        with part_path.open("wb") as output:
+            np.savez(output, **arrays)
+        self.replace_file(part_path, columnar_path)
+        return columnar_path
+
+    def _column_array(self, values: List[Any]) -> np.ndarray:
+        """Return values as an int64, float64 (with NaN for missing values) or string
+        array, so it can be loaded without pickle."""
+        if all(isinstance(value, int) for value in values):
+            return np.array(values, dtype=np.int64)
+        if all(value is None or isinstance(value, (int, float)) for value in values):
+            return np.array(
+                [np.nan if value is None else value for value in values],
+                dtype=np.float64,
+            )
+        return np.array([str(value) for value in values], dtype=np.str_)
+
+    def stream_archive(
+        self, members: Iterable[Tuple[str, Union[Path, bytes]]]
+    ) -> Iterator[bytes]:
+        """Yield a tar archive of members, pairs of a name and a file path or content,
+        while it is built. Files are read in chunks of chunk_size, so the archive is
+        never held in memory."""
+        archive_size = 0
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = (
+                len(content) if isinstance(content, bytes) else content.stat().st_size
+            )
+            info.mode = 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT)
+            yield header
+            if isinstance(content, bytes):
+                yield content
+            else:
+                with content.open("rb") as source:
+                    yield from iter(
+                        lambda source=source: source.read(self.chunk_size), b""
+                    )
+            padding = -info.size % tarfile.BLOCKSIZE
+            yield tarfile.NUL * padding
+            archive_size += len(header) + info.size + padding
+
+        # End of archive marker, padded to a full record like tarfile does
+        archive_size += 2 * tarfile.BLOCKSIZE
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE + -archive_size % tarfile.RECORDSIZE)
+
+
+class DatasetStorageMixin:
+    """Mixin of the IOHelper storing the canonical copies and bounds of datasets."""
+
+    def store_canonical_vector(
+        self, file_path: Path, layer: Optional[str] = None
+    ) -> Optional[Path]:
+        """Convert the vector file at file_path to FlatGeobuf, a binary format, and
+        store it next to it as ``<hash>.fgb``. Returns the canonical path, or None if
+        the file can't be converted. The FlatGeobuf spatial index sorts the features,
+        so it isn't written: calculations number features in file order and have to
+        give the same results for both files. The stored bounds index the features
+        instead."""
+        canonical_path = Path(file_path).with_name(
+            f"{self.content_sha256(file_path)}.fgb"
+        )
+        if canonical_path.exists():
+            return canonical_path
+
+        # GDAL picks the FlatGeobuf layout from the .fgb extension
+        part_path = canonical_path.with_name(f"{uuid.uuid4().hex}.part.fgb")
+        try:
+            with fiona.open(file_path, layer=layer) as source:
+                with fiona.open(
+                    part_path,
+                    "w",
+                    driver="FlatGeobuf",
+                    crs=source.crs,
+                    schema=source.schema,
+                    SPATIAL_INDEX="NO",
+                ) as sink:
+                    sink.writerecords(source)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.warning("Can't convert %s to FlatGeobuf.", file_path, exc_info=True)
+            part_path.unlink(missing_ok=True)
+            return None
+        self.replace_file(part_path, canonical_path)
+        return canonical_path
+
+    def store_canonical_raster(self, file_path: Path) -> Optional[Path]:
+        """Convert the raster file at file_path to a Cloud Optimized GeoTIFF, tiled,
+        compressed and with overviews, and store it next to it as
+        ``<hash>.cog.tif``. Returns the canonical path, or None if the file can't be
+        converted."""
+        canonical_path = Path(file_path).with_name(
+            f"{self.content_sha256(file_path)}.cog.tif"
+        )
+        if canonical_path.exists():
+            return canonical_path
+
+        part_path = canonical_path.with_name(f"{uuid.uuid4().hex}.part.tif")
+        try:
+            rasterio.shutil.copy(
+                str(file_path),
+                str(part_path),
+                driver="COG",
+                compress="DEFLATE",
+                predictor="YES",
+                bigtiff="IF_SAFER",
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.warning("Can't convert %s to COG.", file_path, exc_info=True)
+            part_path.unlink(missing_ok=True)
+            return None
+        self.replace_file(part_path, canonical_path)
+        return canonical_path
+
+    def rename_vector(self, file_path: Path, name: str) -> Path:
+        """Rewrite the vector file pandarus created at file_path as name in the same
+        directory and return its path. Drivers like GeoJSON store the layer name, the
+        file name, so renaming the file isn't enough."""
+        file_path = Path(file_path)
+        renamed_path = file_path.with_name(name)
+        with fiona.open(file_path) as source:
+            with fiona.open(
+                renamed_path,
+                "w",
+                driver=source.driver,
+                crs=CRS.from_string(WGS84),
+                schema=source.schema,
+            ) as sink:
+                sink.writerecords(source)
+        file_path.unlink()
+        return renamed_path
+
+    def rewrite_metadata(self, file_path: Path, **files: File) -> None:
+        """Describe files, by their metadata key, in the metadata of the JSON result
+        file at file_path as they are stored, instead of the canonical copies pandarus
+        read."""
+        file_path = Path(file_path)
+        with file_path.open("r", encoding="utf-8") as source:
+            result = json.load(source)
+        for key, file in files.items():
+            result["metadata"][key].update(
+                path=str(file.file_path),
+                filename=os.path.basename(file.file_path),
+                sha256=file.sha256,
+            )
+        with file_path.open("w", encoding="utf-8") as output:
+            json.dump(result, output, ensure_ascii=False)
+
+    def bounds_path(self, file_path: Path) -> Path:
+        """Return the path of the bounds index stored next to a vector file."""
+        file_path = Path(file_path)
+        return file_path.with_name(f"{file_path.name.split('.', 1)[0]}.bounds.npy")
+
+    def store_bounds(self, file_path: Path) -> Optional[Path]:
+        """Store the lat/long bounds of every feature of the vector file at file_path,
+        the input of the rtree index pandarus builds for intersections, next to it.
+        Returns the bounds path, or None if the bounds can't be computed."""
+        bounds_path = self.bounds_path(file_path)
+        if bounds_path.exists():
+            return bounds_path
+
+        try:
+            vector = Map(str(file_path))
+            try:
+                bounds = np.array(
+                    [geom.bounds for _, geom in vector.iter_latlong()],
+                    dtype=np.float64,
+                ).reshape(-1, 4)
+            finally:
+                vector.file.close()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.warning("Can't compute the bounds of %s.", file_path, exc_info=True)
+            return None
+
+        part_path = bounds_path.with_name(f"{uuid.uuid4().hex}.bounds.npy.part")
+        with part_path.open("wb") as output:
+            np.save(output, bounds)
+        self.replace_file(part_path, bounds_path)
+        return bounds_path
+
+    def load_rtree_index(self, file_path: Path) -> Optional[rtree.index.Index]:
+        """Return an rtree index bulk loaded from the stored bounds of the vector file
+        at file_path, or None if its bounds aren't stored."""
+        bounds_path = self.bounds_path(file_path)
+        if not bounds_path.exists():
+            return None
+
+        bounds = np.load(bounds_path, mmap_mode="r")
+        if len(bounds) == 0:
+            return rtree.index.Index()
+        return rtree.index.Index(
+            (index, tuple(feature_bounds), None)
+            for index, feature_bounds in enumerate(bounds)
+        )
@@ -0,0 +1,289 @@
+"""Upload helpers for the __pandarus_remote__ web service, mixed into the IOHelper
+and the DatabaseHelper."""
+
+import hashlib
+import io
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import fiona
+from pandarus.errors import UnknownDatasetTypeError
+from pandarus.utils.conversion import check_dataset_type
+from pandarus.utils.io import sha256_file
+from peewee import DoesNotExist
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+
+from .errors import (
+    FileAlreadyExistsError,
+    InvalidSpatialDatasetError,
+    NoneReproducibleHashError,
+    UploadNotFoundError,
+)
+from .models import File, Upload, UploadChunk
+from .utils import loggable
+
+
+class StagingFile(io.FileIO):
+    """Staging file an uploaded file is written to while the request is parsed,
+    hashing its content, so it can be moved to the storage without being copied.
+    Closing it removes the staging file unless it was moved."""
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(path, "w+b")
+        self.path = Path(path)
+        self.hasher = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        written = super().write(data)
+        self.hasher.update(memoryview(data)[:written])
+        return written
+
+    def close(self) -> None:
+        super().close()
+        self.path.unlink(missing_ok=True)
+
+
+class UploadStorageMixin:
+    """Mixin of the IOHelper storing uploaded files."""
+
+    upload_chunk_size: int = 64 * 1024 * 1024
+
+    @property
+    def async_ingest(self) -> bool:
+        """Return True if uploads are validated in a background ingest job."""
+        return os.environ.get("PANDARUS_ASYNC_INGEST", "").lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+
+    @property
+    def max_upload_size(self) -> int:
+        """Return the largest size in bytes of a resumable upload, 10 GiB by
+        default."""
+        try:
+            return int(os.environ["PANDARUS_MAX_UPLOAD_SIZE"])
+        except (KeyError, ValueError):
+            return 10 * 1024 * 1024 * 1024
+
+    @property
+    def upload_ttl(self) -> int:
+        """Return the number of seconds after which an unfinished resumable upload
+        expires, a day by default."""
+        try:
+            return int(os.environ["PANDARUS_UPLOAD_TTL"])
+        except (KeyError, ValueError):
+            return 24 * 60 * 60
+
+    def staging_file_path(self, upload_id: str) -> Path:
+        """Return the staging file path of a resumable upload."""
+        return self.uploads_dir / f"{upload_id}.part"
+
+    def create_staging_file(self, upload: Upload) -> None:
+        """Create the staging file of a resumable upload with its final size, so
+        chunks can be written in any order."""
+        with Path(upload.staging_file_path).open("wb") as staging_file:
+            staging_file.truncate(upload.size)
+
+    def store_upload(self, upload: Upload) -> Path:
+        """Move a completely received resumable upload to its content-addressed path
+        in the uploads directory and return it. Raises NoneReproducibleHashError if
+        the upload hash is not reproducible."""
+        staging_file_path = Path(upload.staging_file_path)
+        if sha256_file(staging_file_path) != upload.sha256:
+            staging_file_path.unlink()
+            raise NoneReproducibleHashError(upload.name)
+
+        return self.store_file(
+            staging_file_path,
+            self.uploads_dir,
+            upload.sha256,
+            "".join(Path(secure_filename(upload.name)).suffixes),
+        )
+
+    def finalize_upload(self, upload: Upload) -> File:
+        """Store a completely received resumable upload and return its File.
+        Raises InvalidSpatialDatasetError if the file is not a valid spatial dataset.
+        Raises NoneReproducibleHashError if the upload hash is not reproducible."""
+        return self.create_file(
+            self.store_upload(upload),
+            upload.name,
+            upload.sha256,
+            upload.layer,
+            upload.field,
+            upload.band,
+        )
+
+    def store_uploaded_file(self, file: FileStorage, name: str, file_hash: str) -> Path:
+        """Save an uploaded file to its content-addressed path in the uploads directory
+        and return it. A file received into a StagingFile is moved there, others are
+        written to a staging file first. Raises NoneReproducibleHashError if the
+        file_hash is not reproducible."""
+        if isinstance(file.stream, StagingFile):
+            staging_file_path = file.stream.path
+            our_hash = file.stream.hasher.hexdigest()
+        else:
+            staging_file_path = self.staging_file_path(uuid.uuid4().hex)
+            our_hash = self.write_stream(file.stream, staging_file_path)
+        if our_hash != file_hash:
+            staging_file_path.unlink()
+            raise NoneReproducibleHashError(name)
+
+        return self.store_file(
+            staging_file_path,
+            self.uploads_dir,
+            our_hash,
+            "".join(Path(secure_filename(name)).suffixes),
+        )
+
+    def save_uploaded_file(
+        self,
+        file: FileStorage,
+        name: str,
+        file_hash: str,
+        layer: Optional[str] = None,
+        field: Optional[str] = None,
+        band: Optional[str] = None,
+    ) -> File:
+        """Save an uploaded file to its content-addressed path in the uploads directory.
+        Raises InvalidSpatialDatasetError if the file is not a valid spatial dataset.
+        Raises NoneReproducibleHashError if the file_hash is not reproducible."""
+        file_path = self.store_uploaded_file(file, name, file_hash)
+        return self.create_file(file_path, name, file_hash, layer, field, band)
+
+    def create_file(
+        self,
+        file_path: Path,
+        name: str,
+        file_hash: str,
+        layer: Optional[str] = None,
+        field: Optional[str] = None,
+        band: Optional[str] = None,
+    ) -> File:
+        """Create a File for a dataset saved at file_path. Raises
+        InvalidSpatialDatasetError and removes the file if it is not a valid spatial
+        dataset."""
+        try:
+            kind = check_dataset_type(file_path)
+        except UnknownDatasetTypeError as udte:
+            self.delete_file(file_path)
+            raise InvalidSpatialDatasetError(name) from udte
+        if kind == "vector":
+            band = None
+            with fiona.open(file_path) as src:
+                geom_type = src.meta["schema"]["geometry"]
+        else:  # kind == "raster"
+            layer = field = geom_type = None
+
+        return File(
+            file_path=file_path,
+            name=secure_filename(name),
+            sha256=file_hash,
+            band=band,
+            layer=layer,
+            field=field,
+            kind=kind,
+            geometry_type=geom_type,
+        )
+
+
+class UploadDatabaseMixin:
+    """Mixin of the DatabaseHelper recording files and resumable uploads."""
+
+    @loggable
+    def file_exists(self, sha256: str) -> bool:
+        """Return True if a file with sha256 exists in the database and its stored
+        file isn't missing."""
+        return File.select().where((File.sha256 == sha256) & ~File.missing).exists()
+
+    @loggable
+    def existing_files(self, sha256s: List[str]) -> List[str]:
+        """Return the hashes of sha256s which exist in the database, with a stored file
+        which isn't missing. Hashes are looked up in batches of query_batch_size to
+        stay under the SQLite variables limit."""
+        existing = set()
+        for start in range(0, len(sha256s), self.query_batch_size):
+            batch = sha256s[start : start + self.query_batch_size]
+            existing.update(
+                sha256
+                for (sha256,) in File.select(File.sha256)
+                .where(File.sha256.in_(batch) & ~File.missing)
+                .tuples()
+                .iterator()
+            )
+        return [sha256 for sha256 in sha256s if sha256 in existing]
+
+    @loggable
+    def add_upload(self, upload: Upload) -> None:
+        """Add a resumable upload to the database. Raises FileAlreadyExistsError if a
+        file with the same hash already exists."""
+        if self.file_exists(upload.sha256):
+            raise FileAlreadyExistsError(upload.name)
+        upload.save(force_insert=True)
+
+    @loggable
+    def get_upload(self, upload_id: str) -> Upload:
+        """Return a resumable upload. Raises UploadNotFoundError if it doesn't exist."""
+        try:
+            return Upload.get(Upload.id == upload_id)
+        except DoesNotExist as dne:
+            raise UploadNotFoundError(upload_id) from dne
+
+    @loggable
+    def add_upload_chunk(self, upload: Upload, index: int, sha256: str) -> None:
+        """Add a received chunk to a resumable upload, replacing a previous one with
+        the same index."""
+        UploadChunk.insert(upload=upload, index=index, sha256=sha256).on_conflict(
+            conflict_target=[UploadChunk.upload, UploadChunk.index],
+            update={UploadChunk.sha256: sha256},
+        ).execute()
+
+    @loggable
+    def get_upload_status(self, upload: Upload) -> Dict[str, Any]:
+        """Return the received and missing chunk indices of a resumable upload."""
+        received = [
+            obj.index
+            for obj in UploadChunk.select(UploadChunk.index)
+            .where(UploadChunk.upload == upload)
+            .order_by(UploadChunk.index)
+        ]
+        received_set = set(received)
+        return {
+            "upload_id": upload.id,
+            "chunk_size": upload.chunk_size,
+            "received": received,
+            "missing": [
+                index for index in range(upload.n_chunks) if index not in received_set
+            ],
+        }
+
+    @loggable
+    def delete_upload(self, upload: Upload) -> None:
+        """Delete a resumable upload and its received chunks from the database."""
+        with self.atomic:
+            upload.delete_instance(recursive=True)
+
+    @loggable
+    def add_uploaded_file(self, file: File) -> None:
+        """Add a file to the database and enqueue the conversion to its canonical
+        format. A file whose stored file is missing is replaced. Raises
+        FileAlreadyExistsError if the file already exists, after removing the stored
+        file if it was stored under another suffix than the existing file."""
+        existing_file = File.get_or_none(File.sha256 == file.sha256)
+        if existing_file is not None and not existing_file.missing:
+            if Path(existing_file.file_path) != Path(file.file_path):
+                self.io_helper.delete_file(file.file_path)
+            raise FileAlreadyExistsError(file.name)
+        if existing_file is not None:
+            # The storage sweep found the stored file missing, the entry is reused
+            file.id = existing_file.id
+        with self.atomic:
+            file.save()
+            self.record_catalog_changes("added", [file])
+        self.invalidate_catalog([file])
+        if existing_file is not None:
+            self.invalidate_file_cache()
+        self.redis_helper.enqueue_canonical_job(file)
@@ -1,21 +1,26 @@
 """Utility functions for the __pandarus_remote__ package."""
 
 import logging
-import os
 from functools import wraps
 from http import HTTPStatus
 from pathlib import Path
 from typing import Any, Callable, Dict, Tuple
 
-from flask import Response, send_file, url_for
+from flask import Response, url_for
 
 from .errors import (
+    FileAlreadyExistsError,
+    IncompleteUploadError,
     IntersectionWithSelfError,
+    InvalidChunkError,
     InvalidIntersectionFileTypesError,
     InvalidIntersectionGeometryTypeError,
     InvalidRasterstatsFileTypesError,
+    InvalidSpatialDatasetError,
     NoEntryFoundError,
+    NoneReproducibleHashError,
     ResultAlreadyExistsError,
+    UploadNotFoundError,
 )
 
 
@@ -60,33 +65,6 @@ def create_if_not_exists(
     return wrapper
 
 
-def get_calculation_endpoint(
-    calculation_function: Callable[[], str]
-) -> Callable[[], Response]:
-    """Decorator for get_calculation endpoints."""
-
-    @wraps(calculation_function)
-    def wrapper() -> Path:
-        """Wrapper function for get_calculation endpoints."""
-        try:
-            result = calculation_function()
-            return (
-                send_file(
-                    result,
-                    mimetype="application/octet-stream",
-                    as_attachment=True,
-                    download_name=os.path.basename(result),
-                ),
-                HTTPStatus.OK,
-            )
-        except NoEntryFoundError as nefe:
-            return {"error": str(nefe)}, HTTPStatus.NOT_FOUND
-        except ResultAlreadyExistsError as raee:
-            return {"error": str(raee)}, HTTPStatus.CONFLICT
-
-    return wrapper
-
-
 def calculate_endpoint(
     calculation_function: Callable[[], str]
 ) -> Callable[[], Response]:
@@ -115,3 +93,29 @@ def calculate_endpoint(
             return {"error": str(iwse)}, HTTPStatus.BAD_REQUEST
 
     return wrapper
+
+
+def upload_endpoint(
+    upload_function: Callable[..., Tuple[Dict[str, Any], HTTPStatus]]
+) -> Callable[..., Response]:
+    """Decorator for resumable upload endpoints."""
+
+    @wraps(upload_function)
+    def wrapper(*args: Tuple[Any], **kwargs: Dict[str, Any]) -> Response:
+        """Wrapper function for resumable upload endpoints."""
+        try:
+            return upload_function(*args, **kwargs)
+        except UploadNotFoundError as unfe:
+            return {"error": str(unfe)}, HTTPStatus.NOT_FOUND
+        except InvalidChunkError as ice:
+            return {"error": str(ice)}, HTTPStatus.BAD_REQUEST
+        except NoneReproducibleHashError as nrhe:
+            return {"error": str(nrhe)}, HTTPStatus.BAD_REQUEST
+        except IncompleteUploadError as iue:
+            return {"error": str(iue)}, HTTPStatus.CONFLICT
+        except FileAlreadyExistsError as faee:
+            return {"error": str(faee)}, HTTPStatus.CONFLICT
+        except InvalidSpatialDatasetError as isde:
+            return {"error": str(isde)}, HTTPStatus.UNPROCESSABLE_ENTITY
+
+    return wrapper
@@ -0,0 +1,78 @@
+"""Helper script to compare the payload size and enqueue throughput of jobs taking
+pickled File entries with jobs taking hashes serialized by the TaskSerializer."""
+
+import argparse
+import hashlib
+import time
+import zlib
+
+from fakeredis import FakeStrictRedis
+from redis import Redis
+from rq import Queue
+from rq.serializers import DefaultSerializer
+
+from pandarus_remote.helpers import TaskHelper, TaskSerializer
+from pandarus_remote.models import File
+
+
+def benchmark(queue: Queue, args: tuple, count: int) -> tuple:
+    """Enqueue count raster stats jobs with args and return the payload size of a
+    job in bytes, before and after compression, and the number of jobs enqueued per
+    second. The jobs are deleted afterwards."""
+    start = time.perf_counter()
+    jobs = [
+        queue.enqueue_call(TaskHelper().raster_stats_task, args) for _ in range(count)
+    ]
+    elapsed = time.perf_counter() - start
+    data = queue.connection.hget(jobs[0].key, "data")
+    for job in jobs:
+        job.delete()
+    return len(zlib.decompress(data)), len(data), count / elapsed
+
+
+def main() -> None:
+    """Print the payload size and enqueue throughput of both kinds of jobs."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", help="Redis to enqueue to, fakeredis if unset")
+    parser.add_argument("--count", type=int, default=2000)
+    arguments = parser.parse_args()
+    connection = (
+        Redis.from_url(arguments.redis_url)
+        if arguments.redis_url
+        else FakeStrictRedis()
+    )
+
+    files = [
+        File(
+            id=index,
+            name=f"{kind}.{extension}",
+            kind=kind,
+            sha256=hashlib.sha256(str(index).encode()).hexdigest(),
+            file_path=f"/data/uploads/{index * 2}/{index}.{extension}",
+            canonical_file_path=f"/data/uploads/{index * 2}/{index}.cog.tif",
+            band=1,
+            layer=None,
+            field="name",
+            geometry_type="Polygon",
+        )
+        for index, kind, extension in ((1, "vector", "geojson"), (2, "raster", "tif"))
+    ]
+    cases = {
+        "pickled File entries": (DefaultSerializer, (files[0], files[1], 1)),
+        "JSON hashes": (TaskSerializer, (files[0].sha256, files[1].sha256, 1)),
+    }
+    for name, (serializer, args) in cases.items():
+        queue = Queue(
+            f"benchmark-{serializer.__name__}",
+            connection=connection,
+            serializer=serializer,
+        )
+        size, compressed_size, rate = benchmark(queue, args, arguments.count)
+        print(
+            f"{name}: {size} bytes ({compressed_size} compressed) per job, "
+            f"{rate:.0f} jobs/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
 #!/bin/bash
 
-rq worker-pool -u redis://redis:6379 --logging-level info
+rq worker-pool -u redis://redis:6379 --serializer pandarus_remote.helpers.TaskSerializer --logging-level info
@@ -13,8 +13,24 @@ from pandarus.utils.io import sha256_file
 from werkzeug.datastructures import FileStorage
 
 from pandarus_remote.app import create_app
-from pandarus_remote.helpers import DatabaseHelper, IOHelper, RedisHelper
-from pandarus_remote.models import File, Intersection, RasterStats, Remaining
+from pandarus_remote.helpers import DatabaseHelper, IOHelper, RedisHelper, TaskHelper
+from pandarus_remote.models import (
+    CatalogChange,
+    File,
+    Intersection,
+    RasterStats,
+    Remaining,
+    Upload,
+    UploadChunk,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_helpers() -> None:
+    """Reset the helper singletons, so every test creates its own helpers instead of
+    using the ones, and the database and redis connections, of a previous test."""
+    for helper in (IOHelper, DatabaseHelper, RedisHelper, TaskHelper):
+        helper._instance = None  # pylint: disable=protected-access
 
 
 @pytest.fixture
@@ -56,14 +72,21 @@ def cleanup_databse() -> None:
     Intersection.delete().execute(None)
     RasterStats.delete().execute(None)
     Remaining.delete().execute(None)
+    UploadChunk.delete().execute(None)
+    Upload.delete().execute(None)
+    CatalogChange.delete().execute(None)
+    DatabaseHelper().invalidate_file_cache()
 
 
 @pytest.fixture
-def database_helper() -> Generator[DatabaseHelper, None, None]:
+def database_helper(
+    redis_helper,  # pylint: disable=redefined-outer-name,unused-argument
+) -> Generator[DatabaseHelper, None, None]:
     """Mock a temporary in-memory database and return a DatabaseHelper.
     If insert_files is True, insert two files. If insert_intersections is True,
     insert two intersections. If insert_raster_stats is True, insert two
-    raster stats. If insert_remaining is True, insert two remaining."""
+    raster stats. If insert_remaining is True, insert two remaining. Redis is
+    mocked too, as adding entries bumps the catalog generation."""
 
     @wraps(database_helper)
     def wrapper(
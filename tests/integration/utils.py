@@ -128,6 +128,7 @@ def run_calculation(
     WindowsSimpleWorker(
         connection=RedisHelper().queue.connection,
         queues=[RedisHelper().queue],
+        serializer=RedisHelper().queue.serializer,
     ).work(burst=True)
     response = client_app.get(f"/status/{job_id}")
     assert_response(response, HTTPStatus.OK, "finished", "status")
@@ -0,0 +1,270 @@
+"""Test cases for the storage maintenance of the __DatabaseHelper__ class."""
+
+import datetime
+import json
+import os
+from pathlib import Path
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+from pandarus_remote.helpers import RedisHelper
+from pandarus_remote.models import (
+    File,
+    Intersection,
+    RasterStats,
+    Remaining,
+    Upload,
+    UploadChunk,
+)
+
+from ... import FILE_VECTOR1
+
+
+def test_evict_result_records_catalog_change(database_helper) -> None:
+    """Test the DatabaseHelper.evict_result method records the removal."""
+    helper = database_helper(inserted_files=2, insert_raster_stats=True)
+    since = helper.catalog_change_sequence
+    helper.evict_result(RasterStats.get(RasterStats.id == 1))
+    assert [
+        (change["type"], change["action"])
+        for change in helper.catalog_changes(since)["changes"]
+    ] == [("raster_stats", "removed")]
+
+
+def test_migrate_schema(database_helper) -> None:
+    """Test the DatabaseHelper.migrate_schema method adds missing columns."""
+    helper = database_helper()
+    database = Remaining._meta.database  # pylint: disable=no-member,protected-access
+    migrate(SqliteMigrator(database).drop_column("remaining", "data_sha256"))
+    assert "data_sha256" not in [c.name for c in database.get_columns("remaining")]
+
+    helper.migrate_schema([File, Remaining])
+    assert "data_sha256" in [c.name for c in database.get_columns("remaining")]
+
+
+def test_store_missing_bounds(database_helper, io_helper, tmp_path) -> None:
+    """Test the DatabaseHelper.store_missing_bounds method."""
+    helper = database_helper(inserted_files=2)
+    file_path = tmp_path / "vector.geojson"
+    file_path.write_bytes(FILE_VECTOR1.read_bytes())
+    File.update(file_path=str(file_path), kind="vector").where(File.id == 1).execute(
+        None
+    )
+
+    assert helper.store_missing_bounds() == 1
+    assert io_helper.bounds_path(file_path).exists()
+    assert helper.store_missing_bounds() == 0
+
+
+def test_migrate_storage(database_helper, io_helper) -> None:
+    """Test the DatabaseHelper.migrate_storage method."""
+    helper = database_helper(inserted_files=2, insert_intersections=True)
+    upload_path = io_helper.uploads_dir / "uuid.upload.txt"
+    upload_path.write_text("upload")
+    vector_path = io_helper.intersections_dir / "vector.geojson"
+    vector_path.write_text("vector")
+    data_path = io_helper.intersections_dir / "data.json.bz2"
+    data_path.write_text("data")
+    File.update(file_path=str(upload_path)).where(File.id == 1).execute(None)
+    File.update(file_path=str(vector_path)).where(File.id == 2).execute(None)
+    Intersection.update(
+        data_file_path=str(data_path), vector_file_path=str(vector_path)
+    ).where(Intersection.id == 1).execute(None)
+
+    assert helper.migrate_storage() == 4
+    file1, file2 = File.get(File.id == 1), File.get(File.id == 2)
+    intersection = Intersection.get(Intersection.id == 1)
+    assert io_helper.is_stored(file1.file_path, io_helper.uploads_dir)
+    assert io_helper.is_stored(file2.file_path, io_helper.uploads_dir)
+    assert io_helper.is_stored(intersection.data_file_path, io_helper.intersections_dir)
+    assert io_helper.is_stored(
+        intersection.vector_file_path, io_helper.intersections_dir
+    )
+    assert Path(file2.file_path).samefile(intersection.vector_file_path)
+    assert not upload_path.exists()
+    assert not vector_path.exists()
+    assert Intersection.get(Intersection.id == 2).data_file_path == "data_path2"
+    assert helper.migrate_storage() == 0
+
+
+def _store_result(io_helper, directory: Path, content: str) -> str:
+    """Store a JSON result of content in directory and return its path."""
+    file_path = directory / "result.json"
+    file_path.write_text(content)
+    return str(io_helper.store_result(file_path, directory))
+
+
+def test_evict_results(database_helper, io_helper, monkeypatch) -> None:
+    """Test the DatabaseHelper.evict_results method evicts the least recently
+    accessed results, with the remaining of an evicted intersection, by the running
+    storage usage."""
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    helper = database_helper(
+        inserted_files=2,
+        insert_raster_stats=True,
+        insert_intersections=True,
+        insert_remaining=True,
+    )
+    upload_path = io_helper.uploads_dir / "upload.txt"
+    upload_path.write_text("upload" * 1000)
+    for model, field, directory in (
+        (Intersection, Intersection.data_file_path, io_helper.intersections_dir),
+        (RasterStats, RasterStats.output_file_path, io_helper.raster_stats_dir),
+        (Remaining, Remaining.data_file_path, io_helper.remaining_dir),
+    ):
+        for result_id in (1, 2):
+            model.update(
+                {
+                    field: _store_result(
+                        io_helper,
+                        directory,
+                        json.dumps({"data": [f"{model.__name__}{result_id}" * 100]}),
+                    ),
+                    model.last_accessed: datetime.datetime(2024, 1, result_id),
+                }
+            ).where(model.id == result_id).execute(None)
+    Intersection.update(last_accessed=None).where(Intersection.id == 2).execute(None)
+    RasterStats.update(pinned=True).where(RasterStats.id == 1).execute(None)
+    evicted_path = Path(Intersection.get(Intersection.id == 2).data_file_path)
+
+    assert helper.evict_results(io_helper.storage_usage() + 1) == 0
+    assert helper.evict_results(io_helper.storage_usage() - 1) == 1
+    assert Intersection.get_or_none(Intersection.id == 2) is None
+    assert Remaining.get_or_none(Remaining.intersection == 2) is None
+    assert not evicted_path.exists()
+    assert not io_helper.columnar_path(evicted_path).exists()
+    assert RedisHelper().storage_usage == io_helper.storage_usage()
+
+    assert helper.evict_results(0) == 2
+    assert [obj.id for obj in RasterStats.select()] == [1]
+    assert Intersection.select().count(None) == 0
+    assert Remaining.select().count(None) == 0
+    assert upload_path.exists()
+
+
+def test_evict_results_pinned_remaining(database_helper, io_helper) -> None:
+    """Test the DatabaseHelper.evict_results method keeps the intersection of a
+    pinned remaining."""
+    helper = database_helper(
+        inserted_files=2, insert_intersections=True, insert_remaining=True
+    )
+    (io_helper.uploads_dir / "upload.txt").write_text("upload")
+    Remaining.update(pinned=True).where(Remaining.id == 1).execute(None)
+
+    assert helper.evict_results(0) == 1
+    assert [obj.id for obj in Intersection.select()] == [1]
+    assert [obj.id for obj in Remaining.select()] == [1]
+
+
+def test_evict_result_shared_file(database_helper, io_helper) -> None:
+    """Test the DatabaseHelper.evict_result method keeps files shared by other
+    results."""
+    helper = database_helper(inserted_files=2, insert_raster_stats=True)
+    file_path = _store_result(io_helper, io_helper.raster_stats_dir, "{}")
+    RasterStats.update(output_file_path=file_path).execute(None)
+
+    assert helper.evict_result(RasterStats.get(RasterStats.id == 1)) == 0
+    assert Path(file_path).exists()
+    assert helper.evict_result(RasterStats.get(RasterStats.id == 2)) > 0
+    assert not Path(file_path).exists()
+
+
+def test_sweep_storage(database_helper, io_helper) -> None:
+    """Test the DatabaseHelper.sweep_storage method deletes orphaned files and flags
+    entries with missing files."""
+    helper = database_helper(inserted_files=2, insert_raster_stats=True)
+    file_path = io_helper.content_path(io_helper.uploads_dir, "a" * 64, ".geojson")
+    file_path.parent.mkdir(parents=True)
+    file_path.write_text("file")
+    bounds_path = io_helper.bounds_path(file_path)
+    bounds_path.write_text("bounds")
+    orphan_path = io_helper.content_path(io_helper.uploads_dir, "a" * 64, ".fgb")
+    orphan_path = orphan_path.with_name(f"{'b' * 64}.fgb")
+    orphan_path.write_text("orphan")
+    # The same content stored under the suffix of another name isn't referenced
+    duplicate_path = file_path.with_suffix(".json")
+    duplicate_path.write_text("file")
+    upload_path = io_helper.uploads_dir / "uuid.upload.txt"
+    upload_path.write_text("upload")
+    result_path = _store_result(io_helper, io_helper.raster_stats_dir, "{}")
+    for path in (
+        file_path,
+        bounds_path,
+        orphan_path,
+        duplicate_path,
+        Path(result_path),
+    ):
+        os.utime(path, (0, 0))
+    File.update(file_path=str(file_path)).where(File.id == 1).execute(None)
+    RasterStats.update(output_file_path=result_path).where(RasterStats.id == 1).execute(
+        None
+    )
+
+    since = helper.catalog_change_sequence
+    assert helper.sweep_storage(dry_run=True) == {
+        "orphaned_files": 2,
+        "missing_entries": 2,
+        "expired_uploads": 0,
+    }
+    assert orphan_path.exists()
+    assert not File.get(File.id == 2).missing
+
+    assert helper.sweep_storage() == {
+        "orphaned_files": 2,
+        "missing_entries": 2,
+        "expired_uploads": 0,
+    }
+    assert not orphan_path.exists() and not duplicate_path.exists()
+    assert file_path.exists() and bounds_path.exists() and upload_path.exists()
+    assert Path(result_path).exists()
+    assert [obj.id for obj in File.select().where(File.missing).iterator()] == [2]
+    assert [
+        obj.id for obj in RasterStats.select().where(RasterStats.missing).iterator()
+    ] == [2]
+    changes = helper.catalog_changes(since)["changes"]
+    assert [(change["type"], change["action"]) for change in changes] == [
+        ("files", "removed"),
+        ("raster_stats", "removed"),
+    ]
+
+    File.update(file_path=str(upload_path)).where(File.id == 2).execute(None)
+    assert helper.sweep_storage(grace_period=0) == {
+        "orphaned_files": 0,
+        "missing_entries": 1,
+        "expired_uploads": 0,
+    }
+    assert not File.get(File.id == 2).missing
+    assert helper.catalog_changes(changes[-1]["cursor"])["changes"][0]["action"] == (
+        "added"
+    )
+
+
+def test_sweep_storage_expired_uploads(monkeypatch, database_helper, io_helper) -> None:
+    """Test the DatabaseHelper.sweep_storage method deletes the resumable uploads
+    started more than upload_ttl seconds ago, with their chunks and staging files."""
+    helper = database_helper()
+    staging_paths = []
+    for upload_id, age in (("expired", 120), ("pending", 0)):
+        upload = Upload(
+            id=upload_id,
+            name="name",
+            sha256="sha256",
+            size=6,
+            chunk_size=6,
+            staging_file_path=str(io_helper.staging_file_path(upload_id)),
+            created_at=datetime.datetime.now() - datetime.timedelta(seconds=age),
+        )
+        Path(upload.staging_file_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(upload.staging_file_path).write_text("upload", encoding="utf-8")
+        helper.add_upload(upload)
+        helper.add_upload_chunk(upload, 0, "chunk_sha256")
+        staging_paths.append(Path(upload.staging_file_path))
+    monkeypatch.setenv("PANDARUS_UPLOAD_TTL", "60")
+
+    assert helper.sweep_storage(dry_run=True)["expired_uploads"] == 1
+    assert Upload.select().count(None) == 2 and staging_paths[0].exists()
+
+    assert helper.sweep_storage()["expired_uploads"] == 1
+    assert [upload.id for upload in Upload.select().iterator()] == ["pending"]
+    assert UploadChunk.select().count(None) == 1
+    assert not staging_paths[0].exists() and staging_paths[1].exists()
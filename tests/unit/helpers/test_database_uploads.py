@@ -0,0 +1,192 @@
+"""Test cases for the uploads of the __DatabaseHelper__ class."""
+
+import pytest
+from peewee import PostgresqlDatabase
+
+from pandarus_remote.errors import FileAlreadyExistsError, UploadNotFoundError
+from pandarus_remote.helpers import RedisHelper
+from pandarus_remote.models import File, Upload, UploadChunk
+
+
+def _upload(sha256: str = "sha256") -> Upload:
+    """Return a resumable upload of 5 bytes in chunks of 2 bytes."""
+    return Upload(
+        id="upload_id",
+        name="name",
+        sha256=sha256,
+        size=5,
+        chunk_size=2,
+        staging_file_path="staging_file_path",
+    )
+
+
+def test_file_exists(database_helper) -> None:
+    """Test the DatabaseHelper.file_exists method."""
+    helper = database_helper(inserted_files=1)
+    assert helper.file_exists("sha2561")
+    assert not helper.file_exists("sha2562")
+    File.update(missing=True).execute(None)
+    assert not helper.file_exists("sha2561")
+
+
+def test_existing_files(database_helper, monkeypatch) -> None:
+    """Test the DatabaseHelper.existing_files method."""
+    helper = database_helper(inserted_files=3)
+    monkeypatch.setattr(helper, "query_batch_size", 2)
+    assert helper.existing_files(["sha2563", "sha2564", "sha2561", "sha2562"]) == [
+        "sha2563",
+        "sha2561",
+        "sha2562",
+    ]
+    assert helper.existing_files([]) == []
+    File.update(missing=True).where(File.id == 1).execute(None)
+    assert helper.existing_files(["sha2561", "sha2562"]) == ["sha2562"]
+
+
+def test_add_uploaded_file_not_exists(database_helper) -> None:
+    """Test the DatabaseHelper.add_uploaded_file method and file doesn't exist."""
+    database_helper().add_uploaded_file(
+        File(
+            name="name",
+            kind="kind",
+            sha256="sha256",
+            file_path="file_path",
+        )
+    )
+    assert File.select().where(File.sha256 == "sha256").exists()
+
+
+def test_add_uploaded_file_bumps_catalog_generation(database_helper) -> None:
+    """Test the DatabaseHelper.add_uploaded_file method bumps the catalog
+    generation."""
+    generation = RedisHelper().catalog_generation
+    database_helper().add_uploaded_file(
+        File(name="name", kind="kind", sha256="sha256", file_path="file_path")
+    )
+    assert RedisHelper().catalog_generation == generation + 1
+
+
+def test_add_uploaded_file_enqueues_canonical_job(database_helper) -> None:
+    """Test the DatabaseHelper.add_uploaded_file method enqueues the conversion of
+    a file to its canonical format."""
+    database_helper().add_uploaded_file(
+        File(name="name", kind="raster", sha256="sha256", file_path="file_path")
+    )
+    (job,) = RedisHelper().queue.jobs
+    assert job.func_name.endswith("canonical_task")
+    assert list(job.args) == ["sha256"]
+
+
+def test_add_uploaded_file_exists(database_helper) -> None:
+    """Test the DatabaseHelper.add_uploaded_file method and file exists."""
+    with pytest.raises(FileAlreadyExistsError) as faee:
+        helper = database_helper(inserted_files=1)
+        helper.add_uploaded_file(File.select().first(None))
+        assert "name" in str(faee)
+
+
+def test_add_uploaded_file_missing(database_helper) -> None:
+    """Test the DatabaseHelper.add_uploaded_file method restores a file whose stored
+    file is missing."""
+    helper = database_helper(inserted_files=1)
+    File.update(missing=True).execute(None)
+    since = helper.catalog_change_sequence
+    helper.add_uploaded_file(
+        File(name="name", kind="kind", sha256="sha2561", file_path="file_path")
+    )
+    file = File.get(File.sha256 == "sha2561")
+    assert (file.id, file.file_path, file.missing) == (1, "file_path", False)
+    assert [
+        change["action"] for change in helper.catalog_changes(since)["changes"]
+    ] == ["added"]
+
+
+def test_add_uploaded_file_exists_other_suffix(
+    database_helper, tmp_path, monkeypatch
+) -> None:
+    """Test the DatabaseHelper.add_uploaded_file method removes the stored file of an
+    existing file stored under another suffix, with its bytes from the storage usage,
+    but not the existing file."""
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    helper = database_helper(inserted_files=1)
+    usage = RedisHelper().storage_usage
+    existing_path = tmp_path / "sha2561.geojson"
+    existing_path.write_text("file")
+    File.update(file_path=str(existing_path)).where(File.id == 1).execute(None)
+    for file_path in (tmp_path / "sha2561.json", existing_path):
+        file_path.write_text("file")
+        with pytest.raises(FileAlreadyExistsError):
+            helper.add_uploaded_file(
+                File(name="name", kind="kind", sha256="sha2561", file_path=file_path)
+            )
+    assert sorted(tmp_path.iterdir()) == [existing_path]
+    assert RedisHelper().storage_usage == usage - len("file")
+
+
+def test_add_upload_not_exists(database_helper) -> None:
+    """Test the DatabaseHelper.add_upload method and file doesn't exist."""
+    helper = database_helper()
+    helper.add_upload(_upload())
+    assert helper.get_upload("upload_id").size == 5
+
+
+def test_add_upload_exists(database_helper) -> None:
+    """Test the DatabaseHelper.add_upload method and file exists."""
+    with pytest.raises(FileAlreadyExistsError):
+        database_helper(inserted_files=1).add_upload(_upload("sha2561"))
+
+
+def test_get_upload_not_exists(database_helper) -> None:
+    """Test the DatabaseHelper.get_upload method and upload doesn't exist."""
+    with pytest.raises(UploadNotFoundError):
+        database_helper().get_upload("upload_id")
+
+
+def test_get_upload_status(database_helper) -> None:
+    """Test the DatabaseHelper.add_upload_chunk and get_upload_status methods."""
+    helper = database_helper()
+    upload = _upload()
+    helper.add_upload(upload)
+    helper.add_upload_chunk(upload, 2, "sha2562")
+    helper.add_upload_chunk(upload, 0, "wrong")
+    helper.add_upload_chunk(upload, 0, "sha2560")
+    assert helper.get_upload_status(upload) == {
+        "upload_id": "upload_id",
+        "chunk_size": 2,
+        "received": [0, 2],
+        "missing": [1],
+    }
+    assert UploadChunk.get(UploadChunk.index == 0).sha256 == "sha2560"
+
+
+def test_add_upload_chunk_postgresql(database_helper, monkeypatch) -> None:
+    """Test the DatabaseHelper.add_upload_chunk method upserts chunks with the
+    PostgreSQL dialect, which has no REPLACE."""
+    helper = database_helper()
+    database = PostgresqlDatabase("pandarus_remote")
+    queries = []
+    monkeypatch.setattr(
+        database, "execute_sql", lambda *query: queries.append(query) and None
+    )
+    with database.bind_ctx([Upload, UploadChunk]):
+        helper.add_upload_chunk(_upload(), 0, "sha2560")
+    assert queries == [
+        (
+            'INSERT INTO "uploadchunk" ("upload_id", "index", "sha256") '
+            "VALUES (%s, %s, %s) "
+            'ON CONFLICT ("upload_id", "index") DO UPDATE SET "sha256" = %s '
+            'RETURNING "uploadchunk"."id"',
+            ["upload_id", 0, "sha2560", "sha2560"],
+        )
+    ]
+
+
+def test_delete_upload(database_helper) -> None:
+    """Test the DatabaseHelper.delete_upload method."""
+    helper = database_helper()
+    upload = _upload()
+    helper.add_upload(upload)
+    helper.add_upload_chunk(upload, 0, "sha2560")
+    helper.delete_upload(upload)
+    assert not Upload.select().exists(None)
+    assert not UploadChunk.select().exists(None)
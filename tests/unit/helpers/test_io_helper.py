@@ -1,10 +1,26 @@
 """Test cases for the __IOHelper__ class."""
 
+import bz2
+import gzip
+import hashlib
+import json
+import tarfile
+from io import BytesIO
+from pathlib import Path
+
+import fiona
+import numpy as np
 import pytest
+import rasterio
+from pandarus.model import Map
+from pandarus.utils.io import sha256_file
+from werkzeug.datastructures import FileStorage
 
 from pandarus_remote.errors import InvalidSpatialDatasetError, NoneReproducibleHashError
+from pandarus_remote.models import File, Upload
+from pandarus_remote.uploads import StagingFile
 
-from ... import FILE_RASTER, FILE_TEXT, FILE_VECTOR1
+from ... import FILE_RASTER, FILE_TEXT, FILE_VECTOR1, FILE_VECTOR2
 
 
 def test_data_dir(io_helper) -> None:
@@ -37,23 +53,621 @@ def test_remaining_dir(io_helper) -> None:
     assert io_helper.remaining_dir.exists()
 
 
-def test_save_uploaded_file_vector(assert_upload_file) -> None:
-    """Test the IOHelper.save_uploaded_file method with vector input."""
+def test_async_ingest_default(io_helper) -> None:
+    """Test the IOHelper.async_ingest property default."""
+    assert not io_helper.async_ingest
+
+
+def test_async_ingest_custom(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.async_ingest property with PANDARUS_ASYNC_INGEST set."""
+    monkeypatch.setenv("PANDARUS_ASYNC_INGEST", "true")
+    assert io_helper.async_ingest
+
+
+def test_content_path(io_helper) -> None:
+    """Test the IOHelper.content_path method."""
+    assert io_helper.content_path(io_helper.uploads_dir, "abcdef", ".tif") == (
+        io_helper.uploads_dir / "ab" / "cd" / "abcdef.tif"
+    )
+    assert io_helper.is_stored(
+        io_helper.content_path(io_helper.uploads_dir, "abcdef"), io_helper.uploads_dir
+    )
+    assert not io_helper.is_stored(
+        io_helper.uploads_dir / "abcdef", io_helper.uploads_dir
+    )
+
+
+def test_store_file(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_file method."""
+    file_path = tmp_path / "result.json.bz2"
+    file_path.write_bytes(FILE_TEXT.read_bytes())
+    stored_path = io_helper.store_file(file_path, io_helper.intersections_dir)
+    assert stored_path == io_helper.content_path(
+        io_helper.intersections_dir, sha256_file(FILE_TEXT), ".json.bz2"
+    )
+    assert stored_path.read_bytes() == FILE_TEXT.read_bytes()
+    assert not file_path.exists()
+
+    file_path.write_bytes(FILE_TEXT.read_bytes())
+    assert io_helper.store_file(file_path, io_helper.intersections_dir) == stored_path
+    assert not file_path.exists()
+
+
+def test_link_file(io_helper, tmp_path) -> None:
+    """Test the IOHelper.link_file method."""
+    file_path = tmp_path / "vector.geojson"
+    file_path.write_bytes(FILE_VECTOR1.read_bytes())
+    linked_path = io_helper.link_file(file_path, io_helper.uploads_dir)
+    assert linked_path == io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".geojson"
+    )
+    assert linked_path.samefile(file_path)
+
+
+def test_result_encodings(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.result_encodings property without zstandard."""
+    monkeypatch.setattr("pandarus_remote.storage.zstandard", None)
+    assert io_helper.result_encodings == {"gzip": ".gz"}
+
+
+def test_store_result(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_result method with plain and bz2 JSON results."""
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    bz2_path = tmp_path / "result.json.bz2"
+    bz2_path.write_bytes(bz2.compress(b'{"data": []}'))
+
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    assert stored_path == io_helper.content_path(
+        io_helper.intersections_dir,
+        hashlib.sha256(b'{"data": []}').hexdigest(),
+        ".json.gz",
+    )
+    assert gzip.decompress(stored_path.read_bytes()) == b'{"data": []}'
+    stored_bytes = stored_path.read_bytes()
+    assert io_helper.store_result(bz2_path, io_helper.intersections_dir) == stored_path
+    assert stored_path.read_bytes() == stored_bytes
+    assert not json_path.exists()
+    assert not bz2_path.exists()
+    assert not list(io_helper.intersections_dir.glob("*.part"))
+
+
+def test_result_sha256(io_helper, tmp_path) -> None:
+    """Test the IOHelper.result_sha256 method ignores the ``when`` timestamp, so
+    identical results are stored once."""
+    first_path = tmp_path / "first.json"
+    first_path.write_text(
+        '{"data": [], "metadata": {"when": "2024-01-01T00:00:00", "first": {}}}'
+    )
+    second_path = tmp_path / "second.json.bz2"
+    second_path.write_bytes(
+        bz2.compress(
+            b'{"metadata": {"first": {}, "when": "2024-01-02T00:00:00"}, "data": []}'
+        )
+    )
+    assert io_helper.result_sha256(first_path) == io_helper.result_sha256(second_path)
+    assert io_helper.result_sha256(first_path) == (
+        hashlib.sha256(b'{"data": [], "metadata": {"first": {}}}').hexdigest()
+    )
+
+    stored_path = io_helper.store_result(first_path, io_helper.intersections_dir)
+    assert io_helper.store_result(second_path, io_helper.intersections_dir) == (
+        stored_path
+    )
+    assert b"2024-01-01" in gzip.decompress(stored_path.read_bytes())
+
+
+def test_store_result_zstd(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_result method stores a zstd file with zstandard."""
+    zstandard = pytest.importorskip("zstandard")
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    zstd_path = stored_path.with_suffix(".zst")
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    assert decompressor.decompress(zstd_path.read_bytes()) == b'{"data": []}'
+    assert io_helper.result_representation(stored_path, ["zstd", "gzip"]) == (
+        zstd_path,
+        "zstd",
+    )
+
+
+def test_result_representation(io_helper, tmp_path) -> None:
+    """Test the IOHelper.result_representation method."""
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    assert io_helper.is_compressed_result(stored_path)
+    assert not io_helper.is_compressed_result(FILE_TEXT)
+    assert io_helper.result_representation(stored_path, ["gzip"]) == (
+        stored_path,
+        "gzip",
+    )
+    assert io_helper.result_representation(stored_path, []) == (stored_path, None)
+    assert b"".join(io_helper.read_decompressed(stored_path)) == b'{"data": []}'
+
+
+def test_store_columnar(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_columnar method."""
+    json_path = tmp_path / "result.json"
+    json_path.write_text(
+        '{"data": [[1, {"min": 1, "mean": 1.5}], [2, {"min": null, "mean": 2}]],'
+        ' "metadata": {"when": "now"}}'
+    )
+    stored_path = io_helper.store_result(json_path, io_helper.raster_stats_dir)
+    columnar_path = io_helper.store_columnar(stored_path, "raster_stats")
+    assert columnar_path == io_helper.columnar_path(stored_path)
+    assert columnar_path.name == f"{io_helper.content_sha256(stored_path)}.npz"
+    with np.load(columnar_path) as columnar:
+        assert sorted(columnar.files) == ["id", "mean", "metadata", "min"]
+        assert columnar["id"].dtype == np.int64
+        assert columnar["id"].tolist() == [1, 2]
+        assert columnar["mean"].tolist() == [1.5, 2.0]
+        assert np.isnan(columnar["min"][1])
+        assert json.loads(str(columnar["metadata"])) == {"when": "now"}
+
+
+def test_store_canonical_vector(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_canonical_vector method."""
+    file_path = io_helper.content_path(tmp_path, sha256_file(FILE_VECTOR2), ".geojson")
+    file_path.parent.mkdir(parents=True)
+    file_path.write_bytes(FILE_VECTOR2.read_bytes())
+
+    canonical_path = io_helper.store_canonical_vector(file_path)
+    assert canonical_path == file_path.with_suffix(".fgb")
+    with fiona.open(FILE_VECTOR2) as source, fiona.open(canonical_path) as canonical:
+        assert canonical.driver == "FlatGeobuf"
+        assert canonical.schema == source.schema
+        assert [feature.properties for feature in canonical] == [
+            feature.properties for feature in source
+        ]
+    assert not list(canonical_path.parent.glob("*.part*"))
+
+
+def test_store_canonical_vector_invalid(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_canonical_vector method with a file it can't read."""
+    file_path = tmp_path / "text.txt"
+    file_path.write_bytes(FILE_TEXT.read_bytes())
+    assert io_helper.store_canonical_vector(file_path) is None
+    assert list(tmp_path.iterdir()) == [file_path]
+
+
+def test_store_canonical_raster(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_canonical_raster method."""
+    file_path = io_helper.content_path(tmp_path, sha256_file(FILE_RASTER), ".tif")
+    file_path.parent.mkdir(parents=True)
+    file_path.write_bytes(FILE_RASTER.read_bytes())
+
+    canonical_path = io_helper.store_canonical_raster(file_path)
+    assert canonical_path == file_path.with_suffix(".cog.tif")
+    with rasterio.open(FILE_RASTER) as source, rasterio.open(canonical_path) as cog:
+        assert cog.profile["tiled"]
+        assert cog.profile["compress"] == "deflate"
+        assert (cog.read() == source.read()).all()
+    assert not list(canonical_path.parent.glob("*.part*"))
+
+
+def test_store_canonical_raster_invalid(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_canonical_raster method with a file it can't read."""
+    file_path = tmp_path / "text.txt"
+    file_path.write_bytes(FILE_TEXT.read_bytes())
+    assert io_helper.store_canonical_raster(file_path) is None
+    assert list(tmp_path.iterdir()) == [file_path]
+
+
+def test_rename_vector(io_helper, tmp_path) -> None:
+    """Test the IOHelper.rename_vector method."""
+    file_path = tmp_path / "vector.geojson"
+    file_path.write_bytes(FILE_VECTOR1.read_bytes())
+
+    renamed_path = io_helper.rename_vector(file_path, "renamed.geojson")
+    assert renamed_path == tmp_path / "renamed.geojson"
+    assert not file_path.exists()
+    assert json.loads(renamed_path.read_text())["name"] == "renamed"
+    with fiona.open(FILE_VECTOR1) as source, fiona.open(renamed_path) as renamed:
+        assert [feature.properties for feature in renamed] == [
+            feature.properties for feature in source
+        ]
+
+
+def test_rewrite_metadata(io_helper, tmp_path) -> None:
+    """Test the IOHelper.rewrite_metadata method."""
+    file_path = tmp_path / "data.json"
+    file_path.write_text(
+        json.dumps(
+            {
+                "data": [["a", 0.5]],
+                "metadata": {"source": {"field": "name", "sha256": "fgb"}},
+            }
+        )
+    )
+    file = File(file_path="uploads/a/b/sha256.geojson", sha256="sha256")
+    io_helper.rewrite_metadata(file_path, source=file)
+    assert json.loads(file_path.read_text()) == {
+        "data": [["a", 0.5]],
+        "metadata": {
+            "source": {
+                "field": "name",
+                "path": "uploads/a/b/sha256.geojson",
+                "filename": "sha256.geojson",
+                "sha256": "sha256",
+            }
+        },
+    }
+
+
+def test_store_bounds(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_bounds and IOHelper.load_rtree_index methods build
+    the same rtree index as pandarus."""
+    file_path = tmp_path / "vector.geojson"
+    file_path.write_bytes(FILE_VECTOR2.read_bytes())
+    assert io_helper.load_rtree_index(file_path) is None
+
+    bounds_path = io_helper.store_bounds(file_path)
+    assert bounds_path == tmp_path / "vector.bounds.npy"
+    vector = Map(str(file_path))
+    expected_index = vector.create_rtree_index()
+    rtree_index = io_helper.load_rtree_index(file_path)
+    assert len(rtree_index) == len(vector)
+    for bounds in np.load(bounds_path):
+        assert sorted(rtree_index.intersection(bounds)) == sorted(
+            expected_index.intersection(bounds)
+        )
+    vector.file.close()
+
+
+def test_store_bounds_invalid(io_helper, tmp_path) -> None:
+    """Test the IOHelper.store_bounds method with a file it can't read."""
+    file_path = tmp_path / "text.txt"
+    file_path.write_bytes(FILE_TEXT.read_bytes())
+    assert io_helper.store_bounds(file_path) is None
+    assert not io_helper.bounds_path(file_path).exists()
+
+
+def test_stream_archive(io_helper) -> None:
+    """Test the IOHelper.stream_archive method."""
+    archive = b"".join(
+        io_helper.stream_archive([("content.txt", b"content"), ("text", FILE_TEXT)])
+    )
+    assert len(archive) % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        assert tar.getnames() == ["content.txt", "text"]
+        assert tar.extractfile("content.txt").read() == b"content"
+        assert tar.extractfile("text").read() == FILE_TEXT.read_bytes()
+
+
+def test_write_stream(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.write_stream method."""
+    monkeypatch.setattr(io_helper, "chunk_size", 3)
+    file_path = io_helper.uploads_dir / "test.txt"
+    file_hash = io_helper.write_stream(BytesIO(FILE_TEXT.read_bytes()), file_path)
+    assert file_hash == sha256_file(FILE_TEXT)
+    assert file_path.read_bytes() == FILE_TEXT.read_bytes()
+
+
+def test_write_stream_offset(io_helper) -> None:
+    """Test the IOHelper.write_stream method with an offset."""
+    file_path = io_helper.uploads_dir / "test.txt"
+    file_path.write_bytes(b"abcdef")
+    assert io_helper.write_stream(BytesIO(b"XY"), file_path, offset=2) == (
+        io_helper.write_stream(BytesIO(b"XY"), io_helper.uploads_dir / "XY.txt")
+    )
+    assert file_path.read_bytes() == b"abXYef"
+
+
+def test_write_stream_interrupted(io_helper) -> None:
+    """Test the IOHelper.write_stream method with an interrupted stream."""
+
+    class _InterruptedStream(BytesIO):
+        def read(self, *_) -> bytes:
+            raise ConnectionError
+
+    file_path = io_helper.uploads_dir / "test.txt"
+    with pytest.raises(ConnectionError):
+        io_helper.write_stream(_InterruptedStream(), file_path)
+    assert not file_path.exists()
+
+
+def test_store_uploaded_file_staging_file(io_helper) -> None:
+    """Test the IOHelper.store_uploaded_file method moves a file received into a
+    StagingFile to the storage instead of writing it again."""
+    staging_file = StagingFile(io_helper.staging_file_path("upload"))
+    staging_file.write(FILE_VECTOR1.read_bytes())
+    staging_file.seek(0)
+    file_path = io_helper.store_uploaded_file(
+        FileStorage(stream=staging_file, filename=FILE_VECTOR1.name),
+        FILE_VECTOR1.name,
+        sha256_file(FILE_VECTOR1),
+    )
+    staging_file.close()
+    assert file_path.read_bytes() == FILE_VECTOR1.read_bytes()
+    assert not staging_file.path.exists()
+
+    staging_file = StagingFile(io_helper.staging_file_path("rejected"))
+    staging_file.write(b"content")
+    staging_file.close()
+    assert not staging_file.path.exists()
+
+
+def test_save_uploaded_file_vector(io_helper, assert_upload_file) -> None:
+    """Test the IOHelper.save_uploaded_file method with vector input leaves the
+    conversion to its canonical format and its bounds to a job."""
     assert_upload_file(FILE_VECTOR1)
+    assert io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".geojson"
+    ).exists()
+    assert not io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".fgb"
+    ).exists()
+    assert not io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".bounds.npy"
+    ).exists()
 
 
-def test_save_uploaded_file_raster(assert_upload_file) -> None:
-    """Test the IOHelper.save_uploaded_file method with raster input."""
+def test_save_uploaded_file_raster(io_helper, assert_upload_file) -> None:
+    """Test the IOHelper.save_uploaded_file method with raster input leaves the
+    conversion to its canonical format to a job."""
     assert_upload_file(FILE_RASTER)
+    assert not io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_RASTER), ".cog.tif"
+    ).exists()
 
 
-def test_save_uploaded_file_text(assert_upload_file) -> None:
-    """Test the IOHelper.save_uploaded_file method with text input."""
+def test_save_uploaded_file_text(
+    io_helper, redis_helper, monkeypatch, assert_upload_file
+) -> None:
+    """Test the IOHelper.save_uploaded_file method with text input removes the stored
+    file and its bytes from the storage usage."""
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    usage = redis_helper.storage_usage
     with pytest.raises(InvalidSpatialDatasetError):
         assert_upload_file(FILE_TEXT)
+    assert redis_helper.storage_usage == usage == io_helper.storage_usage()
 
 
 def test_save_uploaded_file_none_reproducible_hash(assert_upload_file) -> None:
     """Test the IOHelper.save_uploaded_file method with none-reproducible hash."""
     with pytest.raises(NoneReproducibleHashError):
         assert_upload_file(FILE_RASTER, hash_func=lambda _: "")
+
+
+def test_save_uploaded_file_none_reproducible_hash_cleanup(
+    io_helper, assert_upload_file
+) -> None:
+    """Test the IOHelper.save_uploaded_file method removes the file with
+    none-reproducible hash."""
+    with pytest.raises(NoneReproducibleHashError):
+        assert_upload_file(FILE_TEXT, hash_func=lambda _: "")
+    assert not list(io_helper.uploads_dir.iterdir())
+
+
+def test_store_uploaded_file_text(io_helper) -> None:
+    """Test the IOHelper.store_uploaded_file method stores without validating."""
+    with FILE_TEXT.open("rb") as stream:
+        file_path = io_helper.store_uploaded_file(
+            FileStorage(stream=stream, filename=FILE_TEXT.name),
+            FILE_TEXT.name,
+            sha256_file(FILE_TEXT),
+        )
+    assert file_path == io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_TEXT), FILE_TEXT.suffix
+    )
+    assert file_path.read_bytes() == FILE_TEXT.read_bytes()
+
+
+def _upload(io_helper, file_path, sha256) -> Upload:
+    """Return a resumable upload for file_path with its staging file created."""
+    upload = Upload(
+        id="upload_id",
+        name=file_path.name,
+        sha256=sha256,
+        size=file_path.stat().st_size,
+        chunk_size=io_helper.upload_chunk_size,
+        staging_file_path=io_helper.staging_file_path("upload_id"),
+        field="name",
+    )
+    io_helper.create_staging_file(upload)
+    return upload
+
+
+def test_create_staging_file(io_helper) -> None:
+    """Test the IOHelper.create_staging_file method."""
+    upload = _upload(io_helper, FILE_VECTOR1, sha256_file(FILE_VECTOR1))
+    assert upload.staging_file_path.stat().st_size == FILE_VECTOR1.stat().st_size
+
+
+def test_finalize_upload(io_helper) -> None:
+    """Test the IOHelper.finalize_upload method."""
+    upload = _upload(io_helper, FILE_VECTOR1, sha256_file(FILE_VECTOR1))
+    upload.staging_file_path.write_bytes(FILE_VECTOR1.read_bytes())
+    file = io_helper.finalize_upload(upload)
+    assert file.kind == "vector"
+    assert file.canonical_file_path is None
+    assert file.sha256 == upload.sha256
+    assert file.field == "name"
+    assert file.file_path == io_helper.content_path(
+        io_helper.uploads_dir, upload.sha256, ".geojson"
+    )
+    assert file.file_path.read_bytes() == FILE_VECTOR1.read_bytes()
+    assert file.name == FILE_VECTOR1.name
+    assert not upload.staging_file_path.exists()
+
+
+def test_store_upload(io_helper) -> None:
+    """Test the IOHelper.store_upload method stores without validating."""
+    upload = _upload(io_helper, FILE_TEXT, sha256_file(FILE_TEXT))
+    upload.staging_file_path.write_bytes(FILE_TEXT.read_bytes())
+    file_path = io_helper.store_upload(upload)
+    assert file_path == io_helper.content_path(
+        io_helper.uploads_dir, upload.sha256, FILE_TEXT.suffix
+    )
+    assert file_path.read_bytes() == FILE_TEXT.read_bytes()
+    assert not upload.staging_file_path.exists()
+
+
+def test_finalize_upload_none_reproducible_hash(io_helper) -> None:
+    """Test the IOHelper.finalize_upload method with none-reproducible hash."""
+    upload = _upload(io_helper, FILE_VECTOR1, "")
+    with pytest.raises(NoneReproducibleHashError):
+        io_helper.finalize_upload(upload)
+    assert not upload.staging_file_path.exists()
+
+
+def test_storage_budget_default(io_helper) -> None:
+    """Test the IOHelper.storage_budget property default value."""
+    assert io_helper.storage_budget is None
+
+
+def test_storage_budget_custom(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.storage_budget property custom value."""
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    assert io_helper.storage_budget == 1024
+
+
+def test_max_upload_size_default(io_helper) -> None:
+    """Test the IOHelper.max_upload_size property default value."""
+    assert io_helper.max_upload_size == 10 * 1024 * 1024 * 1024
+
+
+def test_max_upload_size_custom(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.max_upload_size property custom value."""
+    monkeypatch.setenv("PANDARUS_MAX_UPLOAD_SIZE", "1024")
+    assert io_helper.max_upload_size == 1024
+
+
+def test_upload_ttl_default(io_helper) -> None:
+    """Test the IOHelper.upload_ttl property default value."""
+    assert io_helper.upload_ttl == 24 * 60 * 60
+
+
+def test_upload_ttl_custom(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.upload_ttl property custom value."""
+    monkeypatch.setenv("PANDARUS_UPLOAD_TTL", "60")
+    assert io_helper.upload_ttl == 60
+
+
+def test_database_url_default(io_helper) -> None:
+    """Test the IOHelper.database_url property default value."""
+    assert io_helper.database_url == str(io_helper.data_dir / "pandarus_remote.db")
+
+
+def test_database_url_custom(io_helper, monkeypatch) -> None:
+    """Test the IOHelper.database_url property custom value."""
+    monkeypatch.setenv("PANDARUS_DATABASE_URL", "postgresql+pool://host/pandarus")
+    assert io_helper.database_url == "postgresql+pool://host/pandarus"
+
+
+def test_storage_usage(io_helper) -> None:
+    """Test the IOHelper.storage_usage method counts hard linked files once and only
+    counts the storage directories."""
+    file_path = io_helper.uploads_dir / "file.txt"
+    file_path.write_bytes(b"content")
+    io_helper.link_file(file_path, io_helper.intersections_dir)
+    (io_helper.raster_stats_dir / "file.txt").write_bytes(b"other")
+    assert io_helper.storage_usage(io_helper.uploads_dir) == 7
+    assert io_helper.storage_usage() == 7 + 5
+    (io_helper.data_dir / "pandarus_remote.db-wal").write_bytes(b"journal")
+    assert io_helper.storage_usage() == 7 + 5
+
+
+def test_record_usage(io_helper, redis_helper, monkeypatch, tmp_path) -> None:
+    """Test that stored and deleted files update the running storage usage while a
+    storage budget is set."""
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    io_helper.store_result(json_path, io_helper.intersections_dir)
+    assert redis_helper.storage_usage == io_helper.storage_usage()
+
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    json_path.write_bytes(b'{"data": [["a", 1]]}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    io_helper.store_columnar(stored_path, "intersection")
+    assert redis_helper.storage_usage == io_helper.storage_usage()
+    io_helper.delete_result(stored_path)
+    assert redis_helper.storage_usage == io_helper.storage_usage()
+
+
+def test_delete_file(io_helper, redis_helper, monkeypatch) -> None:
+    """Test the IOHelper.delete_file method records the bytes it frees."""
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    file_path = io_helper.uploads_dir / "file.txt"
+    file_path.write_bytes(b"content")
+    linked_path = io_helper.link_file(file_path, io_helper.intersections_dir)
+    usage = redis_helper.storage_usage
+    assert io_helper.delete_file(linked_path) == 0
+    assert io_helper.delete_file(file_path) == 7
+    assert io_helper.delete_file(file_path) == 0
+    assert redis_helper.storage_usage == usage - 7 == io_helper.storage_usage()
+
+
+def test_delete_result(io_helper) -> None:
+    """Test the IOHelper.delete_result method deletes the files of a result."""
+    file_path = io_helper.raster_stats_dir / "result.json"
+    file_path.write_text('{"data": [[1, 2.5]]}')
+    stored_path = io_helper.store_result(file_path, io_helper.raster_stats_dir)
+    columnar_path = io_helper.store_columnar(stored_path, "remaining")
+    linked_path = io_helper.link_file(stored_path, io_helper.remaining_dir)
+
+    freed = columnar_path.stat().st_size + sum(
+        path.stat().st_size
+        for path in stored_path.parent.iterdir()
+        if path.name.endswith(".json.zst")
+    )
+    assert io_helper.delete_result(stored_path) == freed
+    assert not list(stored_path.parent.iterdir())
+    assert linked_path.exists()
+    assert io_helper.delete_result(stored_path) == 0
+
+    legacy_path = io_helper.raster_stats_dir / "legacy.json.bz2"
+    legacy_path.write_bytes(b"legacy")
+    assert io_helper.delete_result(legacy_path) == 6
+    assert not legacy_path.exists()
+
+
+def test_derived_paths(io_helper) -> None:
+    """Test the IOHelper.derived_paths method."""
+    assert io_helper.derived_paths("dir/ab/cd/abcd.json.gz") == [
+        *(
+            Path(f"dir/ab/cd/abcd.json{suffix}")
+            for suffix in io_helper.result_encodings.values()
+        ),
+        Path("dir/ab/cd/abcd.npz"),
+    ]
+    assert io_helper.derived_paths("dir/ab/cd/abcd.geojson") == [
+        Path("dir/ab/cd/abcd.fgb"),
+        Path("dir/ab/cd/abcd.cog.tif"),
+        Path("dir/ab/cd/abcd.bounds.npy"),
+    ]
+
+
+def test_iter_files(io_helper) -> None:
+    """Test the IOHelper.iter_files method."""
+    file_path = io_helper.content_path(io_helper.uploads_dir, "abcd", ".txt")
+    file_path.parent.mkdir(parents=True)
+    file_path.write_text("file")
+    (io_helper.uploads_dir / "file.txt").write_text("file")
+    assert sorted(entry.path for entry in io_helper.iter_files(io_helper.data_dir)) == [
+        str(file_path),
+        str(io_helper.uploads_dir / "file.txt"),
+    ]
+
+
+def test_offload_header(io_helper, monkeypatch, tmp_path) -> None:
+    """Test the IOHelper.offload_header method."""
+    file_path = io_helper.intersections_dir / "ab" / "a b.json.gz"
+    assert io_helper.sendfile_mode is None
+    assert io_helper.offload_header(file_path) is None
+
+    monkeypatch.setenv("PANDARUS_SENDFILE_MODE", "X-Sendfile")
+    assert io_helper.offload_header(file_path) == ("X-Sendfile", str(file_path))
+    assert io_helper.offload_header(tmp_path / "file.json") is None
+
+    monkeypatch.setenv("PANDARUS_SENDFILE_MODE", "x-accel-redirect")
+    assert io_helper.offload_header(file_path) == (
+        "X-Accel-Redirect",
+        "/pandarus_remote_data/intersections/ab/a%20b.json.gz",
+    )
+    monkeypatch.setenv("PANDARUS_ACCEL_REDIRECT_PREFIX", "/data")
+    assert io_helper.offload_header(file_path)[1] == (
+        "/data/intersections/ab/a%20b.json.gz"
+    )
@@ -1,9 +1,14 @@
 """Test cases for the __RedisHelper__ class."""
 
+import zlib
+from pathlib import Path
+
 import pytest
+from rq import Queue
+from rq.results import Result
 
 from pandarus_remote.errors import JobNotFoundError
-from pandarus_remote.helpers import RedisHelper
+from pandarus_remote.helpers import TaskHelper, TaskSerializer
 from pandarus_remote.models import File, Intersection
 
 
@@ -32,71 +37,105 @@ def test_create_task_identifier(redis_helper) -> None:
     assert (
         redis_helper.create_task_identifier(
             _test_func,
-            "test_arg1",
-            "test_arg2",
-            test_arg3="test_arg3",
+            File(id=1, sha256="sha2561"),
+            Intersection(id=2),
+            None,
             test_arg4="test_arg4",
+            test_arg3=3,
         )
-        == f"""{_test_func.__name__}: """
-        """['test_arg1', 'test_arg2', 'test_arg3', 'test_arg4']"""
+        == f"{_test_func.__name__}:sha2561:intersection-2::test_arg3=3:"
+        "test_arg4=test_arg4"
     )
 
 
-def test_enqueue_task_task_does_not_exist(redis_helper, monkeypatch) -> None:
-    """Test the RedisHelper.enqueue_task method but task doesn't exist."""
-    monkeypatch.setattr(
-        RedisHelper, "create_task_identifier", lambda *_, **__: "test_identifier"
-    )
+def test_create_job_id(redis_helper) -> None:
+    """Test the RedisHelper.create_job_id method."""
 
     def _test_func():
         pass
 
-    identifier = redis_helper.create_task_identifier(
-        _test_func, "test_arg1", "test_arg2"
-    )
-    assert (
-        redis_helper.queue.connection.hget(redis_helper.job_ids_set_name, identifier)
-        is None
-    )
+    job_id = redis_helper.create_job_id(_test_func, "identifier")
+    assert job_id.startswith(f"{_test_func.__name__}-")
+    assert job_id == redis_helper.create_job_id(_test_func, "identifier")
+    assert job_id != redis_helper.create_job_id(_test_func, "other")
 
-    job = redis_helper.enqueue_task(_test_func, "test_arg1", "test_arg2")
-    assert _test_func.__name__ in job.func_name
-    assert job.args == ("test_arg1", "test_arg2")
-    assert (
-        redis_helper.queue.connection.hget(
-            redis_helper.job_ids_set_name, identifier
-        ).decode("UTF-8")
-        == job.id
-    )
 
+def test_enqueue_task_task_does_not_exist(redis_helper) -> None:
+    """Test the RedisHelper.enqueue_task method but task doesn't exist."""
+    job = redis_helper.enqueue_task(len, "does_not_exist")
+    assert job.func_name.endswith("len")
+    assert job.args == ("does_not_exist",)
+    assert job.id == redis_helper.create_job_id(len, "len:does_not_exist")
+    assert job.get_status() == "queued"
+    assert job.result_ttl == redis_helper.job_result_ttl
+    assert job.failure_ttl == redis_helper.job_failure_ttl
 
-def test_enqueue_task_task_exists(redis_helper, monkeypatch) -> None:
+
+def test_enqueue_task_task_exists(redis_helper) -> None:
     """Test the RedisHelper.enqueue_task method and task exists."""
-    monkeypatch.setattr(
-        RedisHelper, "create_task_identifier", lambda *_, **__: "test_identifier"
-    )
+    count = redis_helper.queue.count
+    expected_job = redis_helper.enqueue_task(len, "exists")
+    actual_job = redis_helper.enqueue_task(len, "exists")
+    assert actual_job.id == expected_job.id
+    assert redis_helper.queue.count == count + 1
 
-    def _test_func():
-        pass
+    expected_job.set_status("started")
+    assert redis_helper.enqueue_task(len, "exists").id == expected_job.id
+    assert redis_helper.queue.count == count + 1
 
-    expected_job = redis_helper.queue.enqueue(lambda: None)
-    identifier = redis_helper.create_task_identifier(
-        _test_func, "test_arg1", "test_arg2"
-    )
-    redis_helper.queue.connection.hset(
-        redis_helper.job_ids_set_name, identifier, expected_job.id
-    )
-    assert (
-        redis_helper.queue.connection.hget(
-            redis_helper.job_ids_set_name, identifier
-        ).decode("UTF-8")
-        == expected_job.id
-    )
 
-    actual_job = redis_helper.enqueue_task(_test_func, "test_arg1", "test_arg2")
-    assert actual_job.id == expected_job.id
-    assert actual_job.func_name == expected_job.func_name
-    assert actual_job.args == expected_job.args
+def test_enqueue_task_task_failed(redis_helper) -> None:
+    """Test the RedisHelper.enqueue_task method replaces a failed job."""
+    job = redis_helper.enqueue_task(len, "failed")
+    redis_helper.queue.remove(job)
+    job.set_status("failed")
+    redis_helper.queue.failed_job_registry.add(job, 60)
+
+    requeued_job = redis_helper.enqueue_task(len, "failed")
+    assert requeued_job.id == job.id
+    assert requeued_job.get_status() == "queued"
+    assert job.id in redis_helper.queue.job_ids
+    assert job.id not in redis_helper.queue.failed_job_registry
+
+
+def test_enqueue_task_task_finished(redis_helper) -> None:
+    """Test the RedisHelper.enqueue_task method replaces a finished job without its
+    fields, results and expiry."""
+    job = redis_helper.enqueue_task(len, "finished")
+    redis_helper.queue.remove(job)
+    connection = redis_helper.queue.connection
+    connection.hset(job.key, mapping={"status": "finished", "worker_name": "worker"})
+    connection.expire(job.key, redis_helper.job_result_ttl)
+    connection.xadd(Result.get_key(job.id), {"type": "1"})
+    redis_helper.queue.finished_job_registry.add(job, 60)
+
+    requeued_job = redis_helper.enqueue_task(len, "finished")
+    assert requeued_job.id == job.id
+    assert requeued_job.get_status() == "queued"
+    assert job.id not in redis_helper.queue.finished_job_registry
+    assert connection.hget(job.key, "worker_name") != b"worker"
+    assert connection.ttl(job.key) == -1
+    assert not connection.exists(Result.get_key(job.id))
+
+
+def test_enqueue_task_concurrent(redis_helper, monkeypatch) -> None:
+    """Test the RedisHelper.enqueue_task method returns the job enqueued by a
+    concurrent request between its check and its transaction."""
+    enqueue_call = Queue.enqueue_call
+    concurrent_jobs = []
+
+    def _enqueue_call(queue, *args, **kwargs):
+        if not concurrent_jobs:
+            concurrent_jobs.append(
+                enqueue_call(queue, *args, **{**kwargs, "pipeline": None})
+            )
+        return enqueue_call(queue, *args, **kwargs)
+
+    monkeypatch.setattr(Queue, "enqueue_call", _enqueue_call)
+    count = redis_helper.queue.count
+    job = redis_helper.enqueue_task(len, "concurrent")
+    assert job.id == concurrent_jobs[0].id
+    assert redis_helper.queue.count == count + 1
 
 
 def test_enqueue_interesect_job(redis_helper) -> None:
@@ -104,8 +143,7 @@ def test_enqueue_interesect_job(redis_helper) -> None:
     file1 = File(name="name1", kind="kind1", sha256="sha2561")
     file2 = File(name="name2", kind="kind2", sha256="sha2562")
     job = redis_helper.enqueue_intersection_job(file1, file2)
-    assert job.args[0].name == file1.name
-    assert job.args[1].name == file2.name
+    assert job.args == ("sha2561", "sha2562")
 
 
 def test_enqueue_raster_stats_job(redis_helper) -> None:
@@ -113,17 +151,179 @@ def test_enqueue_raster_stats_job(redis_helper) -> None:
     file1 = File(name="name1", kind="kind1", sha256="sha2561")
     file2 = File(name="name2", kind="kind2", sha256="sha2562")
     job = redis_helper.enqueue_raster_stats_job(file1, file2, 1)
-    assert job.args[0].name == file1.name
-    assert job.args[1].name == file2.name
-    assert job.args[2] == 1
+    assert job.args == ("sha2561", "sha2562", 1)
+
+
+def test_enqueue_ingest_job(redis_helper) -> None:
+    """Test the RedisHelper.enqueue_ingest_job method."""
+    job = redis_helper.enqueue_ingest_job(
+        Path("file_path"), "name", "sha256", None, "name", 1
+    )
+    assert job.func_name.endswith("ingest_task")
+    assert job.args == ("file_path", "name", "sha256", None, "name", 1)
+
+
+def test_enqueue_canonical_job(redis_helper) -> None:
+    """Test the RedisHelper.enqueue_canonical_job method."""
+    job = redis_helper.enqueue_canonical_job(File(name="name", sha256="sha256"))
+    assert job.func_name.endswith("canonical_task")
+    assert job.args == ("sha256",)
 
 
 def test_enqueue_remaining_job(redis_helper) -> None:
     """Test the RedisHelper.enqueue_remaining_job method."""
-    intersection = Intersection(
-        data_file_path="data_file_path", vector_file_path="vector_file_path"
+    job = redis_helper.enqueue_remaining_job("sha2561", "sha2562")
+    assert job.func_name.endswith("remaining_task")
+    assert job.args == ("sha2561", "sha2562")
+
+
+def test_task_serializer(redis_helper) -> None:
+    """Test that jobs are serialized as compact JSON and load their task."""
+    job = redis_helper.enqueue_raster_stats_job(
+        File(sha256="serialized1"), File(sha256="serialized2"), 1
     )
-    assert (
-        redis_helper.enqueue_remaining_job(intersection).args[0].data_file_path
-        == intersection.data_file_path
+    data = zlib.decompress(redis_helper.queue.connection.hget(job.key, "data"))
+    assert data == (
+        b'["raster_stats_task",{"__task_helper__":true},'
+        b'["serialized1","serialized2",1],{}]'
     )
+    fetched = redis_helper.queue.fetch_job(job.id)
+    assert isinstance(fetched.instance, TaskHelper)
+    assert fetched.func == fetched.instance.raster_stats_task
+    assert fetched.args == ["serialized1", "serialized2", 1]
+
+    with pytest.raises(TypeError):
+        TaskSerializer.dumps(File())
+
+
+def test_enqueue_eviction_job(redis_helper, monkeypatch) -> None:
+    """Test the RedisHelper.enqueue_eviction_job method."""
+    assert redis_helper.enqueue_eviction_job() is None
+
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    job = redis_helper.enqueue_eviction_job()
+    count = redis_helper.queue.count
+    assert job.func_name.endswith("evict_task")
+    assert redis_helper.enqueue_eviction_job().id == job.id
+    assert redis_helper.queue.count == count
+
+    job.set_status("finished")
+    assert redis_helper.enqueue_eviction_job().get_status() == "queued"
+
+
+def test_enqueue_sweep_job(redis_helper) -> None:
+    """Test the RedisHelper.enqueue_sweep_job method."""
+    job = redis_helper.enqueue_sweep_job()
+    assert job.func_name.endswith("sweep_task")
+    assert redis_helper.enqueue_sweep_job(60).id == job.id
+
+    job.set_status("started")
+    scheduled_job = redis_helper.enqueue_sweep_job(60)
+    assert scheduled_job.id == f"{job.id}-next"
+    assert scheduled_job.get_status() == "scheduled"
+    assert redis_helper.enqueue_sweep_job().id == scheduled_job.id
+
+    job.set_status("finished")
+    scheduled_job.set_status("started")
+    requeued_job = redis_helper.enqueue_sweep_job(60)
+    assert requeued_job.id == job.id
+    assert requeued_job.get_status() == "scheduled"
+
+    dry_run_job = redis_helper.enqueue_sweep_job(grace_period=60, dry_run=True)
+    assert dry_run_job.id != scheduled_job.id
+    assert list(dry_run_job.args) == [60, True]
+    assert redis_helper.enqueue_sweep_job(grace_period=60, dry_run=True).id == (
+        dry_run_job.id
+    )
+
+
+def test_enqueue_sweep_job_concurrent(redis_helper, monkeypatch) -> None:
+    """Test the RedisHelper.enqueue_sweep_job method returns the sweep job enqueued
+    by a concurrent request between its check and its transaction."""
+    enqueue_in = Queue.enqueue_in
+    concurrent_jobs = []
+
+    def _enqueue_in(queue, *args, **kwargs):
+        if not concurrent_jobs:
+            concurrent_jobs.append(
+                enqueue_in(queue, *args, **{**kwargs, "pipeline": None})
+            )
+        return enqueue_in(queue, *args, **kwargs)
+
+    monkeypatch.setattr(Queue, "enqueue_in", _enqueue_in)
+    job = redis_helper.enqueue_sweep_job(60, grace_period=30)
+    assert job.id == concurrent_jobs[0].id
+    assert redis_helper.queue.scheduled_job_registry.get_job_ids() == [job.id]
+
+
+def test_job_stats(redis_helper) -> None:
+    """Test the RedisHelper.job_stats property and compact_jobs method."""
+    connection = redis_helper.queue.connection
+    queued = redis_helper.job_stats["queued"]
+    redis_helper.enqueue_task(len, "job_stats")
+    connection.hset(redis_helper.job_ids_set_name, mapping={"a": "1", "b": "2"})
+    assert redis_helper.job_stats["queued"] == queued + 1
+    assert redis_helper.job_stats["legacy_job_ids"] == 2
+
+    assert redis_helper.compact_jobs() == 2
+    assert redis_helper.job_stats["legacy_job_ids"] == 0
+    assert redis_helper.job_stats["queued"] == queued + 1
+    assert redis_helper.compact_jobs() == 0
+
+
+def test_catalog_generation(redis_helper) -> None:
+    """Test the RedisHelper.catalog_generation property and bump method."""
+    redis_helper.queue.connection.delete(redis_helper.catalog_generation_key)
+    generation = redis_helper.catalog_generation
+    assert redis_helper.catalog_generation == generation
+    assert redis_helper.bump_catalog_generation() == generation + 1
+    assert redis_helper.catalog_generation == generation + 1
+
+
+def test_file_generation(redis_helper) -> None:
+    """Test the RedisHelper.file_generation property and bump method."""
+    redis_helper.queue.connection.delete(redis_helper.file_generation_key)
+    generation = redis_helper.file_generation
+    assert redis_helper.file_generation == generation
+    assert redis_helper.bump_file_generation() == generation + 1
+    assert redis_helper.catalog_generation != redis_helper.file_generation
+
+
+def test_storage_usage(redis_helper, io_helper, monkeypatch) -> None:
+    """Test the RedisHelper running storage usage methods."""
+    (io_helper.uploads_dir / "file.txt").write_bytes(b"content")
+    redis_helper.add_storage_usage(3)
+    assert redis_helper.storage_usage == 7
+    redis_helper.add_storage_usage(-2)
+    assert redis_helper.storage_usage == 5
+
+    redis_helper.reset_storage_usage()
+    assert redis_helper.queue.connection.get(redis_helper.storage_usage_key) is None
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    redis_helper.add_storage_usage(3)
+    redis_helper.reset_storage_usage()
+    assert redis_helper.storage_usage == 7
+
+
+def test_result_cache(redis_helper) -> None:
+    """Test the RedisHelper result cache methods."""
+    entry = {"file_path": "path", "sha256": "sha", "size": 2}
+    assert redis_helper.get_cached_result("intersection", "first", "second") is None
+    redis_helper.cache_result("intersection", "first", "second", entry)
+    assert redis_helper.get_cached_result("intersection", "first", "second") == {
+        "file_path": "path",
+        "sha256": "sha",
+        "size": "2",
+    }
+    assert 0 < redis_helper.queue.connection.ttl(
+        redis_helper.result_cache_key("intersection", "first", "second")
+    )
+
+    redis_helper.record_result_access("intersection", "first", "second")
+    accesses = redis_helper.pop_result_accesses()
+    assert [result for result, _ in accesses] == [("intersection", "first", "second")]
+    assert not redis_helper.pop_result_accesses()
+
+    redis_helper.invalidate_results([("intersection", "first", "second")])
+    redis_helper.invalidate_results([])
+    assert redis_helper.get_cached_result("intersection", "first", "second") is None
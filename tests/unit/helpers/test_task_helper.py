@@ -1,9 +1,24 @@
 """Test cases for the __TaskHelper__ class."""
 
-from pandarus_remote.helpers import TaskHelper
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pytest
+from pandarus.model import Map
+from pandarus.utils.io import sha256_file
+
+from pandarus_remote.errors import InvalidSpatialDatasetError
+from pandarus_remote.helpers import DatabaseHelper, RedisHelper, TaskHelper
 from pandarus_remote.models import File, Intersection, RasterStats, Remaining
 
-from ... import FILE_VECTOR1
+from ... import FILE_RASTER, FILE_TEXT, FILE_VECTOR1
 
 
 def test_n_cpu_default() -> None:
@@ -28,56 +43,366 @@ def test_export_format_custom(monkeypatch) -> None:
     assert TaskHelper().export_format == "Shapefile"
 
 
-def test_intersect_task(monkeypatch, database_helper) -> None:
-    """Test that the intersect_task runs correctly."""
+@pytest.mark.usefixtures("io_helper")
+def test_ingest_task(database_helper, tmp_path) -> None:
+    """Test that the ingest_task validates and adds a stored upload."""
+    database_helper()
+    file_path = tmp_path / FILE_VECTOR1.name
+    file_path.write_bytes(FILE_VECTOR1.read_bytes())
+    result = TaskHelper().ingest_task(
+        str(file_path), FILE_VECTOR1.name, sha256_file(FILE_VECTOR1), None, "name", 1
+    )
+    assert result == {
+        "file_name": FILE_VECTOR1.name,
+        "file_sha256": sha256_file(FILE_VECTOR1),
+    }
+    file = File.get(File.sha256 == sha256_file(FILE_VECTOR1))
+    assert file.kind == "vector"
+    assert file.geometry_type is not None
+
+
+@pytest.mark.usefixtures("io_helper")
+def test_ingest_task_invalid_spatial_dataset(database_helper, tmp_path) -> None:
+    """Test that the ingest_task removes an invalid stored upload."""
+    database_helper()
+    file_path = tmp_path / FILE_TEXT.name
+    file_path.write_bytes(FILE_TEXT.read_bytes())
+    with pytest.raises(InvalidSpatialDatasetError):
+        TaskHelper().ingest_task(str(file_path), FILE_TEXT.name, sha256_file(FILE_TEXT))
+    assert not file_path.exists()
+    assert File.select().count(None) == 0
+
+
+def test_stored_rtree_indexes(monkeypatch, io_helper, tmp_path) -> None:
+    """Test that the TaskHelper.stored_rtree_indexes context makes pandarus load the
+    rtree index from the stored bounds."""
+    file_path = tmp_path / "vector.geojson"
+    file_path.write_bytes(FILE_VECTOR1.read_bytes())
+    io_helper.store_bounds(file_path)
+    create_rtree_index = Map.create_rtree_index
+
+    def _iter_latlong(*_, **__):
+        raise AssertionError("The rtree index should be loaded from its bounds.")
+
+    with TaskHelper().stored_rtree_indexes():
+        vector = Map(str(file_path))
+        monkeypatch.setattr(Map, "iter_latlong", _iter_latlong)
+        assert len(vector.create_rtree_index()) == len(vector)
+        vector.file.close()
+    assert Map.create_rtree_index is create_rtree_index
+
+
+def test_stored_rtree_indexes_threads() -> None:
+    """Test that the TaskHelper.stored_rtree_indexes context keeps the stored index
+    until the last thread inside it leaves."""
+    create_rtree_index = Map.create_rtree_index
+    entered, leave = threading.Event(), threading.Event()
+
+    def _inside_context() -> None:
+        with TaskHelper().stored_rtree_indexes():
+            entered.set()
+            leave.wait(10)
+
+    thread = threading.Thread(target=_inside_context)
+    thread.start()
+    entered.wait(10)
+    with TaskHelper().stored_rtree_indexes():
+        pass
+    assert Map.create_rtree_index is not create_rtree_index
+    leave.set()
+    thread.join()
+    assert Map.create_rtree_index is create_rtree_index
+
+
+def _fork_keeps_stored_rtree_index() -> bool:
+    """Fork a child and return whether the child kept the stored rtree index."""
+    pid = os.fork()
+    if pid == 0:
+        # pylint: disable-next=protected-access
+        os._exit(int(Map.create_rtree_index is TaskHelper._create_rtree_index))
+    return os.waitpid(pid, 0)[1] == 0
+
+
+def test_stored_rtree_indexes_fork() -> None:
+    """Test that children forked inside the TaskHelper.stored_rtree_indexes context
+    keep the stored index, while children forked by other threads restore it."""
+    results = []
+    with TaskHelper().stored_rtree_indexes():
+        assert _fork_keeps_stored_rtree_index()
+        thread = threading.Thread(
+            target=lambda: results.append(_fork_keeps_stored_rtree_index())
+        )
+        thread.start()
+        thread.join()
+    assert results == [False]
+
+
+def _mock_intersect(monkeypatch, tmp_path) -> Tuple[Path, List[str], List[Path]]:
+    """Mock pandarus intersect to write a vector and three data files. Returns the
+    vector path, the data and the data paths."""
+    vector_path = tmp_path / "vector.geojson"
+    vector_path.write_bytes(FILE_VECTOR1.read_bytes())
+    data = [f'{{"data": [["a", "b", {index}.5]]}}' for index in range(3)]
+    data[0] = data[0].replace(
+        "}", ', "metadata": {"first": {"field": "name"}, "second": {"field": "name"}}}'
+    )
+    data_paths = [tmp_path / "data0.json"]
+    data_paths[0].write_text(data[0])
+    for index in (1, 2):
+        data_paths.append(tmp_path / f"data{index}.json.bz2")
+        with bz2.open(data_paths[index], "wt") as data_file:
+            data_file.write(data[index])
     monkeypatch.setattr(
         "pandarus_remote.helpers.intersect",
-        lambda *_, **__: (FILE_VECTOR1, "data_path"),
+        lambda *_, **__: (str(vector_path), str(data_paths[0])),
     )
     monkeypatch.setattr(
         "pandarus_remote.helpers.intersections_from_intersection",
-        lambda *_, **__: ("data_path1", "data_path2"),
+        lambda *_, **__: (str(data_paths[1]), str(data_paths[2])),
     )
+    return vector_path, data, data_paths
+
+
+def test_intersect_task(monkeypatch, database_helper, io_helper, tmp_path) -> None:
+    """Test that the intersect_task runs correctly."""
+    vector_path, data, data_paths = _mock_intersect(monkeypatch, tmp_path)
     database_helper(inserted_files=2)
-    TaskHelper().intersect_task(
-        File.get(File.id == 1),
-        File.get(File.id == 2),
+    TaskHelper().intersect_task("sha2561", "sha2562")
+    vector_sha256 = sha256_file(Intersection.select().first(None).vector_file_path)
+    stored_vector_path = io_helper.content_path(
+        io_helper.intersections_dir, vector_sha256, ".geojson"
     )
+    stored_data_path = Path(Intersection.select().first(None).data_file_path)
     assert Intersection.select().count(None) == 3
     assert Intersection.select().first(None).first_file.id == 1
     assert Intersection.select().first(None).second_file.id == 2
-    assert Intersection.select().first(None).data_file_path == "data_path"
-    assert Intersection.select().first(None).vector_file_path == str(FILE_VECTOR1)
+    assert Intersection.select().first(None).vector_file_path == str(stored_vector_path)
+    stored_data = gzip.decompress(stored_data_path.read_bytes())
+    assert stored_data_path == io_helper.content_path(
+        io_helper.intersections_dir,
+        hashlib.sha256(
+            json.dumps(json.loads(stored_data), sort_keys=True).encode()
+        ).hexdigest(),
+        ".json.gz",
+    )
+    assert json.loads(stored_data)["metadata"] == {
+        "first": {
+            "field": "name",
+            "path": "path1",
+            "filename": "path1",
+            "sha256": "sha2561",
+        },
+        "second": {
+            "field": "name",
+            "path": "path2",
+            "filename": "path2",
+            "sha256": "sha2562",
+        },
+    }
+    assert not vector_path.exists()
+    assert not any(data_path.exists() for data_path in data_paths)
+    assert (
+        gzip.decompress(
+            Path(Intersection.get(Intersection.id == 2).data_file_path).read_bytes()
+        )
+        == data[1].encode()
+    )
+    with np.load(io_helper.columnar_path(stored_data_path)) as columnar:
+        assert columnar["measure"].tolist() == [0.5]
 
+    intersection_file = File.get(File.sha256 == vector_sha256)
+    assert intersection_file.name == "sha2561.sha2562.geojson"
+    assert io_helper.is_stored(intersection_file.file_path, io_helper.uploads_dir)
+    assert Path(intersection_file.file_path).samefile(stored_vector_path)
+    assert intersection_file.canonical_file_path == str(
+        io_helper.content_path(io_helper.uploads_dir, vector_sha256, ".fgb")
+    )
+    assert [
+        (change["type"], change["action"])
+        for change in DatabaseHelper().catalog_changes()["changes"]
+    ] == [
+        ("intersections", "added"),
+        ("files", "added"),
+        ("intersections", "added"),
+        ("intersections", "added"),
+    ]
 
-def test_raster_stats_task(monkeypatch, database_helper) -> None:
-    """Test that the raster_stats_task runs correctly."""
+
+@pytest.mark.usefixtures("io_helper")
+def test_intersect_task_evicted(monkeypatch, database_helper, tmp_path) -> None:
+    """Test that the intersect_task runs again for an evicted intersection, and only
+    records the intersection it added again."""
+    database_helper(inserted_files=2)
+    for _ in range(2):
+        _mock_intersect(monkeypatch, tmp_path)
+        Intersection.delete().where(Intersection.first_file == 1).execute(None)
+        TaskHelper().intersect_task("sha2561", "sha2562")
+    assert Intersection.select().count(None) == 3
+    assert File.select().count(None) == 3
+    assert [
+        (change["type"], change["action"])
+        for change in DatabaseHelper().catalog_changes()["changes"]
+    ] == [
+        ("intersections", "added"),
+        ("files", "added"),
+        ("intersections", "added"),
+        ("intersections", "added"),
+        ("intersections", "added"),
+    ]
+
+
+def test_canonical_task(database_helper, io_helper) -> None:
+    """Test that the canonical_task stores the canonical copy of a file."""
+    database_helper()
+    file_path = io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_RASTER), ".tif"
+    )
+    file_path.parent.mkdir(parents=True)
+    file_path.write_bytes(FILE_RASTER.read_bytes())
+    File.create(
+        name="raster.tif",
+        kind="raster",
+        sha256=sha256_file(FILE_RASTER),
+        file_path=file_path,
+    )
+    canonical_file_path = str(file_path.with_suffix(".cog.tif"))
+    assert TaskHelper().canonical_task(sha256_file(FILE_RASTER)) == canonical_file_path
+    assert File.get(File.id == 1).dataset_path == canonical_file_path
+    assert TaskHelper().canonical_task(sha256_file(FILE_RASTER)) == canonical_file_path
+    assert TaskHelper().canonical_task("sha256") is None
+
+
+def test_canonical_task_vector(database_helper, io_helper) -> None:
+    """Test that the canonical_task stores the canonical copy and the bounds of a
+    vector file."""
+    database_helper()
+    file_path = io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".geojson"
+    )
+    file_path.parent.mkdir(parents=True)
+    file_path.write_bytes(FILE_VECTOR1.read_bytes())
+    File.create(
+        name="vector.geojson",
+        kind="vector",
+        sha256=sha256_file(FILE_VECTOR1),
+        file_path=file_path,
+    )
+    canonical_file_path = str(file_path.with_suffix(".fgb"))
+    assert TaskHelper().canonical_task(sha256_file(FILE_VECTOR1)) == canonical_file_path
+    assert File.get(File.id == 1).dataset_path == canonical_file_path
+    assert io_helper.bounds_path(file_path).exists()
+
+
+@pytest.mark.usefixtures("io_helper")
+def test_evict_task(monkeypatch) -> None:
+    """Test that the evict_task evicts results over the storage budget."""
+    monkeypatch.setattr(DatabaseHelper, "evict_results", lambda _, budget: budget)
+    assert TaskHelper().evict_task() == 0
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "2")
+    assert TaskHelper().evict_task() == 2
+
+
+def test_sweep_interval(monkeypatch) -> None:
+    """Test that the sweep interval can be set with an environment variable."""
+    assert TaskHelper().sweep_interval is None
+    monkeypatch.setenv("PANDARUS_SWEEP_INTERVAL", "3600")
+    assert TaskHelper().sweep_interval == 3600
+
+
+def test_sweep_task(monkeypatch, database_helper) -> None:
+    """Test that the sweep_task sweeps the storage, compacts the jobs and runs again
+    with the same options after the sweep interval."""
+    swept = {"orphaned_files": 1, "missing_entries": 2, "expired_uploads": 0}
+    delays = []
+    sweep_arguments = []
     monkeypatch.setattr(
-        "pandarus_remote.helpers.raster_statistics",
-        lambda *_, **__: "data_path",
+        DatabaseHelper,
+        "sweep_storage",
+        lambda _, *args: sweep_arguments.append(args) or dict(swept),
     )
+    monkeypatch.setattr(RedisHelper, "compact_jobs", lambda _: 3)
+    swept_and_compacted = {**swept, "legacy_job_ids": 3}
+    monkeypatch.setattr(
+        RedisHelper,
+        "enqueue_sweep_job",
+        lambda _, d, **options: delays.append((d, options)),
+    )
+    database_helper()
+    assert TaskHelper().sweep_task() == swept_and_compacted
+    assert not delays
+    assert TaskHelper().sweep_task(60, True) == {**swept, "legacy_job_ids": 0}
+    assert sweep_arguments == [(24 * 60 * 60, False), (60, True)]
+
+    monkeypatch.setenv("PANDARUS_SWEEP_INTERVAL", "3600")
+    assert TaskHelper().sweep_task() == swept_and_compacted
+    assert TaskHelper().sweep_task(60, True) == {**swept, "legacy_job_ids": 0}
+    assert delays == [
+        (3600, {"grace_period": 24 * 60 * 60, "dry_run": False}),
+        (3600, {"grace_period": 60, "dry_run": True}),
+    ]
+
+
+def test_raster_stats_task(monkeypatch, database_helper, io_helper, tmp_path) -> None:
+    """Test that the raster_stats_task runs correctly."""
+    data = {
+        "data": [["a", {"min": 1, "max": 2, "mean": 1.5, "count": 2}]],
+        "metadata": {"vector": {"field": "name"}, "raster": {"band": 1}},
+    }
+    data_path = tmp_path / "data.json"
+    data_path.write_text(json.dumps(data))
+    data["metadata"]["vector"].update(path="path1", filename="path1", sha256="sha2561")
+    data["metadata"]["raster"].update(path="path2", filename="path2", sha256="sha2562")
+    raster_statistics_args = []
+
+    def _raster_statistics(*args, **__) -> str:
+        raster_statistics_args.extend(args)
+        return str(data_path)
+
+    monkeypatch.setattr("pandarus_remote.helpers.raster_statistics", _raster_statistics)
 
     database_helper(inserted_files=2, insert_intersections=True)
-    TaskHelper().raster_stats_task(
-        File.get(File.id == 1),
-        File.get(File.id == 2),
-        1,
-    )
+    File.update(canonical_file_path="path2.cog.tif").where(File.id == 2).execute(None)
+    TaskHelper().raster_stats_task("sha2561", "sha2562", 1)
+    assert raster_statistics_args == ["path1", None, "path2.cog.tif"]
     assert RasterStats.select().count(None) == 1
     assert RasterStats.select().first(None).vector_file.id == 1
     assert RasterStats.select().first(None).raster_file.id == 2
-    assert RasterStats.select().first(None).output_file_path == "data_path"
+    assert RasterStats.select().first(None).output_file_path == str(
+        io_helper.content_path(
+            io_helper.raster_stats_dir,
+            hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest(),
+            ".json.gz",
+        )
+    )
+    with np.load(
+        io_helper.columnar_path(RasterStats.select().first(None).output_file_path)
+    ) as columnar:
+        assert columnar["id"].tolist() == ["a"]
+        assert columnar["mean"].tolist() == [1.5]
+    assert RedisHelper().get_cached_result("raster_stats", "sha2561", "sha2562")[
+        "file_path"
+    ] == str(RasterStats.select().first(None).output_file_path)
 
 
-def test_remaining_task(monkeypatch, database_helper) -> None:
+def test_remaining_task(monkeypatch, database_helper, io_helper, tmp_path) -> None:
     """Test that the remaining_task runs correctly."""
+    data = {"data": [["a", 0.5]], "metadata": {"source": {"field": "name"}}}
+    data_path = tmp_path / "data.json"
+    data_path.write_text(json.dumps(data))
+    data["metadata"]["source"].update(path="path1", filename="path1", sha256="sha2561")
     monkeypatch.setattr(
         "pandarus_remote.helpers.calculate_remaining",
-        lambda *_, **__: "data_path",
+        lambda *_, **__: str(data_path),
     )
 
     database_helper(inserted_files=2, insert_intersections=True)
-    TaskHelper().remaining_task(1)
+    TaskHelper().remaining_task("sha2561", "sha2562")
     assert Remaining.select().count(None) == 1
     assert Remaining.select().first(None).intersection.id == 1
-    assert Remaining.select().first(None).data_file_path == "data_path"
+    assert Remaining.select().first(None).data_file_path == str(
+        io_helper.content_path(
+            io_helper.remaining_dir,
+            hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest(),
+            ".json.gz",
+        )
+    )
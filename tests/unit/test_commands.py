@@ -0,0 +1,121 @@
+"""Test cases for the __commands__ module."""
+
+from pandarus_remote.app import create_app
+from pandarus_remote.commands import (
+    evict_results_command,
+    job_stats_command,
+    migrate_storage_command,
+    pin_result_command,
+    store_bounds_command,
+    sweep_storage_command,
+)
+from pandarus_remote.helpers import DatabaseHelper, RedisHelper
+
+
+def test_migrate_storage_command(monkeypatch, database_helper) -> None:
+    """Test the migrate-storage command."""
+    monkeypatch.setattr(DatabaseHelper, "migrate_storage", lambda _: 2)
+    database_helper()
+
+    result = create_app().test_cli_runner().invoke(migrate_storage_command)
+    assert result.exit_code == 0
+    assert "Migrated 2 file(s)" in result.output
+
+
+def test_store_bounds_command(monkeypatch, database_helper) -> None:
+    """Test the store-bounds command."""
+    monkeypatch.setattr(DatabaseHelper, "store_missing_bounds", lambda _: 3)
+    database_helper()
+
+    result = create_app().test_cli_runner().invoke(store_bounds_command)
+    assert result.exit_code == 0
+    assert "Stored the bounds index of 3 vector file(s)." in result.output
+
+
+def test_evict_results_command(monkeypatch, database_helper) -> None:
+    """Test the evict-results command."""
+    monkeypatch.setattr(DatabaseHelper, "evict_results", lambda _, budget: budget)
+    database_helper()
+
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(evict_results_command)
+    assert result.exit_code != 0
+    assert "PANDARUS_STORAGE_BUDGET" in result.output
+
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "4")
+    assert "Evicted 4 result(s)." in runner.invoke(evict_results_command).output
+    result = runner.invoke(evict_results_command, ["--budget", "5"])
+    assert "Evicted 5 result(s)." in result.output
+
+
+def test_pin_result_command(monkeypatch, database_helper) -> None:
+    """Test the pin-result command."""
+    pinned_results = []
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "pin_result",
+        lambda _, *args, pinned=True: pinned_results.append((*args, pinned)),
+    )
+    database_helper()
+
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(pin_result_command, ["intersection", "sha1", "sha2"])
+    assert "Pinned the intersection result." in result.output
+    result = runner.invoke(pin_result_command, ["remaining", "sha1", "sha2", "--unpin"])
+    assert "Unpinned the remaining result." in result.output
+    assert pinned_results == [
+        ("intersection", "sha1", "sha2", True),
+        ("remaining", "sha1", "sha2", False),
+    ]
+
+
+def test_sweep_storage_command(monkeypatch, database_helper) -> None:
+    """Test the sweep-storage command."""
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "sweep_storage",
+        lambda _, grace_period, dry_run: {
+            "orphaned_files": int(grace_period),
+            "missing_entries": int(dry_run),
+            "expired_uploads": 2,
+        },
+    )
+    enqueued = []
+    monkeypatch.setattr(
+        RedisHelper,
+        "enqueue_sweep_job",
+        lambda _, **kwargs: enqueued.append(kwargs)
+        or type("Job", (), {"id": "job_id"}),
+    )
+    database_helper()
+
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(sweep_storage_command, ["--grace-period", "3", "--dry-run"])
+    assert (
+        "Found 3 orphaned file(s), 1 entry(ies) with missing files and 2 expired "
+        "upload(s)." in result.output
+    )
+    result = runner.invoke(sweep_storage_command, ["--enqueue"])
+    assert "Enqueued the sweep job job_id." in result.output
+    result = runner.invoke(
+        sweep_storage_command, ["--enqueue", "--grace-period", "3", "--dry-run"]
+    )
+    assert "Enqueued the sweep job job_id." in result.output
+    assert enqueued == [
+        {"grace_period": 24 * 60 * 60, "dry_run": False},
+        {"grace_period": 3, "dry_run": True},
+    ]
+
+
+def test_job_stats_command(
+    monkeypatch, redis_helper  # pylint: disable=unused-argument
+) -> None:
+    """Test the job-stats command."""
+    monkeypatch.setattr(RedisHelper, "job_stats", {"queued": 1, "legacy_job_ids": 0})
+    monkeypatch.setattr(RedisHelper, "compact_jobs", lambda _: 6)
+
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(job_stats_command)
+    assert result.output == "queued: 1\nlegacy_job_ids: 0\n"
+    result = runner.invoke(job_stats_command, ["--compact"])
+    assert result.output.startswith("Deleted 6 legacy job id(s).\nqueued: 1\n")
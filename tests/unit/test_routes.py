@@ -1,15 +1,22 @@
 """Test cases for the __routes__ module."""
 
+import json
+import tarfile
 from http import HTTPStatus
+from io import BytesIO
 from typing import Any, Dict
 
+from pandarus.utils.io import sha256_file
+
 from pandarus_remote import __version__
 from pandarus_remote.errors import (
     FileAlreadyExistsError,
     IntersectionWithSelfError,
+    InvalidCatalogQueryError,
     InvalidIntersectionFileTypesError,
     InvalidIntersectionGeometryTypeError,
     InvalidRasterstatsFileTypesError,
+    InvalidResultTypeError,
     InvalidSpatialDatasetError,
     JobNotFoundError,
     NoneReproducibleHashError,
@@ -17,7 +24,7 @@ from pandarus_remote.errors import (
 from pandarus_remote.helpers import DatabaseHelper, IOHelper, RedisHelper
 from pandarus_remote.models import File, Intersection, RasterStats, Remaining
 
-from .. import FILE_TEXT
+from .. import FILE_TEXT, FILE_VECTOR1
 
 
 class _MockJob:  # pylint: disable=too-few-public-methods
@@ -50,6 +57,124 @@ def test_catalog(client, monkeypatch) -> None:
     assert response.json == catalog
 
 
+def test_catalog_etag(client, database_helper) -> None:
+    """Test that the catalog page is cached by generation and answers conditional
+    requests with 304."""
+    database_helper(inserted_files=1)
+    response = client.get("/catalog")
+    etag = response.headers["ETag"]
+    assert response.headers["X-Catalog-Cursor"] == str(
+        DatabaseHelper().catalog_change_sequence
+    )
+    assert [file["sha256"] for file in response.json["files"]] == ["sha2561"]
+
+    response = client.get("/catalog", headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    File.delete().execute(None)
+    assert client.get("/catalog", headers={"If-None-Match": etag}).status_code == (
+        HTTPStatus.NOT_MODIFIED
+    )
+    RedisHelper().bump_catalog_generation()
+    response = client.get("/catalog", headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["files"] == []
+
+
+def test_catalog_changes(client, monkeypatch) -> None:
+    """Test that the catalog changes page passes the cursor and limit."""
+    monkeypatch.setattr(
+        DatabaseHelper, "catalog_changes", lambda _, *args: {"args": list(args)}
+    )
+
+    response = client.get("/catalog/changes?since=5&limit=10")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {"args": [5, 10]}
+    assert client.get("/catalog/changes").json == {"args": [0, 1000]}
+    response = client.get("/catalog/changes?since=-1")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_catalog_query(client, monkeypatch) -> None:
+    """Test that the catalog page passes filters and pagination to the query."""
+    monkeypatch.setattr(
+        DatabaseHelper, "query_catalog", lambda _, *args: {"args": list(args)}
+    )
+
+    response = client.get("/catalog?type=files&kind=vector&limit=10&cursor=5")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {"args": ["files", "vector", None, 5, 10]}
+
+    response = client.get("/catalog?limit=0")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json == {
+        "error": str(
+            InvalidCatalogQueryError("limit", "must be an integer of at least 1")
+        )
+    }
+    response = client.get("/catalog?type=files&cursor=abc")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_file_exists(client, monkeypatch) -> None:
+    """Test that the file_exists endpoint is called correctly."""
+    monkeypatch.setattr(DatabaseHelper, "file_exists", lambda _, sha256: sha256 == "a")
+
+    response = client.head("/files/a")
+    assert response.status_code == HTTPStatus.OK
+    response = client.head("/files/b")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_files_exist(client, monkeypatch) -> None:
+    """Test that the files_exist endpoint is called correctly."""
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "existing_files",
+        lambda _, sha256s: [sha256 for sha256 in sha256s if sha256 != "b"],
+    )
+
+    response = client.post("/files/exists", data={"sha256": ["a", "b", "c"]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {"existing": ["a", "c"], "missing": ["b"]}
+
+
+def test_results_exist(client, monkeypatch) -> None:
+    """Test that the results_exist endpoint is called correctly."""
+    calls = []
+
+    def _mock_existing_results(_, result_type, pairs):
+        calls.append(result_type)
+        if result_type == "invalid":
+            raise InvalidResultTypeError(result_type, DatabaseHelper.result_types)
+        return [pair for pair in pairs if pair[1] != "b"]
+
+    monkeypatch.setattr(DatabaseHelper, "existing_results", _mock_existing_results)
+
+    results = [
+        {"type": "intersection", "first": "a", "second": "b"},
+        {"type": "remaining", "first": "a", "second": "c"},
+        {"type": "intersection", "first": "a", "second": "c"},
+    ]
+    response = client.post("/results/exists", json=results)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {"existing": results[1:], "missing": results[:1]}
+    assert sorted(calls) == ["intersection", "remaining"]
+
+    response = client.post(
+        "/results/exists", json=[{"type": "invalid", "first": "a", "second": "b"}]
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    response = client.post("/results/exists", json=[{"type": "intersection"}])
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.post(
+        "/results/exists",
+        json=[{"type": "intersection", "first": ["sha2561"], "second": "sha2562"}],
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
 def test_status(client, monkeypatch) -> None:
     """Test that the status page is called correctly."""
     status = {"status": "queued", "result": None}
@@ -117,6 +242,208 @@ def test_get_remaining(client, monkeypatch) -> None:
     assert response.status_code == HTTPStatus.OK
 
 
+def test_get_intersection_compressed(client, monkeypatch, io_helper, tmp_path) -> None:
+    """Test that the get_intersection endpoint serves compressed results according to
+    Accept-Encoding."""
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "get_intersection",
+        lambda *_, **__: Intersection(data_file_path=str(stored_path)),
+    )
+
+    response = client.post(
+        "/intersection",
+        data={"first": "first", "second": "second"},
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.data == stored_path.read_bytes()
+
+    response = client.post(
+        "/intersection",
+        data={"first": "first", "second": "second"},
+        headers={"Accept-Encoding": "identity"},
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert "Content-Encoding" not in response.headers
+    assert response.mimetype == "application/json"
+    assert response.data == b'{"data": []}'
+    assert stored_path.name.removesuffix(".gz") in (
+        response.headers["Content-Disposition"]
+    )
+
+
+def test_get_intersection_conditional(client, monkeypatch, io_helper, tmp_path) -> None:
+    """Test that the get_intersection endpoint answers conditional and range
+    requests made with GET with the result hash as ETag."""
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    sha256 = io_helper.content_sha256(stored_path)
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "get_intersection",
+        lambda *_, **__: Intersection(
+            data_file_path=str(stored_path), data_sha256=sha256
+        ),
+    )
+    query = {"first": "first", "second": "second"}
+
+    response = client.get(
+        "/intersection", query_string=query, headers={"Accept-Encoding": ""}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] == f'"{sha256}"'
+    response = client.get(
+        "/intersection",
+        query_string=query,
+        headers={"Accept-Encoding": "", "If-None-Match": f'"{sha256}"'},
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    response = client.get(
+        "/intersection", query_string=query, headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] == f'"{sha256}-gzip"'
+    response = client.get(
+        "/intersection",
+        query_string=query,
+        headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{sha256}-gzip"'},
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    response = client.get(
+        "/intersection",
+        query_string=query,
+        headers={"Accept-Encoding": "gzip", "Range": "bytes=10-"},
+    )
+    assert response.status_code == HTTPStatus.PARTIAL_CONTENT
+    assert response.data == stored_path.read_bytes()[10:]
+
+
+def test_get_intersection_offloaded(client, monkeypatch, io_helper, tmp_path) -> None:
+    """Test that the get_intersection endpoint offloads downloads to the front server
+    if a sendfile mode is set."""
+    monkeypatch.setenv("PANDARUS_SENDFILE_MODE", "x-accel-redirect")
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    sha256 = io_helper.content_sha256(stored_path)
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "get_intersection",
+        lambda *_, **__: Intersection(
+            data_file_path=str(stored_path), data_sha256=sha256
+        ),
+    )
+    query = {"first": "first", "second": "second"}
+
+    response = client.get(
+        "/intersection", query_string=query, headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == (
+        "/pandarus_remote_data/"
+        + stored_path.relative_to(io_helper.data_dir).as_posix()
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == f'"{sha256}-gzip"'
+    assert f"filename={sha256}.json" in response.headers["Content-Disposition"]
+    response = client.get(
+        "/intersection",
+        query_string=query,
+        headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{sha256}-gzip"'},
+    )
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    response = client.get(
+        "/intersection", query_string=query, headers={"Accept-Encoding": ""}
+    )
+    assert "X-Accel-Redirect" not in response.headers
+    assert response.data == b'{"data": []}'
+
+
+def test_get_remaining_npz(client, monkeypatch, io_helper, tmp_path) -> None:
+    """Test that the get_remaining endpoint serves the NPZ file with format=npz."""
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": [["a", 0.5]]}')
+    stored_path = io_helper.store_result(json_path, io_helper.remaining_dir)
+    columnar_path = io_helper.store_columnar(stored_path, "remaining")
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "get_remaining",
+        lambda *_, **__: Remaining(data_file_path=str(stored_path)),
+    )
+
+    response = client.get(
+        "/remaining", query_string={"first": "first", "second": "second"}
+    )
+    assert response.mimetype == "application/json"
+    response = client.get(
+        "/remaining",
+        query_string={"first": "first", "second": "second", "format": "npz"},
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.data == columnar_path.read_bytes()
+    assert columnar_path.name in response.headers["Content-Disposition"]
+
+
+def test_results_archive(client, database_helper, io_helper, tmp_path) -> None:
+    """Test that the results_archive endpoint streams found results and a
+    manifest."""
+    database_helper(inserted_files=2, insert_intersections=True)
+    json_path = tmp_path / "result.json"
+    json_path.write_bytes(b'{"data": []}')
+    stored_path = io_helper.store_result(json_path, io_helper.intersections_dir)
+    Intersection.update(data_file_path=str(stored_path)).where(
+        Intersection.id == 1
+    ).execute(None)
+
+    response = client.post(
+        "/results/archive",
+        json=[
+            {"type": "intersection", "first": "sha2561", "second": "sha2562"},
+            {"type": "intersection", "first": "sha2562", "second": "sha2561"},
+            {"type": "remaining", "first": "sha2561", "second": "sha2562"},
+            {"type": "invalid", "first": "sha2561", "second": "sha2562"},
+        ],
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.mimetype == "application/x-tar"
+    with tarfile.open(fileobj=BytesIO(response.data)) as tar:
+        name = "intersection/sha2561-sha2562.json.gz"
+        assert tar.getnames() == ["manifest.json", name]
+        assert tar.extractfile(name).read() == stored_path.read_bytes()
+        manifest = json.load(tar.extractfile("manifest.json"))
+    assert manifest[0]["file"] == name
+    assert manifest[1]["error"] == "Result file is missing."
+    assert "No entry found" in manifest[2]["error"]
+    assert "Invalid result type" in manifest[3]["error"]
+
+
+def test_results_archive_invalid(client) -> None:
+    """Test that the results_archive endpoint rejects invalid requests."""
+    response = client.post("/results/archive", json={"type": "intersection"})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.post("/results/archive", json=[{"type": "intersection"}])
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.post(
+        "/results/archive",
+        json=[{"type": ["intersection"], "first": "sha2561", "second": "sha2562"}],
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.post(
+        "/results/archive", json=[{"type": "intersection", "first": 1, "second": {}}]
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
 def test_upload(client, monkeypatch, mock_uploaded_file) -> None:
     """Test that the upload endpoint is called correctly."""
     file, file_content = mock_uploaded_file
@@ -138,6 +465,32 @@ def test_upload(client, monkeypatch, mock_uploaded_file) -> None:
     assert response.json == {"file_name": file.name, "file_sha256": file.sha256}
 
 
+def test_upload_staging_file(io_helper, client, monkeypatch) -> None:
+    """Test that the upload endpoint moves the file it received into a staging file
+    to the storage without writing it again, and removes the staging file of a
+    rejected upload."""
+
+    def _write_stream(*_, **__) -> None:
+        raise AssertionError("The upload should be moved from its staging file.")
+
+    monkeypatch.setattr(IOHelper, "write_stream", _write_stream)
+    for status in (HTTPStatus.OK, HTTPStatus.CONFLICT):
+        with FILE_VECTOR1.open("rb") as stream:
+            response = client.post(
+                "/upload",
+                data={
+                    "file": (stream, FILE_VECTOR1.name),
+                    "name": FILE_VECTOR1.name,
+                    "sha256": sha256_file(FILE_VECTOR1),
+                },
+            )
+        assert response.status_code == status
+        assert not list(io_helper.uploads_dir.glob("*.part"))
+    assert io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".geojson"
+    ).exists()
+
+
 def test_upload_invalid_spatial_dataset(
     client, monkeypatch, mock_uploaded_file
 ) -> None:
@@ -223,7 +576,206 @@ def test_upload_file_already_exists(
     )
     assert response.status_code == HTTPStatus.CONFLICT
     assert response.json == {"error": str(error)}
-    assert not file_path.exists()
+    assert file_path.exists()
+
+
+def test_upload_async_ingest(
+    io_helper, client, monkeypatch  # pylint: disable=unused-argument
+) -> None:
+    """Test that the upload endpoint enqueues an ingest job in async ingest mode."""
+    monkeypatch.setenv("PANDARUS_ASYNC_INGEST", "1")
+    monkeypatch.setattr(
+        RedisHelper, "enqueue_ingest_job", lambda *_, **__: _MockJob("job_id")
+    )
+    monkeypatch.setattr(DatabaseHelper, "file_exists", lambda *_, **__: False)
+
+    with FILE_VECTOR1.open("rb") as stream:
+        response = client.post(
+            "/upload",
+            data={
+                "file": stream,
+                "name": FILE_VECTOR1.name,
+                "sha256": sha256_file(FILE_VECTOR1),
+            },
+        )
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert response.json == {
+        "file_sha256": sha256_file(FILE_VECTOR1),
+        "status": "/status/job_id",
+    }
+    assert io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".geojson"
+    ).exists()
+
+
+def test_upload_async_ingest_file_already_exists(
+    io_helper, client, monkeypatch  # pylint: disable=unused-argument
+) -> None:
+    """Test that the upload endpoint doesn't store or enqueue an ingest job for an
+    existing file in async ingest mode."""
+    monkeypatch.setenv("PANDARUS_ASYNC_INGEST", "1")
+    monkeypatch.setattr(DatabaseHelper, "file_exists", lambda *_, **__: True)
+
+    with FILE_VECTOR1.open("rb") as stream:
+        response = client.post(
+            "/upload",
+            data={
+                "file": stream,
+                "name": FILE_VECTOR1.name,
+                "sha256": sha256_file(FILE_VECTOR1),
+            },
+        )
+    assert response.status_code == HTTPStatus.CONFLICT
+    assert response.json == {"error": str(FileAlreadyExistsError(FILE_VECTOR1.name))}
+    assert not list(io_helper.iter_files(io_helper.uploads_dir))
+
+
+def _start_upload(client, chunk_size: int = 100) -> str:
+    """Start a resumable upload of FILE_VECTOR1 and return its upload_id."""
+    response = client.post(
+        "/upload/start",
+        data={
+            "name": FILE_VECTOR1.name,
+            "sha256": sha256_file(FILE_VECTOR1),
+            "size": FILE_VECTOR1.stat().st_size,
+            "chunk_size": chunk_size,
+        },
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    return response.json["upload_id"]
+
+
+def test_resumable_upload(io_helper, client) -> None:  # pylint: disable=unused-argument
+    """Test that the resumable upload endpoints are called correctly."""
+    upload_id = _start_upload(client)
+    content = FILE_VECTOR1.read_bytes()
+    chunks = [content[start : start + 100] for start in range(0, len(content), 100)]
+
+    for index in reversed(range(1, len(chunks))):
+        response = client.put(f"/upload/{upload_id}/{index}", data=chunks[index])
+        assert response.status_code == HTTPStatus.OK
+    response = client.post(f"/upload/{upload_id}/finalize")
+    assert response.status_code == HTTPStatus.CONFLICT
+
+    response = client.get(f"/upload/{upload_id}")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["missing"] == [0]
+
+    response = client.put(f"/upload/{upload_id}/0", data=chunks[0])
+    assert response.status_code == HTTPStatus.OK
+    response = client.post(f"/upload/{upload_id}/finalize")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json["file_sha256"] == sha256_file(FILE_VECTOR1)
+    assert DatabaseHelper().file_exists(sha256_file(FILE_VECTOR1))
+
+    response = client.get(f"/upload/{upload_id}")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_resumable_upload_async_ingest(io_helper, client, monkeypatch) -> None:
+    """Test that the finalize_upload endpoint enqueues an ingest job in async ingest
+    mode."""
+    monkeypatch.setenv("PANDARUS_ASYNC_INGEST", "1")
+    monkeypatch.setattr(
+        RedisHelper, "enqueue_ingest_job", lambda *_, **__: _MockJob("job_id")
+    )
+    upload_id = _start_upload(client, chunk_size=FILE_VECTOR1.stat().st_size)
+    response = client.put(f"/upload/{upload_id}/0", data=FILE_VECTOR1.read_bytes())
+    assert response.status_code == HTTPStatus.OK
+
+    response = client.post(f"/upload/{upload_id}/finalize")
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert response.json == {
+        "file_sha256": sha256_file(FILE_VECTOR1),
+        "status": "/status/job_id",
+    }
+    assert not DatabaseHelper().file_exists(sha256_file(FILE_VECTOR1))
+    assert io_helper.content_path(
+        io_helper.uploads_dir, sha256_file(FILE_VECTOR1), ".geojson"
+    ).exists()
+    assert client.get(f"/upload/{upload_id}").status_code == HTTPStatus.NOT_FOUND
+
+
+def test_resumable_upload_file_already_exists(io_helper, client) -> None:
+    """Test that the finalize_upload endpoint doesn't store a file uploaded by another
+    request meanwhile."""
+    upload_id = _start_upload(client, chunk_size=FILE_VECTOR1.stat().st_size)
+    response = client.put(f"/upload/{upload_id}/0", data=FILE_VECTOR1.read_bytes())
+    assert response.status_code == HTTPStatus.OK
+    DatabaseHelper().add_uploaded_file(
+        File(
+            name="name",
+            kind="vector",
+            sha256=sha256_file(FILE_VECTOR1),
+            file_path="file_path",
+        )
+    )
+
+    response = client.post(f"/upload/{upload_id}/finalize")
+    assert response.status_code == HTTPStatus.CONFLICT
+    assert not list(io_helper.iter_files(io_helper.uploads_dir))
+    assert client.get(f"/upload/{upload_id}").status_code == HTTPStatus.NOT_FOUND
+
+
+def test_resumable_upload_invalid_chunk(
+    io_helper, client  # pylint: disable=unused-argument
+) -> None:
+    """Test that the upload_chunk endpoint rejects invalid chunks."""
+    upload_id = _start_upload(client)
+    content = FILE_VECTOR1.read_bytes()
+
+    response = client.put(f"/upload/{upload_id}/100", data=content[:100])
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.put(f"/upload/{upload_id}/0", data=content[:99])
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.put(f"/upload/{upload_id}/0?sha256=wrong", data=content[:100])
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert client.get(f"/upload/{upload_id}").json["received"] == []
+
+
+def test_start_upload_invalid_size(client) -> None:
+    """Test that the start_upload endpoint rejects invalid sizes."""
+    response = client.post(
+        "/upload/start",
+        data={"name": "name", "sha256": "sha256", "size": 1, "chunk_size": 0},
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    response = client.post(
+        "/upload/start",
+        data={"name": "name", "sha256": "sha256", "size": "a", "chunk_size": 1},
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json["error"] == "Upload size and chunk size must be integers."
+    response = client.post(
+        "/upload/start",
+        data={"name": "name", "sha256": "sha256", "size": 1, "chunk_size": "a"},
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_start_upload_too_large(client, monkeypatch) -> None:
+    """Test that the start_upload endpoint rejects sizes over the maximum upload size
+    and chunk sizes over the maximum request size."""
+    monkeypatch.setenv("PANDARUS_MAX_UPLOAD_SIZE", "10")
+    response = client.post(
+        "/upload/start",
+        data={"name": "name", "sha256": "sha256", "size": 11, "chunk_size": 2},
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json["error"] == "Upload size must be at most 10 bytes."
+    response = client.post(
+        "/upload/start",
+        data={
+            "name": "name",
+            "sha256": "sha256",
+            "size": 10,
+            "chunk_size": 250 * 1024 * 1024 + 1,
+        },
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json["error"] == (
+        f"Chunk size must be at most {250 * 1024 * 1024} bytes."
+    )
 
 
 def test_calcculate_intersection(client, monkeypatch) -> None:
@@ -401,3 +953,24 @@ def test_calculate_remaining(client, monkeypatch) -> None:
     )
     assert response.status_code == HTTPStatus.ACCEPTED
     assert f"/status/{job_id}" in response.data.decode()
+
+
+def test_calculate_remaining_enqueues_eviction(client, monkeypatch) -> None:
+    """Test that the calculate endpoints enqueue an eviction job if a storage budget
+    is set."""
+    monkeypatch.setenv("PANDARUS_STORAGE_BUDGET", "1024")
+    monkeypatch.setattr(
+        DatabaseHelper,
+        "get_remaining",
+        lambda *_, **__: Remaining(intersection=Intersection()),
+    )
+    monkeypatch.setattr(
+        RedisHelper, "enqueue_remaining_job", lambda *_, **__: _MockJob("job_id")
+    )
+
+    response = client.post(
+        "/calculate_remaining", data={"first": "first", "second": "second"}
+    )
+    assert response.status_code == HTTPStatus.ACCEPTED
+    (eviction_job,) = RedisHelper().queue.get_jobs()
+    assert eviction_job.func_name.endswith("evict_task")
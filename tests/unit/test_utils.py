@@ -7,18 +7,25 @@ from typing import Any, Dict, Optional, Tuple
 import pytest
 
 from pandarus_remote.errors import (
+    IncompleteUploadError,
     IntersectionWithSelfError,
+    InvalidChunkError,
     InvalidIntersectionFileTypesError,
     InvalidIntersectionGeometryTypeError,
     InvalidRasterstatsFileTypesError,
+    InvalidResultFormatError,
     NoEntryFoundError,
     ResultAlreadyExistsError,
+    ResultFormatNotFoundError,
+    ResultMissingError,
+    UploadNotFoundError,
 )
+from pandarus_remote.responses import get_calculation_endpoint
 from pandarus_remote.utils import (
     calculate_endpoint,
     create_if_not_exists,
-    get_calculation_endpoint,
     loggable,
+    upload_endpoint,
 )
 
 
@@ -83,20 +90,49 @@ def test_create_if_not_exists(tmp_path) -> None:
     assert path.exists()
 
 
-def test_get_calculation_endpoint(monkeypatch) -> None:
+def test_get_calculation_endpoint(client, monkeypatch) -> None:
     """Test the get_calculation_endpoint decorator."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     @get_calculation_endpoint
-    def _calculation_function() -> str:
-        return "test"
+    def _calculation_function() -> Tuple[str, Optional[str]]:
+        return "test", None
+
+    with client.application.test_request_context():
+        assert _calculation_function() == "test"
+
+
+def test_get_calculation_endpoint_invalid_result_format(client) -> None:
+    """Test the get_calculation_endpoint decorator with InvalidResultFormatError."""
+
+    @get_calculation_endpoint
+    def _calculation_function() -> Tuple[str, Optional[str]]:
+        return "test", None
+
+    with client.application.test_request_context("/?format=invalid"):
+        assert _calculation_function() == (
+            {"error": str(InvalidResultFormatError("invalid", ["json", "npz"]))},
+            HTTPStatus.BAD_REQUEST,
+        )
 
-    assert _calculation_function() == ("test", HTTPStatus.OK)
+
+def test_get_calculation_endpoint_result_format_not_found(client) -> None:
+    """Test the get_calculation_endpoint decorator with ResultFormatNotFoundError."""
+
+    @get_calculation_endpoint
+    def _calculation_function() -> Tuple[str, Optional[str]]:
+        return "test", None
+
+    with client.application.test_request_context("/?format=npz"):
+        assert _calculation_function() == (
+            {"error": str(ResultFormatNotFoundError("npz"))},
+            HTTPStatus.NOT_FOUND,
+        )
 
 
 def test_get_calculation_endpoint_no_entry_found(monkeypatch) -> None:
     """Test the get_calculation_endpoint decorator with NoEntryFoundError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = NoEntryFoundError("Test")
 
@@ -107,9 +143,22 @@ def test_get_calculation_endpoint_no_entry_found(monkeypatch) -> None:
     assert _calculation_function() == ({"error": str(error)}, HTTPStatus.NOT_FOUND)
 
 
+def test_get_calculation_endpoint_result_missing(monkeypatch) -> None:
+    """Test the get_calculation_endpoint decorator with ResultMissingError."""
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
+
+    error = ResultMissingError(["sha256"])
+
+    @get_calculation_endpoint
+    def _calculation_function() -> str:
+        raise error
+
+    assert _calculation_function() == ({"error": str(error)}, HTTPStatus.GONE)
+
+
 def test_get_calculation_endpoint_result_already_exists(monkeypatch) -> None:
     """Test the get_calculation_endpoint decorator with ResultAlreadyExistsError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = ResultAlreadyExistsError("Test")
 
@@ -133,7 +182,7 @@ def test_calculate_endpoint(monkeypatch) -> None:
 
 def test_calculate_endpoint_no_entry_found(monkeypatch) -> None:
     """Test the test_calculate_endpoint decorator with NoEntryFoundError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = NoEntryFoundError("Test")
 
@@ -146,7 +195,7 @@ def test_calculate_endpoint_no_entry_found(monkeypatch) -> None:
 
 def test_calculate_endpoint_result_already_exists(monkeypatch) -> None:
     """Test the test_calculate_endpoint decorator with ResultAlreadyExistsError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = ResultAlreadyExistsError("Test")
 
@@ -160,7 +209,7 @@ def test_calculate_endpoint_result_already_exists(monkeypatch) -> None:
 def test_calculate_endpoint_invalid_rasterstats_file_types(monkeypatch) -> None:
     """Test the test_calculate_endpoint decorator with
     InvalidRasterstatsFileTypesError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = InvalidRasterstatsFileTypesError("sha2561", "raster", "sha2562", "vector")
 
@@ -174,7 +223,7 @@ def test_calculate_endpoint_invalid_rasterstats_file_types(monkeypatch) -> None:
 def test_calculate_endpoint_invalid_intersection_geometry_type(monkeypatch) -> None:
     """Test the test_calculate_endpoint decorator with
     InvalidIntersectionGeometryTypeError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = InvalidIntersectionGeometryTypeError(
         "sha2561", "raster", "sha2562", "vector"
@@ -190,7 +239,7 @@ def test_calculate_endpoint_invalid_intersection_geometry_type(monkeypatch) -> N
 def test_calculate_endpoint_invalid_intersection_file_types(monkeypatch) -> None:
     """Test the test_calculate_endpoint decorator with
     InvalidIntersectionFileTypesError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = InvalidIntersectionFileTypesError("sha2561", "raster", "sha2562", "vector")
 
@@ -203,7 +252,7 @@ def test_calculate_endpoint_invalid_intersection_file_types(monkeypatch) -> None
 
 def test_calculate_endpoint_intersection_with_self(monkeypatch) -> None:
     """Test the test_calculate_endpoint decorator with IntersectionWithSelfError."""
-    monkeypatch.setattr("pandarus_remote.utils.send_file", lambda *_, **__: "test")
+    monkeypatch.setattr("pandarus_remote.responses.send_file", lambda *_, **__: "test")
 
     error = IntersectionWithSelfError("sha2561")
 
@@ -212,3 +261,31 @@ def test_calculate_endpoint_intersection_with_self(monkeypatch) -> None:
         raise error
 
     assert _calculation_function() == ({"error": str(error)}, HTTPStatus.BAD_REQUEST)
+
+
+@pytest.mark.parametrize(
+    "error, status",
+    [
+        (UploadNotFoundError("upload_id"), HTTPStatus.NOT_FOUND),
+        (InvalidChunkError("upload_id", 0, "reason"), HTTPStatus.BAD_REQUEST),
+        (IncompleteUploadError("upload_id", [0]), HTTPStatus.CONFLICT),
+    ],
+)
+def test_upload_endpoint_errors(error: Exception, status: HTTPStatus) -> None:
+    """Test the upload_endpoint decorator with upload errors."""
+
+    @upload_endpoint
+    def _upload_function(upload_id: str) -> Tuple[Dict[str, Any], HTTPStatus]:
+        raise error
+
+    assert _upload_function(upload_id="upload_id") == ({"error": str(error)}, status)
+
+
+def test_upload_endpoint() -> None:
+    """Test the upload_endpoint decorator."""
+
+    @upload_endpoint
+    def _upload_function(upload_id: str) -> Tuple[Dict[str, Any], HTTPStatus]:
+        return {"upload_id": upload_id}, HTTPStatus.OK
+
+    assert _upload_function("test") == ({"upload_id": "test"}, HTTPStatus.OK)